@@ -0,0 +1,253 @@
+"""Measures the whole SDK stack (messages, encoding, connection pool, retries, login) against an in-process fake API.
+
+Scenarios:
+  single         simple_email calls one after another
+  batch          one large batch sent with execute() in concurrent chunks
+  adaptive       a large batch sent with adaptive_send(), the API slows down with larger batches and rejects
+                 more than 800 messages with 413
+  fanout         many coroutines calling simple_email at once
+  coalesced      the same fan-out with coalescing, simple_email calls within 2 ms share a request
+  faults         fan-out with 500s and 429s, recovered by the retry policy
+  refresh_storm  concurrent OAuth2 requests every time the token expires, should log in once per round
+
+Every scenario reports emails/s, p50/p99 latency of a single operation and the peak memory allocated while it
+runs (measured with tracemalloc in a separate run, so it doesn't slow down the timed one).
+
+Results can be saved and compared with a later run, which exits with 1 when throughput or p99 latency
+got worse by more than the tolerance:
+
+  python -m benchmarks.bench_fake_api --save baseline.json
+  python -m benchmarks.bench_fake_api --compare baseline.json
+
+Run with: python -m benchmarks.bench_fake_api [scenario ...]
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import sys
+import time
+import tracemalloc
+
+from coresender import errors
+from coresender.batching import AdaptiveBatching
+from coresender.requests.core import CoresenderClient
+from coresender.requests.send import SendEmail
+from coresender.retry import RetryPolicy
+
+from .fake_api import FakeApi
+
+
+SINGLE_EMAILS = 500
+BATCH_EMAILS = 20000
+BATCH_CHUNK_SIZE = 500
+FANOUT_EMAILS = 2000
+STORM_ROUNDS = 20
+STORM_REQUESTS = 200
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def _timed(latencies: list, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        latencies.append(time.perf_counter() - started)
+
+
+async def _simple_email(client: CoresenderClient, idx: int):
+    return await SendEmail(client=client).simple_email(
+        'sender@example.com', 'recipient-%d@example.net' % idx, 'Order %d confirmed' % idx, 'Thank you for your order.')
+
+
+async def run_single(api: FakeApi, client: CoresenderClient, size: int) -> dict:
+    latencies = []
+    for idx in range(size):
+        await _timed(latencies, _simple_email(client, idx))
+    return {'emails': size, 'latencies': latencies}
+
+
+async def run_batch(api: FakeApi, client: CoresenderClient, size: int) -> dict:
+    rq = SendEmail(client=client)
+    for idx in range(size):
+        rq.add_to_batch(
+            from_email='newsletter@example.com', from_name='Example Shop',
+            to_email='recipient-%d@example.net' % idx, subject='Our weekly offer',
+            body_text='Hello,\nsee our weekly offer at https://example.com/', custom_id='campaign-%08d' % idx,
+        )
+
+    # latency of every chunk request
+    latencies = []
+    client.context.trace_hook = lambda event, fields: latencies.append(fields['elapsed']) if event == 'chunk_end' else None
+    await rq.execute(chunk_size=BATCH_CHUNK_SIZE)
+    return {'emails': size, 'latencies': latencies}
+
+
+async def run_adaptive(api: FakeApi, client: CoresenderClient, size: int) -> dict:
+    messages = [
+        {'from_email': 'newsletter@example.com', 'to_email': 'recipient-%d@example.net' % idx, 'subject': 'Our weekly offer',
+         'body_text': 'Hello,\nsee our weekly offer at https://example.com/', 'custom_id': 'campaign-%08d' % idx}
+        for idx in range(size)
+    ]
+    batching = AdaptiveBatching(batch_size=50, max_batch_size=2000, concurrency=2, target_latency=0.05)
+
+    latencies = []
+    client.context.trace_hook = lambda event, fields: latencies.append(fields['elapsed']) if event == 'request_end' else None
+    async for _ in SendEmail(client=client).adaptive_send(messages, batching=batching):
+        pass
+    return {'emails': size, 'latencies': latencies, 'batching': batching.get_state()}
+
+
+async def run_fanout(api: FakeApi, client: CoresenderClient, size: int) -> dict:
+    latencies = []
+    results = await asyncio.gather(
+        *[_timed(latencies, _simple_email(client, idx)) for idx in range(size)], return_exceptions=True)
+    failures = sum(1 for result in results if isinstance(result, errors.CoresenderError))
+    return {'emails': size - failures, 'latencies': latencies, 'failures': failures}
+
+
+async def run_coalesced(api: FakeApi, client: CoresenderClient, size: int) -> dict:
+    client.context.coalesce_window = 0.002
+    return await run_fanout(api, client, size)
+
+
+async def run_refresh_storm(api: FakeApi, client: CoresenderClient, size: int) -> dict:
+    ctx = client.context
+    ctx.token_auto_refresh = False
+    url = 'http://127.0.0.1:%d/v1/send_email' % api.port
+    payload = [{'from': {'email': 'sender@example.com'}, 'to': [{'email': 'recipient@example.net'}], 'subject': 'test', 'body': {'text': 'Hello'}}]
+
+    latencies = []
+    for _ in range(STORM_ROUNDS):
+        # every request of the round finds the token expired at once
+        api.expire_tokens()
+        if ctx.token:
+            ctx.token.expires_on = datetime.datetime.now()
+        await asyncio.gather(*[
+            _timed(latencies, client.send('POST', url, payload, {'oauth2_token_required': True, 'emails': 1}))
+            for _ in range(size)
+        ])
+
+    return {'emails': STORM_ROUNDS * size, 'latencies': latencies, 'logins': api.logins, 'rounds': STORM_ROUNDS}
+
+
+SCENARIOS = {
+    'single': (run_single, SINGLE_EMAILS, {}),
+    'batch': (run_batch, BATCH_EMAILS, {}),
+    'adaptive': (run_adaptive, BATCH_EMAILS, {'latency_per_email': 0.00005, 'max_batch_emails': 800}),
+    'fanout': (run_fanout, FANOUT_EMAILS, {}),
+    'coalesced': (run_coalesced, FANOUT_EMAILS, {}),
+    'faults': (run_fanout, FANOUT_EMAILS, {'error_rate': 0.05, 'throttle_rate': 0.05}),
+    'refresh_storm': (run_refresh_storm, STORM_REQUESTS, {}),
+}
+
+
+async def run(name: str, latency: float, scale: float = 1.0, trace_memory: bool = False) -> dict:
+    scenario, size, api_options = SCENARIOS[name]
+    size = max(1, int(size * scale))
+
+    async with FakeApi(latency=latency, **api_options) as api:
+        ctx = api.create_context()
+        ctx.retry_policy = RetryPolicy(max_attempts=5, backoff_factor=0.01, backoff_max=0.1)
+        client = CoresenderClient(ctx)
+
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            result = await scenario(api, client, size)
+            elapsed = time.perf_counter() - started
+            if trace_memory:
+                _, result['memory_peak'] = tracemalloc.get_traced_memory()
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            await client.aclose()
+
+        result['requests'] = sum(api.requests.values())
+        result['connections'] = api.connections
+
+    latencies = result.pop('latencies')
+    result.update({
+        'elapsed': elapsed,
+        'emails_per_second': result['emails'] / elapsed,
+        'latency_p50': _percentile(latencies, 50),
+        'latency_p99': _percentile(latencies, 99),
+    })
+    return result
+
+
+async def measure(name: str, latency: float, scale: float = 1.0) -> dict:
+    result = await run(name, latency, scale)
+    result['memory_peak'] = (await run(name, latency, scale, trace_memory=True))['memory_peak']
+    return result
+
+
+def _print_result(name: str, result: dict) -> None:
+    extra = ''
+    if 'failures' in result:
+        extra += '   failures %d' % result['failures']
+    if 'batching' in result:
+        extra += '   batch_size %(batch_size)d concurrency %(concurrency)d' % result['batching']
+    if 'logins' in result:
+        extra += '   logins %d in %d rounds' % (result['logins'], result['rounds'])
+    print('%-14s %9.0f emails/s   p50 %7.1f ms   p99 %7.1f ms   memory %6.1f MB   requests %d%s' % (
+        name, result['emails_per_second'], result['latency_p50'] * 1000, result['latency_p99'] * 1000,
+        result['memory_peak'] / 2 ** 20, result['requests'], extra,
+    ))
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    ok = True
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        throughput = result['emails_per_second'] / base['emails_per_second'] - 1
+        p99 = result['latency_p99'] / base['latency_p99'] - 1 if base['latency_p99'] else 0.0
+        regressed = throughput < -tolerance or p99 > tolerance
+        ok = ok and not regressed
+        print('%-14s throughput %+6.1f%%   p99 %+6.1f%%%s' % (name, throughput * 100, p99 * 100, '   REGRESSION' if regressed else ''))
+    return ok
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks the SDK against an in-process fake Coresender API')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run, all by default: %s' % ', '.join(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.002, help='server latency in seconds')
+    parser.add_argument('--save', help='save results to a JSON file')
+    parser.add_argument('--compare', help='compare results with a JSON file saved earlier')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario: %s' % name)
+
+    print('server latency %.1f ms' % (args.latency * 1000))
+    results = {}
+    for name in args.scenarios or list(SCENARIOS):
+        results[name] = await measure(name, args.latency)
+        _print_result(name, results[name])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
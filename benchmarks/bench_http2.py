@@ -0,0 +1,188 @@
+"""Compares concurrent send_email calls over HTTP/1.1 and HTTP/2 against an in-process TLS stand-in server.
+
+The server negotiates h2 or http/1.1 with ALPN, answers every request after a fixed latency and counts
+the connections it accepted. A self-signed certificate is generated with the openssl command.
+
+Run with: python -m benchmarks.bench_http2
+"""
+
+import asyncio
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import time
+
+import h11
+import h2.config
+import h2.connection
+import h2.events
+
+from coresender.context import CoresenderContext
+from coresender.requests.core import CoresenderClient
+
+
+REQUESTS = 2000
+CONCURRENCY = (8, 64)
+LATENCY = 0.005
+
+RESPONSE = json.dumps({'data': [{'message_id': '7d6f1c5e', 'custom_id': None, 'status': 'accepted', 'errors': None}]}).encode()
+PAYLOAD = [{'from': {'email': 'sender@example.com'}, 'to': [{'email': 'recipient@example.net'}], 'subject': 'test', 'body': {'text': 'Hello'}}]
+
+
+class StandInServer:
+    def __init__(self, certfile: str, keyfile: str):
+        self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.ssl_context.load_cert_chain(certfile, keyfile)
+        self.ssl_context.set_alpn_protocols(['h2', 'http/1.1'])
+        self.connections = 0
+        self.server = None
+        self.handlers = {}
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0, ssl=self.ssl_context)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        # closed connections end their handlers with EOF
+        for writer in self.handlers.values():
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self.handlers[asyncio.current_task()] = writer
+        try:
+            if writer.get_extra_info('ssl_object').selected_alpn_protocol() == 'h2':
+                await self.handle_h2(reader, writer)
+            else:
+                await self.handle_h11(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            self.handlers.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def handle_h11(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = h11.Connection(h11.SERVER)
+        while True:
+            event = conn.next_event()
+            if event is h11.NEED_DATA:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                conn.receive_data(data)
+            elif isinstance(event, h11.EndOfMessage):
+                await asyncio.sleep(LATENCY)
+                headers = [('content-type', 'application/json'), ('content-length', str(len(RESPONSE)))]
+                writer.write(conn.send(h11.Response(status_code=200, headers=headers)))
+                writer.write(conn.send(h11.Data(data=RESPONSE)))
+                writer.write(conn.send(h11.EndOfMessage()))
+                await writer.drain()
+                conn.start_next_cycle()
+            elif isinstance(event, h11.ConnectionClosed):
+                return
+
+    async def handle_h2(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+
+        async def respond(stream_id: int):
+            await asyncio.sleep(LATENCY)
+            headers = [(':status', '200'), ('content-type', 'application/json'), ('content-length', str(len(RESPONSE)))]
+            conn.send_headers(stream_id, headers)
+            conn.send_data(stream_id, RESPONSE, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    asyncio.ensure_future(respond(event.stream_id))
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            writer.write(conn.data_to_send())
+
+
+def _create_certificate(directory: str):
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        [
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+            '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+            '-keyout', keyfile, '-out', certfile,
+        ],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return certfile, keyfile
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def run(server: StandInServer, url: str, http2: bool, concurrency: int):
+    ctx = CoresenderContext()
+    ctx.sending_account_id = 'bench'
+    ctx.sending_account_key = 'bench'
+    ctx.retry_policy = None
+    ctx.http2 = http2
+    # every HTTP/1.1 connection is kept open, so neither protocol pays for reconnects
+    ctx.pool_max_keepalive = ctx.pool_max_connections
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(client: CoresenderClient):
+        async with semaphore:
+            started = time.perf_counter()
+            await client.send('POST', url, PAYLOAD, {'api_key_required': True})
+            latencies.append(time.perf_counter() - started)
+
+    async with CoresenderClient(ctx) as client:
+        # warm-up, connection setup is not measured
+        await send(client)
+        latencies.clear()
+        connections = server.connections
+
+        started = time.perf_counter()
+        await asyncio.gather(*[send(client) for _ in range(REQUESTS)])
+        elapsed = time.perf_counter() - started
+
+    print('%-10s concurrency=%-4d %8.0f req/s   p50 %6.1f ms   p99 %6.1f ms   connections %d' % (
+        'HTTP/2' if http2 else 'HTTP/1.1', concurrency, REQUESTS / elapsed,
+        _percentile(latencies, 50) * 1000, _percentile(latencies, 99) * 1000,
+        server.connections - connections + 1,
+    ))
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = _create_certificate(directory)
+        # httpx verifies the server certificate against SSL_CERT_FILE
+        os.environ['SSL_CERT_FILE'] = certfile
+
+        server = StandInServer(certfile, keyfile)
+        port = await server.start()
+        url = 'https://localhost:%d/v1/send_email' % port
+
+        print('%d requests, %.0f ms server latency' % (REQUESTS, LATENCY * 1000))
+        for concurrency in CONCURRENCY:
+            for http2 in (False, True):
+                await run(server, url, http2, concurrency)
+
+        await server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""Compares JSON codecs on a 10k-message send_email payload with HTML bodies and on its response.
+
+Run with: python -m benchmarks.bench_json_codecs
+"""
+
+import timeit
+
+from coresender import codec
+from coresender.requests.send import SendEmail
+
+
+MESSAGES = 10000
+ROUNDS = 5
+
+HTML = ''.join(
+    '<tr><td class="item">Product %d – “Łódź” edition</td><td><a href="https://example.com/p/%d?utm_source=newsletter">Buy now</a></td></tr>' % (idx, idx)
+    for idx in range(20)
+)
+HTML = '<html><body><h1>Hello {{name}}</h1><table>%s</table><p>Unsubscribe: https://example.com/u</p></body></html>' % HTML
+
+
+def _get_payload() -> list:
+    return [
+        SendEmail._build_email(
+            from_email='newsletter@example.com', from_name='Example Shop',
+            to_email='recipient-%d@example.net' % idx, to_name='Recipient %d' % idx,
+            subject='Our weekly offer #%d' % idx,
+            body_html=HTML, body_text='Hello,\nsee our weekly offer at https://example.com/',
+            custom_id='campaign-42-%08d' % idx, custom_id_unique=True,
+            track_opens=True, track_click=True,
+        )
+        for idx in range(MESSAGES)
+    ]
+
+
+def _get_response() -> dict:
+    return {
+        'data': [
+            {'message_id': '7d6f1c5e-%08d' % idx, 'custom_id': 'campaign-42-%08d' % idx, 'status': 'accepted', 'errors': None}
+            for idx in range(MESSAGES)
+        ],
+    }
+
+
+def main():
+    payload = _get_payload()
+    response = codec.get_codec('json').dumps(_get_response())
+    print('%d messages, payload %d bytes, response %d bytes' % (MESSAGES, len(codec.get_codec('json').dumps(payload)), len(response)))
+    print('%-10s %14s %14s' % ('codec', 'encode [ms]', 'decode [ms]'))
+
+    for name in codec.available_codecs():
+        cdc = codec.get_codec(name)
+        encode = min(timeit.repeat(lambda: cdc.dumps(payload), number=ROUNDS, repeat=3)) / ROUNDS
+        decode = min(timeit.repeat(lambda: cdc.loads(response), number=ROUNDS, repeat=3)) / ROUNDS
+        print('%-10s %14.2f %14.2f' % (name, encode * 1000, decode * 1000))
+
+
+if __name__ == '__main__':
+    main()
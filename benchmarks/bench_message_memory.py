@@ -0,0 +1,68 @@
+"""Compares memory and wire size of SendEmail batches: Message objects vs. the previous nested dicts.
+
+Run with: python -m benchmarks.bench_message_memory
+"""
+
+import gc
+import tracemalloc
+
+from coresender.codec import get_codec
+from coresender.requests.send import SendEmail
+
+
+MESSAGES = 100000
+
+
+def _build_dict(idx: int) -> dict:
+    # the previous representation, built by SendEmail.add_to_batch
+    return {
+        "from": {"email": 'newsletter@example.com', "name": 'Example Shop'},
+        "to": [{'email': 'recipient-%d@example.net' % idx, 'name': None}],
+        "reply_to": [{'email': None, 'name': None}],
+        "subject": 'Our weekly offer',
+        "body": {"html": None, "text": 'Hello,\nsee our weekly offer at https://example.com/'},
+        "custom_id": 'campaign-42-%08d' % idx,
+        "custom_id_unique": False,
+        "track_opens": False,
+        "track_clicks": False,
+        "list_id": None,
+        "list_unsubscribe": None,
+    }
+
+
+def _build_message(idx: int):
+    return SendEmail._build_email(
+        from_email='newsletter@example.com', from_name='Example Shop',
+        to_email='recipient-%d@example.net' % idx,
+        subject='Our weekly offer',
+        body_text='Hello,\nsee our weekly offer at https://example.com/',
+        custom_id='campaign-42-%08d' % idx,
+    )
+
+
+def _measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    batch = [build(idx) for idx in range(MESSAGES)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del batch
+    return size
+
+
+def main():
+    codec = get_codec()
+    print('%d messages' % MESSAGES)
+    print('%-10s %14s %18s' % ('model', 'memory [MB]', 'bytes/message JSON'))
+
+    dict_memory = _measure(_build_dict)
+    dict_wire = len(codec.dumps([_build_dict(idx) for idx in range(1000)])) / 1000
+    print('%-10s %14.1f %18.0f' % ('dict', dict_memory / 2 ** 20, dict_wire))
+
+    message_memory = _measure(_build_message)
+    message_wire = len(codec.dumps([_build_message(idx).to_wire() for idx in range(1000)])) / 1000
+    print('%-10s %14.1f %18.0f' % ('Message', message_memory / 2 ** 20, message_wire))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compares decoding a 1k-entry send_email response once against the previous three-times path.
+
+Run with: python -m benchmarks.bench_response_decode
+"""
+
+import json
+import timeit
+
+import httpx
+
+from coresender import responses
+from coresender.http_error_handlers import decode_json, get_handler
+
+
+ENTRIES = 1000
+ROUNDS = 200
+
+
+def _get_response() -> httpx.Response:
+    data = {
+        'data': [
+            {
+                'message_id': '7d6f1c5e-%08d' % idx,
+                'custom_id': 'campaign-42-%08d' % idx,
+                'status': 'accepted',
+                'errors': None,
+            }
+            for idx in range(ENTRIES)
+        ],
+    }
+    rsp = httpx.Response(
+        200,
+        request=httpx.Request('POST', 'https://api.coresender.com/v1/send_email'),
+        headers={'Content-Type': 'application/json'},
+        content=json.dumps(data).encode(),
+    )
+    rsp.read()
+    return rsp
+
+
+def decode_per_consumer(rsp: httpx.Response) -> responses.SendEmail:
+    # every consumer parses the body again: error handler lookup and the response object
+    handler = get_handler(rsp)
+    if handler:
+        handler()
+    return responses.SendEmail(rsp.status_code, rsp.json())
+
+
+def decode_once(rsp: httpx.Response) -> responses.SendEmail:
+    data = decode_json(rsp)
+    handler = get_handler(rsp, data)
+    if handler:
+        handler()
+    return responses.SendEmail(rsp.status_code, data)
+
+
+def main():
+    rsp = _get_response()
+    print('send_email response with %d entries, %d bytes' % (ENTRIES, len(rsp.content)))
+
+    for func in (decode_per_consumer, decode_once):
+        elapsed = min(timeit.repeat(lambda: func(rsp), number=ROUNDS, repeat=5))
+        print('%-20s %8.3f ms per response' % (func.__name__, elapsed / ROUNDS * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Measures the per-request overhead of CoresenderClient.send, with a transport that answers at once.
+
+Compares precomputed headers and parsed URLs with the previous approach: a new httpx.Auth object per
+request that base64-encodes the credentials again in its auth flow, and a URL string that httpx parses again.
+
+Run with: python -m benchmarks.bench_send_overhead
+"""
+
+import asyncio
+import base64
+import time
+
+import httpx
+from httpx._dispatch.base import AsyncDispatcher
+
+from coresender.context import CoresenderContext
+from coresender.requests.core import CoresenderClient
+
+
+REQUESTS = 20000
+URL = 'https://api.coresender.com/v1/send_email'
+RESPONSE = b'{"data":[{"message_id":"7d6f1c5e","custom_id":null,"status":"accepted","errors":null}]}'
+
+
+class InstantDispatch(AsyncDispatcher):
+    async def send(self, request: httpx.Request, timeout=None) -> httpx.Response:
+        return httpx.Response(200, request=request, headers={'Content-Type': 'application/json'}, content=RESPONSE)
+
+
+class PerRequestAuth(httpx.Auth):
+    def __init__(self, sending_account_id: str, sending_account_key: str):
+        self.sending_account_id = sending_account_id
+        self.sending_account_key = sending_account_key
+
+    def auth_flow(self, request):
+        token = base64.b64encode(b'%s:%s' % (self.sending_account_id.encode(), self.sending_account_key.encode()))
+        request.headers['Authorization'] = 'Basic ' + token.decode()
+        yield request
+
+
+class PerRequestAuthClient(CoresenderClient):
+    async def _request(self, method, url, headers, body):
+        del headers['Authorization']
+        auth = PerRequestAuth(self._ctx.sending_account_id, self._ctx.sending_account_key)
+        return await self.http.request(method, str(url), headers=headers, data=body, auth=auth)
+
+
+def _get_client(client_class) -> CoresenderClient:
+    ctx = CoresenderContext()
+    ctx.sending_account_id = 'bench'
+    ctx.sending_account_key = 'bench'
+
+    client = client_class(ctx)
+    client._bind_loop()
+    client._http = httpx.AsyncClient(dispatch=InstantDispatch())
+    return client
+
+
+async def measure(client_class) -> float:
+    client = _get_client(client_class)
+    options = {'api_key_required': True}
+
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        await client.send('POST', URL, [], options)
+    elapsed = time.perf_counter() - started
+
+    await client.aclose()
+    return elapsed / REQUESTS
+
+
+async def main():
+    for client_class in (PerRequestAuthClient, CoresenderClient):
+        per_request = min([await measure(client_class) for _ in range(3)])
+        print('%-22s %7.1f us per send' % (client_class.__name__, per_request * 1000000))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""Compares encoding a batch that shares one large HTML body: per-message copies vs. a MessageTemplate.
+
+Run with: python -m benchmarks.bench_template_batch
+"""
+
+import timeit
+
+from coresender.codec import available_codecs, get_codec
+from coresender.message import Message, MessageBatch, MessageTemplate, Recipient
+
+
+RECIPIENTS = 1000
+BODY_SIZE = 50 * 1024
+ROUNDS = 3
+
+HTML = ('<p>Dear customer, see our “weekly” offer at <a href="https://example.com/offer">example.com</a></p>\n' * (BODY_SIZE // 100))[:BODY_SIZE]
+
+
+def _get_copied_batch() -> MessageBatch:
+    return MessageBatch([
+        Message(
+            'newsletter@example.com', [Recipient('recipient-%d@example.net' % idx)],
+            subject='Our weekly offer', body_html=HTML, custom_id='campaign-42-%08d' % idx, track_opens=True,
+        )
+        for idx in range(RECIPIENTS)
+    ])
+
+
+def _get_templated_batch() -> MessageBatch:
+    template = MessageTemplate(from_email='newsletter@example.com', subject='Our weekly offer', body_html=HTML, track_opens=True)
+    return MessageBatch([
+        Message(None, [Recipient('recipient-%d@example.net' % idx)], template=template, custom_id='campaign-42-%08d' % idx)
+        for idx in range(RECIPIENTS)
+    ])
+
+
+def main():
+    print('%d recipients, %d KB HTML body' % (RECIPIENTS, BODY_SIZE // 1024))
+    print('%-10s %-10s %14s %14s' % ('codec', 'batch', 'encode [ms]', 'size [MB]'))
+
+    copied = _get_copied_batch()
+    templated = _get_templated_batch()
+
+    for name in available_codecs():
+        codec = get_codec(name)
+        for label, batch in (('copied', copied), ('template', templated)):
+            size = len(batch.encode_json(codec))
+            elapsed = min(timeit.repeat(lambda: batch.encode_json(codec), number=ROUNDS, repeat=3)) / ROUNDS
+            print('%-10s %-10s %14.2f %14.1f' % (name, label, elapsed * 1000, size / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
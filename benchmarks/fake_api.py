@@ -0,0 +1,181 @@
+"""An in-process stand-in for the Coresender API, for benchmarks.
+
+Serves `/v1/send_email` and `/v1/login` over plain HTTP/1.1 with h11. Every request waits for `latency`
+(plus up to `latency_jitter` and `latency_per_email` for every message of a batch), then fails with 500 at `error_rate`, is throttled with 429 at `throttle_rate`,
+and rejects single messages at `reject_rate`. Batches larger than `max_batch_emails` get 413. Login issues tokens valid for `token_ttl` seconds, and
+send_email accepts them as well as the sending account credentials.
+"""
+
+import asyncio
+import base64
+import collections
+import itertools
+import json
+import random
+from typing import Optional
+
+import h11
+
+from coresender.context import CoresenderContext
+
+
+SENDING_ACCOUNT_ID = 'bench'
+SENDING_ACCOUNT_KEY = 'bench'
+USERNAME = 'bench@example.com'
+PASSWORD = 'bench'
+
+
+class FakeApi:
+    def __init__(self, *,
+        latency: float = 0.002, latency_jitter: float = 0.0, latency_per_email: float = 0.0, max_batch_emails: int = None,
+        error_rate: float = 0.0, throttle_rate: float = 0.0, retry_after: float = 0.01,
+        reject_rate: float = 0.0, token_ttl: int = 3600, seed: int = 0
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.latency_per_email = latency_per_email
+        self.max_batch_emails = max_batch_emails
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.reject_rate = reject_rate
+        self.token_ttl = token_ttl
+
+        self.requests = collections.Counter()
+        self.statuses = collections.Counter()
+        self.logins = 0
+        self.emails = 0
+        self.connections = 0
+
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._tokens = set()
+        self._basic_authorization = 'Basic ' + base64.b64encode(
+            ('%s:%s' % (SENDING_ACCOUNT_ID, SENDING_ACCOUNT_KEY)).encode()).decode()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers = {}
+        self.port = None
+
+    async def __aenter__(self) -> 'FakeApi':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.stop()
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        self._server.close()
+        # closed connections end their handlers with EOF
+        for writer in self._handlers.values():
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def create_context(self) -> CoresenderContext:
+        ctx = CoresenderContext()
+        ctx.sending_account_id = SENDING_ACCOUNT_ID
+        ctx.sending_account_key = SENDING_ACCOUNT_KEY
+        ctx.username = USERNAME
+        ctx.password = PASSWORD
+        ctx.api_proto = 'http'
+        ctx.api_host = '127.0.0.1'
+        ctx.api_port = self.port
+        return ctx
+
+    def expire_tokens(self) -> None:
+        self._tokens.clear()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._handlers[asyncio.current_task()] = writer
+        conn = h11.Connection(h11.SERVER)
+        request = None
+        body = bytearray()
+        try:
+            while True:
+                event = conn.next_event()
+                if event is h11.NEED_DATA:
+                    data = await reader.read(65536)
+                    if not data:
+                        return
+                    conn.receive_data(data)
+                elif isinstance(event, h11.Request):
+                    request = event
+                    body.clear()
+                elif isinstance(event, h11.Data):
+                    body += event.data
+                elif isinstance(event, h11.EndOfMessage):
+                    status, headers, content = await self._respond(request, bytes(body))
+                    self.statuses[status] += 1
+                    headers = headers + [('content-type', 'application/json'), ('content-length', str(len(content)))]
+                    writer.write(conn.send(h11.Response(status_code=status, headers=headers)))
+                    writer.write(conn.send(h11.Data(data=content)))
+                    writer.write(conn.send(h11.EndOfMessage()))
+                    await writer.drain()
+                    if conn.our_state is h11.MUST_CLOSE:
+                        return
+                    conn.start_next_cycle()
+                elif isinstance(event, h11.ConnectionClosed):
+                    return
+        except (ConnectionError, h11.RemoteProtocolError):
+            pass
+        finally:
+            self._handlers.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def _respond(self, request: h11.Request, body: bytes):
+        path = request.target.decode().split('?', 1)[0]
+        self.requests[path] += 1
+
+        emails = json.loads(body) if path == '/v1/send_email' else []
+        await asyncio.sleep(self.latency + self._random.random() * self.latency_jitter + len(emails) * self.latency_per_email)
+
+        if self._random.random() < self.throttle_rate:
+            return 429, [('retry-after', str(self.retry_after))], self._error(429, 'TOO_MANY_REQUESTS', 'Too many requests')
+        if self._random.random() < self.error_rate:
+            return 500, [], self._error(500, 'INTERNAL_ERROR', 'Internal server error')
+
+        if path == '/v1/login':
+            return self._login(json.loads(body))
+        if path == '/v1/send_email':
+            authorization = dict(request.headers).get(b'authorization', b'').decode()
+            if authorization != self._basic_authorization and authorization[len('Bearer '):] not in self._tokens:
+                return 401, [], self._error(401, 'UNAUTHORIZED', 'Unauthorized')
+            if self.max_batch_emails and len(emails) > self.max_batch_emails:
+                return 413, [], self._error(413, 'PAYLOAD_TOO_LARGE', 'Too many messages')
+            return self._send_email(emails)
+
+        return 404, [], self._error(404, 'NOT_FOUND', 'Not found')
+
+    @classmethod
+    def _error(cls, code: int, name: str, description: str) -> bytes:
+        return json.dumps({'data': {'code': name, 'errors': [{'code': code, 'description': description}]}}).encode()
+
+    def _login(self, data: dict):
+        self.logins += 1
+        if data.get('grant_type') == 'password' and (data.get('email'), data.get('password')) != (USERNAME, PASSWORD):
+            return 401, [], self._error(401, 'UNAUTHORIZED', 'Invalid credentials')
+
+        access_token = 'access-%d' % next(self._ids)
+        self._tokens.add(access_token)
+        return 200, [], json.dumps({
+            'access_token': access_token,
+            'refresh_token': 'refresh-%d' % next(self._ids),
+            'token_type': 'Bearer',
+            'expires_in': self.token_ttl,
+        }).encode()
+
+    def _send_email(self, emails: list):
+        self.emails += len(emails)
+        entries = []
+        for email in emails:
+            if self._random.random() < self.reject_rate:
+                entries.append({'message_id': None, 'custom_id': email.get('custom_id'), 'status': 'rejected', 'errors': 'Recipient rejected'})
+            else:
+                entries.append({'message_id': 'msg-%d' % next(self._ids), 'custom_id': email.get('custom_id'), 'status': 'accepted', 'errors': None})
+        return 200, [], json.dumps({'data': entries}).encode()
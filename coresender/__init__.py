@@ -1,41 +1,126 @@
-__all__ = ["init"]
+__all__ = ["init", "close", "create_client", "CoresenderClient", "RetryPolicy", "RateLimiter", "Message", "MessageTemplate", "Recipient", "Outbox"]
 __version__ = '1.1.1'
 
 import logging
 import os
+from typing import Callable
 
 from . import token
 from . import context
 from . import errors
+from . import instrumentation
+from .message import Message, MessageTemplate, Recipient
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
 from .requests import *
+from .requests.core import CoresenderApiRequest, CoresenderClient
+from .outbox import Outbox
 
 
 _logger = logging.getLogger('coresender')
 _logger.addHandler(logging.NullHandler())
 
 
-def init(
+def _create_context(
     *,
     sending_account_key: str = None, sending_account_id: str = None,
+    username: str = None, password: str = None,
+    token_storage: str = None, token_storage_params: dict = None,
     api_proto: str = None, api_host: str = None, api_port: int = None,
-    debug: bool = False):
+    timeout: float = None,
+    pool_max_keepalive: int = None, pool_max_connections: int = None, max_connections_per_host: int = None,
+    http2: bool = False,
+    token_auto_refresh: bool = True, token_refresh_margin: float = None,
+    retry_policy: RetryPolicy = None, rate_limiter: RateLimiter = None,
+    json_codec: str = None,
+    compression: str = None, compression_threshold: int = None,
+    trace_hook: Callable[[str, dict], None] = None, log_body_limit: int = None,
+    coalesce_window: float = None, coalesce_max_batch: int = None) -> context.CoresenderContext:
 
     ctx = context.CoresenderContext()
     ctx.sending_account_key = sending_account_key or os.environ.get('CORESENDER_SENDING_API_KEY')
     ctx.sending_account_id = sending_account_id or os.environ.get('CORESENDER_SENDING_API_ID')
+    ctx.username = username
+    ctx.password = password
+    if token_storage:
+        ctx.token_storage = token_storage
+        ctx.token_storage_params = token_storage_params or {}
+        ctx.token_storage_handler = token.get_storage_handler(token_storage)(ctx.token_storage_params)
+    ctx.token_auto_refresh = token_auto_refresh
+    if token_refresh_margin is not None:
+        ctx.token_refresh_margin = token_refresh_margin
     if not api_proto:
         ctx.api_proto = api_proto
     if api_host:
         ctx.api_host = api_host
     if api_port:
         ctx.api_port = api_port
+    if timeout:
+        ctx.timeout = timeout
+    if pool_max_keepalive is not None:
+        ctx.pool_max_keepalive = pool_max_keepalive
+    if pool_max_connections is not None:
+        ctx.pool_max_connections = pool_max_connections
+    if max_connections_per_host is not None:
+        ctx.max_connections_per_host = max_connections_per_host
+    ctx.http2 = http2
+    if retry_policy:
+        ctx.retry_policy = retry_policy
+    ctx.rate_limiter = rate_limiter
+    ctx.json_codec = json_codec
+    ctx.compression = compression
+    if compression_threshold is not None:
+        ctx.compression_threshold = compression_threshold
+    ctx.trace_hook = trace_hook
+    if log_body_limit is not None:
+        ctx.log_body_limit = log_body_limit
+    ctx.coalesce_window = coalesce_window
+    if coalesce_max_batch is not None:
+        ctx.coalesce_max_batch = coalesce_max_batch
+
+    return ctx
+
+
+def init(
+    *,
+    sending_account_key: str = None, sending_account_id: str = None,
+    username: str = None, password: str = None,
+    token_storage: str = None, token_storage_params: dict = None,
+    api_proto: str = None, api_host: str = None, api_port: int = None,
+    timeout: float = None,
+    pool_max_keepalive: int = None, pool_max_connections: int = None, max_connections_per_host: int = None,
+    http2: bool = False,
+    token_auto_refresh: bool = True, token_refresh_margin: float = None,
+    retry_policy: RetryPolicy = None, rate_limiter: RateLimiter = None,
+    json_codec: str = None,
+    compression: str = None, compression_threshold: int = None,
+    trace_hook: Callable[[str, dict], None] = None, log_body_limit: int = None,
+    coalesce_window: float = None, coalesce_max_batch: int = None,
+    debug: bool = False):
 
-    context.set_context(ctx)
+    params = dict(locals())
+    del params['debug']
+    context.set_context(_create_context(**params))
+    # the shared client is created again for the new context, the previous one stops refreshing its token
+    previous, CoresenderApiRequest._client = CoresenderApiRequest._client, None
+    if previous is not None:
+        previous.close_soon()
 
     if debug or os.environ.get('CORESENDER_DEBUG', '').lower() in ('yes', 'true', '1'):
         configure_debug_logger()
 
 
+def create_client(**kwargs) -> CoresenderClient:
+    # takes the same arguments as init(), except debug
+    return CoresenderClient(_create_context(**kwargs))
+
+
+async def close():
+    client = CoresenderApiRequest._client
+    if client:
+        await client.aclose()
+
+
 def configure_debug_logger():
     import sys
 
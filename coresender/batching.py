@@ -0,0 +1,84 @@
+__all__ = ['AdaptiveBatching']
+
+from typing import Optional
+
+import httpx
+
+
+# the batch is too large for the API to accept or to process within the timeout
+_too_large_statuses = (413, )
+# the API is overloaded, fewer requests should be in flight
+_overload_statuses = (429, 500, 502, 503, 504)
+
+
+class AdaptiveBatching:
+    def __init__(self, *,
+        batch_size: int = 100, min_batch_size: int = 1, max_batch_size: int = 1000, batch_size_step: int = 50,
+        concurrency: int = 2, max_concurrency: int = 16,
+        max_batch_bytes: int = 10 * 2 ** 20, min_batch_bytes: int = 64 * 1024,
+        target_latency: float = 2.0, decrease_factor: float = 0.5
+    ):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_size_step = batch_size_step
+        self.max_concurrency = max_concurrency
+        self.min_batch_bytes = min_batch_bytes
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+
+        self.batch_size = min(max(batch_size, min_batch_size), max_batch_size)
+        self.concurrency = min(max(concurrency, 1), max_concurrency)
+        self.max_batch_bytes = max_batch_bytes
+        # successful batches since concurrency was last increased
+        self._successes = 0
+
+    def __repr__(self):
+        return '<AdaptiveBatching batch_size=%s, concurrency=%s, max_batch_bytes=%s>' % (
+            self.batch_size, self.concurrency, self.max_batch_bytes)
+
+    def get_state(self) -> dict:
+        return {'batch_size': self.batch_size, 'concurrency': self.concurrency, 'max_batch_bytes': self.max_batch_bytes}
+
+    def on_success(self, emails: int, batch_bytes: int, latency: float) -> Optional[str]:
+        if latency > self.target_latency:
+            # the API takes longer with larger batches, they are made smaller before requests start timing out
+            self._successes = 0
+            return self._decrease_batch_size(emails) and 'latency'
+
+        changed = False
+        # only full batches show that the batch size can grow
+        if emails >= self.batch_size and self.batch_size < self.max_batch_size:
+            self.batch_size = min(self.batch_size + self.batch_size_step, self.max_batch_size)
+            changed = True
+
+        # one more request in flight after every round of successful requests, like the TCP congestion window
+        self._successes += 1
+        if self._successes >= self.concurrency and self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            self._successes = 0
+            changed = True
+
+        return 'increase' if changed else None
+
+    def on_error(self, exc: BaseException, emails: int, batch_bytes: int) -> Optional[str]:
+        self._successes = 0
+        status = getattr(exc, 'http_status', None)
+
+        if status in _too_large_statuses or (isinstance(exc, httpx.TimeoutException) and not isinstance(exc, httpx.PoolTimeout)):
+            if status == 413:
+                self.max_batch_bytes = max(int(batch_bytes * self.decrease_factor), self.min_batch_bytes)
+            self._decrease_batch_size(emails)
+            return 'too_large'
+
+        if status in _overload_statuses or isinstance(exc, (httpx.NetworkError, httpx.PoolTimeout, OSError)):
+            self.concurrency = max(int(self.concurrency * self.decrease_factor), 1)
+            return 'overload'
+
+        return None
+
+    def _decrease_batch_size(self, emails: int) -> bool:
+        batch_size = max(int(min(emails, self.batch_size) * self.decrease_factor), self.min_batch_size)
+        if batch_size == self.batch_size:
+            return False
+        self.batch_size = batch_size
+        return True
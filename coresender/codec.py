@@ -0,0 +1,115 @@
+__all__ = ['JsonCodec', 'get_codec', 'available_codecs']
+
+import importlib
+import json
+from typing import Any, Dict, List, Optional, Type
+
+from . import errors
+
+
+_codecs: Dict[str, Type['JsonCodec']] = {}
+_instances: Dict[str, 'JsonCodec'] = {}
+
+# fastest first, the first installed one is used by default
+_preference = ('orjson', 'msgspec', 'ujson', 'json')
+
+
+def available_codecs() -> List[str]:
+    return [name for name in _preference if name in _codecs and _codecs[name].is_available()]
+
+
+def get_codec(name: Optional[str] = None) -> 'JsonCodec':
+    if not name:
+        name = available_codecs()[0]
+
+    if name not in _instances:
+        try:
+            codec_class = _codecs[name]
+        except KeyError:
+            raise errors.CoresenderError("Unknown JSON codec: %s" % name)
+        if not codec_class.is_available():
+            raise errors.CoresenderError("JSON codec %s requires %s package to be installed" % (name, codec_class.module_name))
+
+        _instances[name] = codec_class()
+
+    return _instances[name]
+
+
+class JsonCodec:
+    module_name: str = None
+
+    def __init_subclass__(cls, codec_name: str, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        global _codecs
+        _codecs[codec_name] = cls
+        cls.name = codec_name
+
+    def __init__(self):
+        self._module = importlib.import_module(self.module_name)
+
+    def __repr__(self):
+        return '<JsonCodec %s>' % self.name
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            importlib.import_module(cls.module_name)
+        except ImportError:
+            return False
+        return True
+
+    def dumps(self, data: Any) -> bytes:
+        raise NotImplementedError()
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError()
+
+
+class StdlibJsonCodec(JsonCodec, codec_name='json'):
+    module_name = 'json'
+
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec, codec_name='orjson'):
+    module_name = 'orjson'
+
+    def dumps(self, data: Any) -> bytes:
+        return self._module.dumps(data)
+
+    def loads(self, data: bytes) -> Any:
+        return self._module.loads(data)
+
+
+class UjsonCodec(JsonCodec, codec_name='ujson'):
+    module_name = 'ujson'
+
+    def dumps(self, data: Any) -> bytes:
+        return self._module.dumps(data, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+
+    def loads(self, data: bytes) -> Any:
+        return self._module.loads(data)
+
+
+class MsgspecCodec(JsonCodec, codec_name='msgspec'):
+    module_name = 'msgspec'
+
+    def __init__(self):
+        super().__init__()
+        self._encoder = self._module.json.Encoder()
+        self._decoder = self._module.json.Decoder()
+
+    def dumps(self, data: Any) -> bytes:
+        return self._encoder.encode(data)
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return self._decoder.decode(data)
+        except self._module.DecodeError as exc:
+            # same contract as the other codecs
+            raise ValueError(str(exc)) from exc
@@ -0,0 +1,81 @@
+__all__ = ['Compressor', 'get_compressor', 'available_compressions']
+
+import gzip
+import importlib
+from typing import Dict, List, Optional, Type
+
+from . import errors
+
+
+_compressors: Dict[str, Type['Compressor']] = {}
+_instances: Dict[str, 'Compressor'] = {}
+
+# best ratio and speed first, used for `auto`
+_preference = ('zstd', 'gzip')
+
+
+def available_compressions() -> List[str]:
+    return [name for name in _preference if name in _compressors and _compressors[name].is_available()]
+
+
+def get_compressor(name: str) -> 'Compressor':
+    if name == 'auto':
+        name = available_compressions()[0]
+
+    if name not in _instances:
+        try:
+            compressor_class = _compressors[name]
+        except KeyError:
+            raise errors.CoresenderError("Unknown compression: %s" % name)
+        if not compressor_class.is_available():
+            raise errors.CoresenderError("Compression %s requires %s package to be installed" % (name, compressor_class.module_name))
+
+        _instances[name] = compressor_class()
+
+    return _instances[name]
+
+
+class Compressor:
+    module_name: Optional[str] = None
+
+    def __init_subclass__(cls, encoding: str, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        global _compressors
+        _compressors[encoding] = cls
+        cls.encoding = encoding
+
+    def __repr__(self):
+        return '<Compressor %s>' % self.encoding
+
+    @classmethod
+    def is_available(cls) -> bool:
+        if not cls.module_name:
+            return True
+        try:
+            importlib.import_module(cls.module_name)
+        except ImportError:
+            return False
+        return True
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+
+class GzipCompressor(Compressor, encoding='gzip'):
+    level = 6
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level)
+
+
+class ZstdCompressor(Compressor, encoding='zstd'):
+    module_name = 'zstandard'
+    level = 3
+
+    def __init__(self):
+        self._module = importlib.import_module(self.module_name)
+
+    def compress(self, data: bytes) -> bytes:
+        # ZstdCompressor objects are not thread safe, compressions can run in executor threads concurrently
+        return self._module.ZstdCompressor(level=self.level).compress(data)
@@ -1,6 +1,9 @@
 __all__ = ["CoresenderContext", "get_context", "set_context"]
 
-from typing import Optional
+from typing import Callable, Optional
+
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
 
 
 _ctx: Optional['CoresenderContext'] = None
@@ -12,6 +15,9 @@ class CoresenderContext:
         self.token_storage = None
         self.token_storage_params = {}
         self.token_storage_handler = None
+        self.token_auto_refresh = True
+        self.token_refresh_margin = 60.0
+        self.token_refresh_retry_delay = 5.0
         self.username = None
         self.password = None
         self.sending_account_key = None
@@ -19,11 +25,28 @@ class CoresenderContext:
         self.api_proto = None
         self.api_host = None
         self.api_port = None
+        self.timeout = 30.0
+        self.pool_max_keepalive = 10
+        self.pool_max_connections = 100
+        self.max_connections_per_host = None
+        self.http2 = False
+        self.retry_policy: Optional[RetryPolicy] = RetryPolicy()
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.json_codec: Optional[str] = None
+        self.compression: Optional[str] = None
+        self.compression_threshold = 16 * 1024
+        self.compression_offload_threshold = 256 * 1024
+        self.log_body_limit = 1024
+        self.trace_hook: Optional[Callable[[str, dict], None]] = None
+        # simple_email calls within the window are sent in one request, None turns it off
+        self.coalesce_window: Optional[float] = None
+        self.coalesce_max_batch = 100
 
     def __repr__(self):
         return ('<CoresenderContext token="%s", token_storage="%s", username="%s", password="***", '
                'sending_account_id="%s", sending_account_key="***", api_proto="%s", api_host="%s", '
-                'api_port="%s">') % (
+                'api_port="%s", timeout="%s", pool_max_keepalive="%s", pool_max_connections="%s", '
+                'max_connections_per_host="%s", http2="%s">') % (
             self.token,
             self.token_storage,
             self.username,
@@ -31,6 +54,11 @@ class CoresenderContext:
             self.api_proto,
             self.api_host,
             self.api_port,
+            self.timeout,
+            self.pool_max_keepalive,
+            self.pool_max_connections,
+            self.max_connections_per_host,
+            self.http2,
         )
 
 
@@ -2,10 +2,33 @@ class CoresenderError(Exception):
     pass
 
 
+class BatchValidationError(CoresenderError):
+    def __init__(self, invalid: list):
+        # InvalidMessage instances, found before the batch was sent
+        self.invalid = invalid
+
+    def __str__(self):
+        return '%s invalid messages in the batch, first at index %s: %s' % (
+            len(self.invalid), self.invalid[0].index, '; '.join(self.invalid[0].errors))
+
+
+class PartialBatchError(CoresenderError):
+    def __init__(self, response, messages: list, exceptions: list):
+        # responses.SendEmail of the chunks that were sent, and the messages of the failed chunks
+        self.response = response
+        self.messages = messages
+        self.exceptions = exceptions
+
+    def __str__(self):
+        return '%s messages not sent in %s failed chunks: %s' % (
+            len(self.messages), len(self.exceptions), str(self.exceptions[0]) or repr(self.exceptions[0]))
+
+
 class CoresenderApiError(CoresenderError):
-    def __init__(self, response_code, msg):
+    def __init__(self, response_code, msg, http_status: int = None):
         self.response_code = response_code
         self.msg = msg
+        self.http_status = http_status
 
     def __str__(self):
         return self.msg
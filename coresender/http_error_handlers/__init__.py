@@ -1,17 +1,32 @@
-__all__ = ['get_handler']
+__all__ = ['get_handler', 'decode_json']
 
 import logging
-from typing import Callable, Optional
+from typing import Any, Callable, Optional
 
 import httpx
 
 from .. import errors
+from ..codec import JsonCodec
 
 _logger = logging.getLogger('coresender')
 _error_handlers = {}
+_not_decoded = object()
 
 
-def get_handler(rsp: httpx.Response) -> Optional[Callable[[], None]]:
+def decode_json(rsp: httpx.Response, codec: JsonCodec = None) -> Any:
+    try:
+        if codec is None:
+            return rsp.json()
+        return codec.loads(rsp.content)
+    except ValueError:
+        return None
+
+
+def get_handler(rsp: httpx.Response, data: Any = _not_decoded) -> Optional[Callable[[], None]]:
+    # `data` is the already decoded response body, so it's not parsed again here and in handlers
+    if data is _not_decoded:
+        data = decode_json(rsp)
+
     handler = None
     http_code = str(rsp.status_code)
     if http_code in _error_handlers:
@@ -21,7 +36,6 @@ def get_handler(rsp: httpx.Response) -> Optional[Callable[[], None]]:
     else:
         # if it's not json or there is no `code` key - both situations handle in same way
         try:
-            data = rsp.json()
             handler = _error_handlers.get(data['data']['code'], None)
         except:
             pass
@@ -32,7 +46,7 @@ def get_handler(rsp: httpx.Response) -> Optional[Callable[[], None]]:
     if not handler:
         return
 
-    return handler(rsp.status_code, rsp)
+    return handler(rsp.status_code, rsp, data)
 
 
 class ErrorHandler:
@@ -42,36 +56,41 @@ class ErrorHandler:
         global _error_handlers
         _error_handlers[cls.register_code] = cls
 
-    def __init__(self, http_code: int, rsp: httpx.Response):
+    def __init__(self, http_code: int, rsp: httpx.Response, data: Any):
         self._http_code = http_code
         self._rsp = rsp
+        self._data = data
 
 
 class ErrorHandlerDefault(ErrorHandler):
     register_code = 'default'
 
     def __call__(self):
-        data = self._rsp.json()
+        data = self._data
         _logger.error("Coresender API response code is %s and data: %s", self._http_code, data)
-        raise errors.CoresenderApiError(data['data']['code'], "Coresender API request failed, http status code: %s" % self._http_code)
+        try:
+            code = data['data']['code']
+        except (KeyError, TypeError):
+            code = None
+        raise errors.CoresenderApiError(code, "Coresender API request failed, http status code: %s" % self._http_code, self._http_code)
 
 
 class ErrorHandler401(ErrorHandler):
     register_code = '401'
 
     def __call__(self):
-        _logger.error("Coresender API authorization error: [%s] %s", self._http_code, self._rsp.json())
-        data = self._rsp.json()['data']['errors'][0]
+        _logger.error("Coresender API authorization error: [%s] %s", self._http_code, self._data)
+        data = self._data['data']['errors'][0]
 
-        raise errors.AuthorizationError(data['code'], data['description'])
+        raise errors.AuthorizationError(data['code'], data['description'], self._http_code)
 
 
 class ErrorHandler422(ErrorHandler):
     register_code = '422'
 
     def __call__(self):
-        _logger.error("Coresender API validation error: [%s] %s", self._http_code, self._rsp.json())
-        data = self._rsp.json()['data']
+        _logger.error("Coresender API validation error: [%s] %s", self._http_code, self._data)
+        data = self._data['data']
 
         msg = []
         for error in data['errors']:
@@ -80,7 +99,7 @@ class ErrorHandler422(ErrorHandler):
             if items:
                 msg[-1] += ': ' + ', '.join(items)
 
-        raise errors.ValidationError(data['code'], '. '.join(msg))
+        raise errors.ValidationError(data['code'], '. '.join(msg), self._http_code)
 
 
 class ErrorHandler409(ErrorHandler):
@@ -91,8 +110,8 @@ class ErrorHandler409(ErrorHandler):
     }
 
     def __call__(self):
-        _logger.error("Coresender API error: [%s] %s", self._http_code, self._rsp.json())
-        data = self._rsp.json()['data']
+        _logger.error("Coresender API error: [%s] %s", self._http_code, self._data)
+        data = self._data['data']
 
         # there can be messing 'code' in data or missing code in _exceptions, both handled in same way
         try:
@@ -101,4 +120,4 @@ class ErrorHandler409(ErrorHandler):
             exc_class = errors.ApiLogicError
 
         msg = ['%s: %s' % (error['code'], error['description']) for error in data['errors']]
-        raise exc_class(data['code'], '. '.join(msg))
+        raise exc_class(data['code'], '. '.join(msg), self._http_code)
@@ -0,0 +1,204 @@
+__all__ = ['ClientStats', 'combine_hooks', 'PrometheusHook', 'OpenTelemetryHook']
+
+import collections
+import importlib
+import logging
+from typing import Callable, Deque, Dict, Optional
+from urllib.parse import urlsplit
+
+from . import errors
+
+
+_logger = logging.getLogger('coresender')
+
+TraceHook = Callable[[str, dict], None]
+
+
+def _import(module_name: str, extra: str):
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        raise errors.CoresenderError("%s requires %s package to be installed (coresender[%s])" % (extra, module_name, extra))
+
+
+def _get_endpoint(url: str) -> str:
+    # the path only, so metric labels don't grow with hosts and query strings
+    return urlsplit(url).path
+
+
+def combine_hooks(*hooks: TraceHook) -> TraceHook:
+    def hook(event: str, fields: dict) -> None:
+        for h in hooks:
+            try:
+                h(event, fields)
+            except Exception:
+                _logger.exception("Coresender trace hook %r failed on %s event", h, event)
+
+    return hook
+
+
+class ClientStats:
+    def __init__(self, latency_samples: int = 1000):
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.statuses: Dict[int, int] = collections.Counter()
+        self.logins = 0
+        self.rate_limit_waits = 0
+        self.rate_limit_wait_time = 0.0
+        self.emails = 0
+        self.emails_accepted = 0
+        self.emails_rejected = 0
+        # operating point of adaptive batching, see SendEmail.adaptive_send
+        self.batch_size: Optional[int] = None
+        self.concurrency: Optional[int] = None
+        self.max_batch_bytes: Optional[int] = None
+        # recent send() latencies, for percentiles
+        self._latencies: Deque[float] = collections.deque(maxlen=latency_samples)
+
+    def on_event(self, event: str, fields: dict) -> None:
+        if event == 'request':
+            self.attempts += 1
+        elif event == 'request_end':
+            self.requests += 1
+            self._latencies.append(fields['elapsed'])
+            if fields['status_code'] is not None:
+                self.statuses[fields['status_code']] += 1
+            if fields['exception'] is not None:
+                self.failures += 1
+        elif event == 'retry':
+            self.retries += 1
+        elif event == 'login':
+            self.logins += 1
+        elif event == 'rate_limit_wait':
+            self.rate_limit_waits += 1
+            self.rate_limit_wait_time += fields['waited']
+        elif event == 'batch':
+            self.emails += fields['emails']
+            self.emails_accepted += fields['accepted']
+            self.emails_rejected += fields['rejected']
+        elif event == 'batching':
+            self.batch_size = fields['batch_size']
+            self.concurrency = fields['concurrency']
+            self.max_batch_bytes = fields['max_batch_bytes']
+
+    def latency_percentile(self, percent: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    @property
+    def acceptance_rate(self) -> Optional[float]:
+        if not self.emails:
+            return None
+        return self.emails_accepted / self.emails
+
+    def as_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'failures': self.failures,
+            'statuses': dict(self.statuses),
+            'logins': self.logins,
+            'rate_limit_waits': self.rate_limit_waits,
+            'rate_limit_wait_time': self.rate_limit_wait_time,
+            'emails': self.emails,
+            'emails_accepted': self.emails_accepted,
+            'emails_rejected': self.emails_rejected,
+            'acceptance_rate': self.acceptance_rate,
+            'batch_size': self.batch_size,
+            'concurrency': self.concurrency,
+            'max_batch_bytes': self.max_batch_bytes,
+            'latency_p50': self.latency_percentile(50),
+            'latency_p99': self.latency_percentile(99),
+        }
+
+    def __repr__(self):
+        return '<ClientStats requests=%s, failures=%s, retries=%s, emails=%s, emails_accepted=%s>' % (
+            self.requests, self.failures, self.retries, self.emails, self.emails_accepted,
+        )
+
+
+class PrometheusHook:
+    def __init__(self, registry=None, namespace: str = 'coresender'):
+        prometheus_client = _import('prometheus_client', 'prometheus')
+        kwargs = {'namespace': namespace}
+        if registry is not None:
+            kwargs['registry'] = registry
+
+        self.requests = prometheus_client.Counter(
+            'requests_total', 'Coresender API requests', ['endpoint', 'status'], **kwargs)
+        self.request_duration = prometheus_client.Histogram(
+            'request_duration_seconds', 'Coresender API request duration, with retries', ['endpoint'], **kwargs)
+        self.retries = prometheus_client.Counter(
+            'retries_total', 'Coresender API request retries', ['endpoint'], **kwargs)
+        self.logins = prometheus_client.Counter(
+            'logins_total', 'Coresender OAuth2 logins and token refreshes', ['grant_type'], **kwargs)
+        self.rate_limit_wait = prometheus_client.Counter(
+            'rate_limit_wait_seconds_total', 'Time requests waited for the rate limiter', **kwargs)
+        self.emails = prometheus_client.Counter(
+            'emails_total', 'Emails sent to Coresender API', ['result'], **kwargs)
+        self.batch_size = prometheus_client.Gauge(
+            'batch_size', 'Batch size chosen by adaptive batching', **kwargs)
+        self.concurrency = prometheus_client.Gauge(
+            'concurrency', 'Requests in flight allowed by adaptive batching', **kwargs)
+
+    def __call__(self, event: str, fields: dict) -> None:
+        if event == 'request_end':
+            endpoint = _get_endpoint(fields['url'])
+            status = 'error' if fields['status_code'] is None else str(fields['status_code'])
+            self.requests.labels(endpoint, status).inc()
+            self.request_duration.labels(endpoint).observe(fields['elapsed'])
+        elif event == 'retry':
+            self.retries.labels(_get_endpoint(fields['url'])).inc()
+        elif event == 'login':
+            self.logins.labels(fields['grant_type']).inc()
+        elif event == 'rate_limit_wait':
+            self.rate_limit_wait.inc(fields['waited'])
+        elif event == 'batch':
+            self.emails.labels('accepted').inc(fields['accepted'])
+            self.emails.labels('rejected').inc(fields['rejected'])
+        elif event == 'batching':
+            self.batch_size.set(fields['batch_size'])
+            self.concurrency.set(fields['concurrency'])
+
+
+class OpenTelemetryHook:
+    def __init__(self, tracer=None):
+        self._trace = _import('opentelemetry.trace', 'opentelemetry')
+        self._tracer = tracer or self._trace.get_tracer('coresender')
+        # spans of send() calls in progress, by request_id
+        self._spans = {}
+
+    def __call__(self, event: str, fields: dict) -> None:
+        if event == 'request_start':
+            # started in the caller's task, so the span is a child of its current span
+            self._spans[fields['request_id']] = self._tracer.start_span(
+                'coresender %s %s' % (fields['method'], _get_endpoint(fields['url'])),
+                attributes={'http.method': fields['method'], 'http.url': fields['url'], 'coresender.emails': fields['emails']},
+            )
+            return
+
+        span = self._spans.get(fields.get('request_id'))
+        if span is None:
+            return
+
+        if event == 'retry':
+            span.add_event('retry', {'attempt': fields['attempt'], 'delay': fields['delay']})
+        elif event == 'rate_limit_wait':
+            span.add_event('rate_limit_wait', {'waited': fields['waited']})
+        elif event == 'request_end':
+            del self._spans[fields['request_id']]
+            span.set_attribute('coresender.attempts', fields['attempts'])
+            for name, value in fields['timings'].items():
+                span.set_attribute('coresender.timings.%s' % name, value)
+            if fields['status_code'] is not None:
+                span.set_attribute('http.status_code', fields['status_code'])
+            if fields['exception'] is not None:
+                span.record_exception(fields['exception'])
+            if fields['exception'] is not None or (fields['status_code'] or 0) >= 400:
+                span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+            span.end()
@@ -0,0 +1,236 @@
+__all__ = ['Recipient', 'MessageTemplate', 'Message', 'MessageBatch', 'encode_message', 'encode_messages']
+
+from typing import Dict, List, Optional
+
+from .codec import JsonCodec
+
+
+class Recipient:
+    __slots__ = ('email', 'name')
+
+    def __init__(self, email: str, name: str = None):
+        self.email = email
+        self.name = name
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Recipient':
+        return cls(data.get('email'), data.get('name'))
+
+    def to_wire(self) -> dict:
+        if self.name is None:
+            return {'email': self.email}
+        return {'email': self.email, 'name': self.name}
+
+    def __eq__(self, other):
+        return isinstance(other, Recipient) and self.email == other.email and self.name == other.name
+
+    def __repr__(self):
+        return '<Recipient email="%s", name="%s">' % (self.email, self.name)
+
+
+def _shared_to_wire(msg) -> dict:
+    # null and default values are left out, the API applies the same defaults
+    r = {}
+    if msg.from_email is not None:
+        sender = {'email': msg.from_email}
+        if msg.from_name is not None:
+            sender['name'] = msg.from_name
+        r['from'] = sender
+
+    reply_to = [recipient.to_wire() for recipient in msg.reply_to or () if recipient.email]
+    if reply_to:
+        r['reply_to'] = reply_to
+    if msg.subject is not None:
+        r['subject'] = msg.subject
+
+    body = {}
+    if msg.body_html is not None:
+        body['html'] = msg.body_html
+    if msg.body_text is not None:
+        body['text'] = msg.body_text
+    if body:
+        r['body'] = body
+
+    if msg.custom_id_unique:
+        r['custom_id_unique'] = True
+    if msg.track_opens:
+        r['track_opens'] = True
+    if msg.track_clicks:
+        r['track_clicks'] = True
+    if msg.list_id is not None:
+        r['list_id'] = msg.list_id
+    if msg.list_unsubscribe is not None:
+        r['list_unsubscribe'] = msg.list_unsubscribe
+
+    return r
+
+
+class MessageTemplate:
+    __slots__ = (
+        'from_email', 'from_name', 'reply_to', 'subject', 'body_html', 'body_text',
+        'custom_id_unique', 'track_opens', 'track_clicks', 'list_id', 'list_unsubscribe',
+        '_encoded',
+    )
+
+    def __init__(self, *,
+        from_email: str = None, from_name: str = None, reply_to: Optional[List[Recipient]] = None,
+        subject: str = None, body_html: str = None, body_text: str = None,
+        custom_id_unique: bool = False, track_opens: bool = False, track_clicks: bool = False,
+        list_id: str = None, list_unsubscribe: str = None
+    ):
+        self.from_email = from_email
+        self.from_name = from_name
+        self.reply_to = reply_to
+        self.subject = subject
+        self.body_html = body_html
+        self.body_text = body_text
+        self.custom_id_unique = custom_id_unique
+        self.track_opens = track_opens
+        self.track_clicks = track_clicks
+        self.list_id = list_id
+        self.list_unsubscribe = list_unsubscribe
+
+    def __setattr__(self, key, value):
+        # any change invalidates the encoded fragment
+        object.__setattr__(self, '_encoded', {})
+        object.__setattr__(self, key, value)
+
+    def to_wire(self) -> dict:
+        return _shared_to_wire(self)
+
+    def encoded_fields(self, codec: JsonCodec) -> bytes:
+        # JSON object members without the enclosing braces, encoded once and spliced into every message
+        encoded: Dict[str, bytes] = self._encoded
+        if codec.name not in encoded:
+            encoded[codec.name] = codec.dumps(self.to_wire())[1:-1]
+        return encoded[codec.name]
+
+    def __repr__(self):
+        return '<MessageTemplate from_email="%s", subject="%s">' % (self.from_email, self.subject)
+
+
+class Message:
+    __slots__ = (
+        'from_email', 'from_name', 'to', 'reply_to', 'subject', 'body_html', 'body_text',
+        'custom_id', 'custom_id_unique', 'track_opens', 'track_clicks', 'list_id', 'list_unsubscribe',
+        'template',
+    )
+
+    # fields that can come from the template
+    _shared_fields = tuple(field for field in MessageTemplate.__slots__ if not field.startswith('_'))
+
+    def __init__(self,
+        from_email: Optional[str], to: List[Recipient], *,
+        template: MessageTemplate = None,
+        from_name: str = None, reply_to: Optional[List[Recipient]] = None,
+        subject: str = None, body_html: str = None, body_text: str = None,
+        custom_id: str = None, custom_id_unique: Optional[bool] = None,
+        track_opens: Optional[bool] = None, track_clicks: Optional[bool] = None,
+        list_id: str = None, list_unsubscribe: str = None
+    ):
+        self.from_email = from_email
+        self.from_name = from_name
+        self.to = to
+        self.reply_to = reply_to
+        self.subject = subject
+        self.body_html = body_html
+        self.body_text = body_text
+        self.custom_id = custom_id
+        self.custom_id_unique = custom_id_unique
+        self.track_opens = track_opens
+        self.track_clicks = track_clicks
+        self.list_id = list_id
+        self.list_unsubscribe = list_unsubscribe
+        self.template = template
+
+    def get(self, field: str):
+        # None is unset, so False, '' and 0 override the template too
+        value = getattr(self, field)
+        if value is None and self.template is not None:
+            return getattr(self.template, field)
+        return value
+
+    def overrides_template(self) -> bool:
+        return any(getattr(self, field) is not None for field in self._shared_fields)
+
+    def _get_own_wire(self) -> dict:
+        r = {'to': [recipient.to_wire() for recipient in self.to]}
+        if self.custom_id is not None:
+            r['custom_id'] = self.custom_id
+        return r
+
+    def to_wire(self) -> dict:
+        r = _shared_to_wire(self if self.template is None else _ResolvedMessage(self))
+        r.update(self._get_own_wire())
+        return r
+
+    def __repr__(self):
+        return '<Message from_email="%s", to=%r, subject="%s", custom_id="%s">' % (self.from_email, self.to, self.subject, self.custom_id)
+
+
+class _ResolvedMessage:
+    __slots__ = ('_message', )
+
+    def __init__(self, message: Message):
+        self._message = message
+
+    def __getattr__(self, field):
+        return self._message.get(field)
+
+
+def encode_message(message: Message, codec: JsonCodec) -> bytes:
+    if message.template is None or message.overrides_template():
+        return codec.dumps(message.to_wire())
+
+    shared = message.template.encoded_fields(codec)
+    own = codec.dumps(message._get_own_wire())
+    if not shared:
+        return own
+    return own[:-1] + b',' + shared + b'}'
+
+
+def encode_messages(messages: List[Message], codec: JsonCodec) -> bytes:
+    # all pieces are joined at once, so shared content is copied only into the final buffer
+    parts = []
+    for message in messages:
+        parts.append(b',')
+        if message.template is None or message.overrides_template():
+            parts.append(codec.dumps(message.to_wire()))
+            continue
+
+        shared = message.template.encoded_fields(codec)
+        own = codec.dumps(message._get_own_wire())
+        if shared:
+            parts.extend((own[:-1], b',', shared, b'}'))
+        else:
+            parts.append(own)
+
+    if parts:
+        parts[0] = b'['
+    else:
+        parts.append(b'[')
+    parts.append(b']')
+    return b''.join(parts)
+
+
+class MessageBatch:
+    __slots__ = ('messages', 'encoded')
+
+    def __init__(self, messages: List[Message], encoded: List[bytes] = None):
+        self.messages = messages
+        # messages already encoded with encode_message, e.g. to measure the batch size before sending it
+        self.encoded = encoded
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def encode_json(self, codec: JsonCodec) -> bytes:
+        if self.encoded is not None:
+            return b'[' + b','.join(self.encoded) + b']'
+        return encode_messages(self.messages, codec)
@@ -0,0 +1,399 @@
+__all__ = ['Outbox', 'OutboxEntry']
+
+import asyncio
+import contextlib
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from . import errors
+from . import responses
+from . import sync
+from .codec import get_codec
+from .message import Message, encode_message
+from .requests.core import CoresenderClient
+from .requests.send import SendEmail
+
+
+_logger = logging.getLogger('coresender')
+
+# the request can't succeed if it's repeated, the batch is split to find the messages the API rejects
+_permanent_errors = (errors.ValidationError, errors.ApiLogicError)
+
+_schema = (
+    'CREATE TABLE IF NOT EXISTS outbox ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' payload BLOB NOT NULL,'
+    ' custom_id TEXT,'
+    ' custom_id_unique INTEGER NOT NULL DEFAULT 0,'
+    ' status TEXT NOT NULL,'
+    ' attempts INTEGER NOT NULL DEFAULT 0,'
+    # pending entries are not sent before, entries being sent are taken over by another flusher after
+    ' available_at REAL NOT NULL,'
+    ' message_id TEXT,'
+    ' errors TEXT,'
+    ' created_at REAL NOT NULL,'
+    ' updated_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS outbox_queue ON outbox (status, available_at, id)',
+)
+
+
+class OutboxEntry:
+    __slots__ = ('id', 'custom_id', 'status', 'attempts', 'message_id', 'errors')
+
+    def __init__(self, id: int, custom_id: Optional[str], status: str, attempts: int, message_id: Optional[str], errors: Optional[str]):
+        self.id = id
+        self.custom_id = custom_id
+        self.status = status
+        self.attempts = attempts
+        self.message_id = message_id
+        self.errors = errors
+
+    def __repr__(self):
+        r = ', '.join(['%s="%s"' % (item, getattr(self, item)) for item in self.__slots__])
+        r = '<OutboxEntry ' + r + '>'
+        return r
+
+
+class _QueuedMessage:
+    __slots__ = ('id', 'payload', 'custom_id', 'custom_id_unique')
+
+    def __init__(self, id: int, payload: bytes, custom_id: Optional[str], custom_id_unique: bool):
+        self.id = id
+        self.payload = payload
+        self.custom_id = custom_id
+        self.custom_id_unique = custom_id_unique
+
+
+class _SendQueuedMessages(SendEmail):
+    def encode_payload(self, payload: List[_QueuedMessage]) -> bytes:
+        # encoded when they were queued
+        return b'[' + b','.join(message.payload for message in payload) + b']'
+
+    def is_idempotent(self, payload: List[_QueuedMessage]) -> bool:
+        return bool(payload) and all(message.custom_id and message.custom_id_unique for message in payload)
+
+    async def send_queued(self,
+        messages: List[_QueuedMessage], classifier: responses.OutcomeClassifier = None
+    ) -> responses.SendEmail:
+        api_rsp = await self.send(data=messages)
+        return self._parse_response(api_rsp, classifier=classifier)
+
+
+class Outbox:
+    def __init__(self, path: str, *,
+        client: CoresenderClient = None,
+        batch_size: int = 500, max_batch_bytes: int = 5 * 2 ** 20, max_concurrency: int = 4,
+        flush_interval: float = 1.0, lease_timeout: float = 300.0,
+        retry_delay: float = 5.0, retry_delay_max: float = 300.0, max_attempts: Optional[int] = None,
+        classifier: responses.OutcomeClassifier = None
+    ):
+        self.path = pathlib.Path(path).expanduser()
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_concurrency = max_concurrency
+        self.flush_interval = flush_interval
+        self.lease_timeout = lease_timeout
+        self.retry_delay = retry_delay
+        self.retry_delay_max = retry_delay_max
+        self.max_attempts = max_attempts
+        # decides which per-message statuses are final
+        self.classifier = classifier or responses.default_classifier
+
+        self._request = _SendQueuedMessages(client=client)
+        self._codec = get_codec()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Future] = None
+        self._stopping = False
+        self._sending = set()
+
+    def __repr__(self):
+        return '<Outbox path="%s", batch_size=%s, max_concurrency=%s>' % (self.path, self.batch_size, self.max_concurrency)
+
+    async def __aenter__(self) -> 'Outbox':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.stop()
+
+    @contextlib.contextmanager
+    def _connection(self) -> sqlite3.Connection:
+        # one connection, shared by the caller threads and the executor threads of the flusher
+        with self._lock:
+            if self._conn is None:
+                conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None, check_same_thread=False)
+                conn.execute('PRAGMA journal_mode=WAL')
+                # every commit is on disk when add returns, NORMAL could lose the last ones on power loss
+                conn.execute('PRAGMA synchronous=FULL')
+                for statement in _schema:
+                    conn.execute(statement)
+                self._conn = conn
+            yield self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def add_to_batch(self, **kwargs) -> int:
+        return self.add_message(SendEmail._build_email(**kwargs))
+
+    def add_message(self, message: Message) -> int:
+        return self.add_messages([message])[0]
+
+    def add_messages(self, messages: Iterable[Message]) -> List[int]:
+        rows = []
+        for message in messages:
+            self._request._validate_email(message)
+            rows.append((encode_message(message, self._codec), message.custom_id, bool(message.get('custom_id_unique'))))
+
+        now = time.time()
+        with self._connection() as conn:
+            # one transaction and one fsync for all of them
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                ids = [
+                    conn.execute(
+                        'INSERT INTO outbox (payload, custom_id, custom_id_unique, status, available_at, created_at, updated_at)'
+                        ' VALUES (?, ?, ?, \'pending\', ?, ?, ?)', (payload, custom_id, custom_id_unique, now, now, now),
+                    ).lastrowid
+                    for payload, custom_id, custom_id_unique in rows
+                ]
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+        self._wake_up()
+        return ids
+
+    async def aadd_messages(self, messages: Iterable[Message]) -> List[int]:
+        # the write waits for fsync, it doesn't block the event loop
+        messages = list(messages)
+        return await asyncio.get_event_loop().run_in_executor(None, self.add_messages, messages)
+
+    async def aadd_message(self, message: Message) -> int:
+        return (await self.aadd_messages([message]))[0]
+
+    def get(self, entry_id: int) -> Optional[OutboxEntry]:
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT id, custom_id, status, attempts, message_id, errors FROM outbox WHERE id = ?', (entry_id, )).fetchone()
+        return OutboxEntry(*row) if row else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._connection() as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+    def purge(self, statuses: Iterable[str] = ('accepted', 'rejected', 'failed')) -> int:
+        statuses = list(statuses)
+        with self._connection() as conn:
+            cursor = conn.execute('DELETE FROM outbox WHERE status IN (%s)' % ','.join('?' * len(statuses)), statuses)
+        return cursor.rowcount
+
+    def _wake_up(self) -> None:
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _claim(self) -> List[_QueuedMessage]:
+        now = time.time()
+        with self._connection() as conn:
+            # taken in a write transaction, so flushers of other processes don't claim the same messages
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute(
+                    'SELECT id, payload, custom_id, custom_id_unique FROM outbox'
+                    ' WHERE status IN (\'pending\', \'sending\') AND available_at <= ? ORDER BY id LIMIT ?',
+                    (now, self.batch_size),
+                ).fetchall()
+
+                messages = []
+                batch_bytes = 2
+                for row in rows:
+                    batch_bytes += len(row[1]) + 1
+                    if messages and batch_bytes > self.max_batch_bytes:
+                        break
+                    messages.append(_QueuedMessage(*row))
+
+                conn.executemany(
+                    'UPDATE outbox SET status = \'sending\', attempts = attempts + 1, available_at = ?, updated_at = ? WHERE id = ?',
+                    [(now + self.lease_timeout, now, message.id) for message in messages],
+                )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+        return messages
+
+    def _format_errors(self, entry_errors) -> Optional[str]:
+        if not entry_errors:
+            return None
+        if isinstance(entry_errors, str):
+            return entry_errors
+        return self._codec.dumps(entry_errors).decode()
+
+    def _save_results(self, messages: List[_QueuedMessage], rsp: responses.SendEmail) -> None:
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # entries of the response are in the order of the sent messages
+                for message, entry in zip(messages, rsp.entries):
+                    entry_errors = self._format_errors(entry.errors)
+                    if entry.get_outcome(self.classifier) is responses.Outcome.transient:
+                        # deferred by the API, only accepted and rejected messages are done
+                        self._retry_later(conn, message.id, entry_errors or entry.status, now)
+                    else:
+                        conn.execute(
+                            'UPDATE outbox SET status = ?, message_id = ?, errors = ?, updated_at = ? WHERE id = ?',
+                            (entry.status, entry.message_id, entry_errors, now, message.id),
+                        )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def _save_failure(self, messages: List[_QueuedMessage], exc: Exception, permanent: bool) -> None:
+        now = time.time()
+        error = str(exc) or repr(exc)
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for message in messages:
+                    if permanent:
+                        conn.execute(
+                            'UPDATE outbox SET status = \'failed\', errors = ?, updated_at = ? WHERE id = ?', (error, now, message.id))
+                    else:
+                        self._retry_later(conn, message.id, error, now)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def _retry_later(self, conn: sqlite3.Connection, message_id: int, error: str, now: float) -> None:
+        attempts = conn.execute('SELECT attempts FROM outbox WHERE id = ?', (message_id, )).fetchone()[0]
+        if self.max_attempts and attempts >= self.max_attempts:
+            conn.execute(
+                'UPDATE outbox SET status = \'failed\', errors = ?, updated_at = ? WHERE id = ?', (error, now, message_id))
+        else:
+            delay = min(self.retry_delay * 2 ** (attempts - 1), self.retry_delay_max)
+            conn.execute(
+                'UPDATE outbox SET status = \'pending\', available_at = ?, errors = ?, updated_at = ? WHERE id = ?',
+                (now + delay, error, now, message_id),
+            )
+
+    async def _send(self, messages: List[_QueuedMessage]) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            rsp = await self._request.send_queued(messages, self.classifier)
+        except _permanent_errors as exc:
+            if len(messages) > 1:
+                # sent again in halves, so only the rejected messages fail
+                middle = len(messages) // 2
+                await self._send(messages[:middle])
+                await self._send(messages[middle:])
+                return
+            _logger.error("Outbox message %s rejected by Coresender API: %s", messages[0].id, exc)
+            await loop.run_in_executor(None, self._save_failure, messages, exc, True)
+            return
+        except Exception as exc:
+            _logger.warning("Cannot send %s outbox messages (%r), will retry", len(messages), exc)
+            await loop.run_in_executor(None, self._save_failure, messages, exc, False)
+            return
+
+        await loop.run_in_executor(None, self._save_results, messages, rsp)
+
+    async def flush(self) -> None:
+        # sends everything that is due now and waits for the results, messages waiting for a retry are not
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send(messages):
+            async with semaphore:
+                await self._send(messages)
+
+        tasks = []
+        while True:
+            await semaphore.acquire()
+            try:
+                messages = await loop.run_in_executor(None, self._claim)
+            finally:
+                semaphore.release()
+            if not messages:
+                break
+            tasks.append(asyncio.ensure_future(send(messages)))
+
+        await asyncio.gather(*tasks)
+
+    async def start(self) -> None:
+        if self._flusher is not None and not self._flusher.done():
+            return
+
+        self._loop = asyncio.get_event_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._flusher = asyncio.ensure_future(self._run())
+
+    def start_sync(self) -> None:
+        # the flusher runs in the background event loop thread of coresender.sync
+        sync.run(self.start())
+
+    async def stop(self) -> None:
+        flusher, self._flusher = self._flusher, None
+        self._loop = None
+        if flusher is not None:
+            # not cancelled, a claim cancelled while it's written would leave its messages to the lease timeout
+            self._stopping = True
+            self._wakeup.set()
+            await flusher
+
+        # batches in flight are finished, not abandoned until their lease expires
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def stop_sync(self) -> None:
+        sync.run(self.stop())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        def done(task):
+            self._sending.discard(task)
+            semaphore.release()
+
+        while not self._stopping:
+            await semaphore.acquire()
+            if self._stopping:
+                semaphore.release()
+                break
+            # cleared before claiming, so messages added meanwhile wake the flusher up again
+            self._wakeup.clear()
+            try:
+                messages = await loop.run_in_executor(None, self._claim)
+            except Exception as exc:
+                # e.g. the database is locked by another process, the slot is released below
+                _logger.exception("Cannot read outbox %s", self.path, exc_info=exc)
+                messages = []
+
+            if messages:
+                task = asyncio.ensure_future(self._send(messages))
+                self._sending.add(task)
+                task.add_done_callback(done)
+                continue
+
+            semaphore.release()
+            with contextlib.suppress(asyncio.TimeoutError):
+                # messages waiting for a retry and messages of other processes are picked up periodically
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
@@ -0,0 +1,140 @@
+__all__ = ['TokenBucket', 'RateLimiter']
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import httpx
+
+
+_logger = logging.getLogger('coresender')
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self._rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1.0))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def __repr__(self):
+        return '<TokenBucket rate=%s, capacity=%s>' % (self._rate, self.capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, value: float) -> None:
+        self._refill()
+        self._rate = float(value)
+
+    def reserve(self, amount: float = 1.0) -> float:
+        # tokens may go below zero: every caller reserves its share at once and waits for its turn,
+        # so queued requests are released at a steady pace in FIFO order
+        self._refill()
+        self._tokens -= amount
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self._rate
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        delay = self.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class RateLimiter:
+    def __init__(self, *,
+        requests_per_second: float = None, emails_per_second: float = None,
+        adaptive: bool = True, decrease_factor: float = 0.5, increase_ratio: float = 0.05, min_ratio: float = 0.05
+    ):
+        self.requests_per_second = requests_per_second
+        self.emails_per_second = emails_per_second
+        self.requests = TokenBucket(requests_per_second) if requests_per_second else None
+        self.emails = TokenBucket(emails_per_second) if emails_per_second else None
+        self.adaptive = adaptive
+        self.decrease_factor = decrease_factor
+        self.increase_ratio = increase_ratio
+        self.min_ratio = min_ratio
+        self._paused_until = 0.0
+
+    def __repr__(self):
+        return '<RateLimiter requests=%r, emails=%r>' % (self.requests, self.emails)
+
+    async def acquire(self, emails: int = 0) -> float:
+        waited = 0.0
+
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+            waited += pause
+
+        delay = 0.0
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1))
+        if self.emails and emails:
+            delay = max(delay, self.emails.reserve(emails))
+        if delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+
+        if waited:
+            _logger.debug("Rate limiter delayed request by %.3fs", waited)
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def on_response(self, rsp: httpx.Response) -> None:
+        if not self.adaptive:
+            return
+
+        if rsp.status_code == 429:
+            self._decrease()
+            retry_after = self._get_header_seconds(rsp, 'Retry-After')
+            if retry_after:
+                self.pause(retry_after)
+            return
+
+        remaining = self._get_header_seconds(rsp, 'X-RateLimit-Remaining')
+        reset = self._get_header_seconds(rsp, 'X-RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            if reset > 1e9:
+                # epoch timestamp instead of seconds left
+                reset = max(reset - time.time(), 0.0)
+            if remaining < 1:
+                self.pause(reset)
+            elif self.requests and reset > 0:
+                self.requests.rate = max(min(remaining / reset, self.requests_per_second), self.requests_per_second * self.min_ratio)
+            return
+
+        self._increase()
+
+    def _decrease(self) -> None:
+        for bucket, limit in ((self.requests, self.requests_per_second), (self.emails, self.emails_per_second)):
+            if bucket:
+                bucket.rate = max(bucket.rate * self.decrease_factor, limit * self.min_ratio)
+        _logger.info("Rate limited by Coresender API, slowing down to %r", self)
+
+    def _increase(self) -> None:
+        for bucket, limit in ((self.requests, self.requests_per_second), (self.emails, self.emails_per_second)):
+            if bucket and bucket.rate < limit:
+                bucket.rate = min(bucket.rate + limit * self.increase_ratio, limit)
+
+    @classmethod
+    def _get_header_seconds(cls, rsp: httpx.Response, name: str) -> Optional[float]:
+        value = rsp.headers.get(name)
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return None
@@ -1,56 +1,321 @@
-__all__ = ['LoginMethod', 'CoresenderClient', 'CoresenderApiRequest']
+__all__ = ['LoginMethod', 'ApiResponse', 'CoresenderClient', 'CoresenderApiRequest']
 
+import asyncio
 import base64
+import contextlib
+import contextvars
+import datetime
 import enum
+import itertools
 import logging
+import re
+import socket
+import threading
+import time
 from abc import abstractmethod
-from typing import Optional, Union
-from urllib.parse import quote_plus
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Union
+from urllib.parse import quote_plus, urlsplit
 
 import httpx
-
-from .. import __version__, errors
+from httpx._dispatch.connection import HTTPConnection
+from httpx._dispatch.connection_pool import ConnectionPool
+from httpx._dispatch.http2 import HTTP2Connection
+from httpx._models import Origin
+
+from .. import __version__, errors, sync
+from ..codec import JsonCodec, get_codec
+from ..compression import Compressor, get_compressor
+from ..instrumentation import ClientStats
 from ..token import OAuth2Token
 from ..context import CoresenderContext, get_context
-from ..http_error_handlers import get_handler as get_error_handler
+from ..http_error_handlers import decode_json, get_handler as get_error_handler
 
 
 _logger = logging.getLogger('coresender')
 _client: Optional['CoresenderClient'] = None
 
+_current_client: contextvars.ContextVar = contextvars.ContextVar('coresender_client', default=None)
+
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+# seconds between background token refreshes at least, even if the API issues very short-lived tokens
+_MIN_REFRESH_INTERVAL = 1.0
+
+_SECRET_HEADERS = frozenset(('authorization', 'proxy-authorization'))
+# also matches a value cut off by truncation
+_SECRET_FIELDS_RE = re.compile(rb'("(?:password|access_token|refresh_token)"\s*:\s*)"(?:[^"\\]|\\.)*(?:"|$)')
+
+
+def _redact_headers(headers: dict) -> dict:
+    return {name: ('***' if name.lower() in _SECRET_HEADERS else value) for name, value in headers.items()}
+
+
+def _format_body(body: Optional[bytes], limit: int, secrets: tuple = ()) -> str:
+    if not body:
+        return ''
+
+    text = _SECRET_FIELDS_RE.sub(rb'\1"***"', body[:limit])
+    for secret in secrets:
+        if secret:
+            text = text.replace(secret.encode(), b'***')
+
+    text = text.decode('utf-8', 'replace')
+    if len(body) > limit:
+        text += '... (%d bytes)' % len(body)
+    return text
+
 
 class LoginMethod(enum.Enum):
     oauth2 = 'oauth2'
     api_key = 'api_key'
 
 
-class CoresenderClientAuth(httpx.Auth):
-    def __init__(self,
-        oauth2_token_required: bool, api_key_required: bool,
-        access_token: str,
-        sending_account_key: str, sending_account_id: str
-    ):
-        self.oauth2_token_required = oauth2_token_required
-        self.api_key_required = api_key_required
-        self.access_token = access_token
-        self.sending_account_key = sending_account_key
-        self.sending_account_id = sending_account_id
+class ApiResponse:
+    __slots__ = ('http_response', 'data')
+
+    def __init__(self, http_response: httpx.Response, data: Any):
+        self.http_response = http_response
+        self.data = data
+
+    @property
+    def status_code(self) -> int:
+        return self.http_response.status_code
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self.http_response.headers
+
+    def json(self) -> Any:
+        return self.data
+
+    def __repr__(self):
+        return '<ApiResponse status_code=%s>' % (self.status_code, )
+
+
+class _HTTP2Connection(HTTP2Connection):
+    # httpx 0.12: a stream blocked on the socket read doesn't notice that another stream already
+    # received its events, and waits for more data until the read timeout. Streams take turns reading
+    # and check their events queue before every read.
+    async def wait_for_event(self, stream_id: int, timeout: httpx.Timeout):
+        if not hasattr(self, '_read_lock'):
+            self._read_lock = asyncio.Lock()
 
-    def auth_flow(self, request):
-        if self.oauth2_token_required:
-            request.headers['Authorization'] = 'Bearer ' + self.access_token
-            _logger.debug("Auth: using oauth2 token")
-        elif self.api_key_required:
-            token = base64.b64encode(b'%s:%s' % (self.sending_account_id.encode(), self.sending_account_key.encode()))
-            request.headers['Authorization'] = 'Basic ' + token.decode()
-            _logger.debug("Auth: using basic auth")
+        while not self.events[stream_id]:
+            async with self._read_lock:
+                if not self.events[stream_id]:
+                    await self.receive_events(timeout)
+        return self.events[stream_id].pop(0)
 
-        yield request
+
+class _HTTPConnection(HTTPConnection):
+    async def connect(self, timeout: httpx.Timeout):
+        connection = await super().connect(timeout)
+        if isinstance(connection, HTTP2Connection):
+            # nothing is sent until the first request, the negotiated socket is handed over as it is
+            connection = _HTTP2Connection(connection.socket, self.backend, on_release=connection.on_release)
+        return connection
+
+
+class _ConnectionPool(ConnectionPool):
+    # the HTTP/2 fix applies only to connections of this SDK's clients, other httpx users are not affected
+    async def acquire_connection(self, origin: Origin, timeout: httpx.Timeout = None) -> HTTPConnection:
+        connection = self.pop_connection(origin)
+
+        if connection is None:
+            pool_timeout = None if timeout is None else timeout.pool_timeout
+
+            await self.max_connections.acquire(timeout=pool_timeout)
+            connection = _HTTPConnection(
+                origin,
+                ssl=self.ssl,
+                backend=self.backend,
+                release_func=self.release_connection,
+                uds=self.uds,
+            )
+
+        self.active_connections.add(connection)
+
+        return connection
+
+
+def _get_running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class _LoopState:
+    # pooled connections and locks are bound to the event loop that created them
+    __slots__ = ('http', 'host_limits', 'login_lock')
+
+    def __init__(self):
+        self.http: Optional[httpx.AsyncClient] = None
+        self.host_limits: Dict[str, asyncio.Semaphore] = {}
+        self.login_lock: Optional[asyncio.Lock] = None
 
 
 class CoresenderClient:
     def __init__(self, ctx: CoresenderContext):
         self._ctx = ctx
+        # one connection pool per event loop, e.g. for async callers and the background loop of sync ones
+        self._loops: Dict[asyncio.AbstractEventLoop, _LoopState] = {}
+        self._loops_lock = threading.Lock()
+        self._refresh_task: Optional[asyncio.Future] = None
+        self._codec: Optional[JsonCodec] = None
+        self._compressor: Optional[Compressor] = None
+        self._static_headers = {
+            'User-Agent': 'coresender-sdk-python/%s' % __version__,
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+        }
+        # (credentials or token, header value), computed again only when they change
+        self._basic_authorization: Optional[tuple] = None
+        self._bearer_authorization: Optional[tuple] = None
+        self._parsed_urls: Dict[str, httpx.URL] = {}
+        self._request_ids = itertools.count(1)
+        self.stats = ClientStats()
+
+    @property
+    def context(self) -> CoresenderContext:
+        return self._ctx
+
+    @contextlib.contextmanager
+    def bind(self) -> Iterator['CoresenderClient']:
+        # requests sent in this block, and in tasks started from it, use this client
+        reset_token = _current_client.set(self)
+        try:
+            yield self
+        finally:
+            _current_client.reset(reset_token)
+
+    async def __aenter__(self) -> 'CoresenderClient':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.aclose()
+
+    def _bind_loop(self) -> _LoopState:
+        loop = asyncio.get_event_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            with self._loops_lock:
+                # pools of closed loops, e.g. of earlier asyncio.run() calls, can't be used anymore
+                released = [(closed, self._loops.pop(closed)) for closed in list(self._loops) if closed.is_closed()]
+                state = self._loops.setdefault(loop, _LoopState())
+            for closed, closed_state in released:
+                _logger.debug("Event loop closed, releasing its connection pool")
+                self._release_loop(closed, closed_state)
+        return state
+
+    def _release_loop(self, loop: asyncio.AbstractEventLoop, state: _LoopState) -> None:
+        self._cancel_refresh(loop)
+        http = state.http
+
+        if loop.is_closed():
+            # nothing runs on a closed loop anymore, e.g. after asyncio.run(), which has cancelled its tasks.
+            # The connections are shut down, their sockets are freed with the transports.
+            for transport in self._iter_transports(http):
+                sock = transport.get_extra_info('socket')
+                if sock is not None:
+                    with contextlib.suppress(OSError):
+                        sock.shutdown(socket.SHUT_RDWR)
+        elif loop.is_running():
+            # the loop runs in another thread
+            if http is not None:
+                asyncio.run_coroutine_threadsafe(http.aclose(), loop)
+        else:
+            for transport in self._iter_transports(http):
+                transport.abort()
+
+    def _cancel_refresh(self, loop: asyncio.AbstractEventLoop) -> None:
+        task = self._refresh_task
+        if task is None or task.get_loop() is not loop:
+            return
+
+        self._refresh_task = None
+        if loop.is_closed():
+            return
+        if loop.is_running() and loop is not _get_running_loop():
+            loop.call_soon_threadsafe(task.cancel)
+        else:
+            task.cancel()
+
+    @classmethod
+    def _iter_transports(cls, http: Optional[httpx.AsyncClient]) -> Iterator[asyncio.BaseTransport]:
+        if http is None:
+            return
+        for dispatch in (http.dispatch, *http.proxies.values()):
+            for store in (getattr(dispatch, 'keepalive_connections', ()), getattr(dispatch, 'active_connections', ())):
+                for connection in list(store):
+                    stream_writer = getattr(getattr(connection.connection, 'socket', None), 'stream_writer', None)
+                    if stream_writer is not None:
+                        yield stream_writer.transport
+
+    @property
+    def _http(self) -> Optional[httpx.AsyncClient]:
+        return self._bind_loop().http
+
+    @_http.setter
+    def _http(self, http: Optional[httpx.AsyncClient]) -> None:
+        self._bind_loop().http = http
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        state = self._bind_loop()
+
+        if state.http is None:
+            pool_limits = httpx.PoolLimits(
+                soft_limit=self._ctx.pool_max_keepalive,
+                hard_limit=self._ctx.pool_max_connections,
+            )
+            state.http = httpx.AsyncClient(
+                timeout=self._ctx.timeout,
+                pool_limits=pool_limits,
+                # negotiated with ALPN, servers without h2 support get HTTP/1.1
+                http2=self._ctx.http2,
+                dispatch=_ConnectionPool(pool_limits=pool_limits, http2=True, trust_env=True) if self._ctx.http2 else None,
+            )
+            _logger.debug("Connection pool created (http2=%s)", self._ctx.http2)
+
+        return state.http
+
+    def _get_host_limit(self, url: str) -> Optional[asyncio.Semaphore]:
+        if not self._ctx.max_connections_per_host:
+            return None
+
+        host_limits = self._bind_loop().host_limits
+        host = urlsplit(url).netloc
+        if host not in host_limits:
+            host_limits[host] = asyncio.Semaphore(self._ctx.max_connections_per_host)
+        return host_limits[host]
+
+    def close_soon(self) -> None:
+        # for synchronous callers: pools are closed on their loops, or shut down if a loop is gone
+        with self._loops_lock:
+            loops, self._loops = self._loops, {}
+
+        for loop, state in loops.items():
+            self._release_loop(loop, state)
+        if self._refresh_task is not None:
+            self._cancel_refresh(self._refresh_task.get_loop())
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_event_loop()
+        with self._loops_lock:
+            loops, self._loops = self._loops, {}
+
+        # pools of other loops are closed on their loops
+        for other_loop, state in loops.items():
+            if other_loop is not loop:
+                self._release_loop(other_loop, state)
+
+        if self._refresh_task is not None:
+            self._cancel_refresh(self._refresh_task.get_loop())
+        state = loops.get(loop)
+        if state is not None and state.http is not None:
+            await state.http.aclose()
+            _logger.debug("Connection pool closed")
 
     @classmethod
     def _url_encode(cls, params: dict) -> str:
@@ -76,64 +341,349 @@ class CoresenderClient:
                 url += sign + params
         return url
 
+    def login_sync(self, force: bool = False) -> None:
+        sync.run(self.login(force))
+
+    def _has_valid_token(self) -> bool:
+        return bool(self._ctx.token and self._ctx.token.is_valid())
+
+    @contextlib.asynccontextmanager
+    async def _token_lock(self) -> AsyncIterator[None]:
+        state = self._bind_loop()
+        if state.login_lock is None:
+            state.login_lock = asyncio.Lock()
+
+        # concurrent callers wait for the login in flight instead of sending their own,
+        # and shared token storages extend that to other processes
+        async with state.login_lock:
+            if self._ctx.token_storage_handler:
+                async with self._ctx.token_storage_handler.alock():
+                    yield
+            else:
+                yield
+
+    async def _reuse_stored_token(self, stale_token: Optional[OAuth2Token]) -> bool:
+        if not self._ctx.token_storage_handler:
+            return False
+
+        stored_token = await self._ctx.token_storage_handler.aread()
+        if not stored_token or not stored_token.is_valid():
+            return False
+        if stale_token and stored_token.access_token == stale_token.access_token:
+            return False
+
+        _logger.debug("Reusing OAuth2 token from token storage")
+        self._ctx.token = stored_token
+        self._schedule_token_refresh()
+        return True
+
     async def login(self, force: bool = False) -> None:
-        if self._ctx.token and self._ctx.token.is_valid() and not force:
+        if self._has_valid_token() and not force:
             _logger.debug("Reusing saved OAuth2 token")
             return
 
-        login = Login()
-        data = {
-            "grant_type": "password",
-            "email": self._ctx.username,
-            "password": self._ctx.password,
-        }
+        token = self._ctx.token
+        async with self._token_lock():
+            if self._ctx.token is not token and self._has_valid_token():
+                _logger.debug("Reusing OAuth2 token obtained by concurrent login")
+                return
+            if await self._reuse_stored_token(token):
+                return
+
+            await self._request_token({
+                "grant_type": "password",
+                "email": self._ctx.username,
+                "password": self._ctx.password,
+            })
+            _logger.info("Logged in as %s", self._ctx.username)
+
+        self._schedule_token_refresh()
+
+    async def refresh_token(self) -> None:
+        token = self._ctx.token
+        if not token or not token.refresh_token:
+            await self.login(force=True)
+            return
 
-        rsp = await self.send(login.api_method, login.get_full_url(), data)
-        json_response = rsp.json()
-        if 'access_token' in json_response:
-            self._ctx.token = OAuth2Token.from_rq_json(json_response)
-            _logger.info("Logged in as %s", data['email'])
+        async with self._token_lock():
+            # only the first process to take the lock refreshes, the others pick up its token
+            if self._ctx.token is not token and self._has_valid_token():
+                return
+            if await self._reuse_stored_token(token):
+                return
+
+            try:
+                await self._request_token({
+                    "grant_type": "refresh_token",
+                    "refresh_token": token.refresh_token,
+                })
+            except errors.AuthorizationError:
+                _logger.info("Refresh token rejected, logging in again")
+                await self._request_token({
+                    "grant_type": "password",
+                    "email": self._ctx.username,
+                    "password": self._ctx.password,
+                })
+            _logger.debug("OAuth2 token refreshed")
+
+    async def _request_token(self, data: dict) -> None:
+        login = Login(client=self)
+        started = time.perf_counter()
+        exception = None
+        try:
+            # repeating a login is harmless
+            rsp = await self.send(login.api_method, login.get_full_url(), data, {'idempotent': True})
+            json_response = rsp.data
+            if 'access_token' not in json_response:
+                raise errors.CoresenderError("Unrecognized response from Coresender API: [%s] %s" % (rsp.status_code, json_response))
+        except Exception as exc:
+            exception = exc
+            raise
+        finally:
+            self.emit('login', grant_type=data['grant_type'], elapsed=time.perf_counter() - started, exception=exception)
+
+        self._ctx.token = OAuth2Token.from_rq_json(json_response)
+
+        if self._ctx.token_storage_handler:
+            await self._ctx.token_storage_handler.asave(self._ctx.token)
+
+    def _schedule_token_refresh(self) -> None:
+        if not self._ctx.token_auto_refresh:
+            return
+        # one refresh task per client, on the loop that scheduled it first
+        task = self._refresh_task
+        if task is not None and not task.done() and not task.get_loop().is_closed():
+            return
 
-            self._ctx.token_storage_handler.save(self._ctx.token)
-        else:
-            raise errors.CoresenderError("Unrecognized response from Coresender API: [%s] %s" % (rsp.status_code, json_response))
+        self._refresh_task = asyncio.ensure_future(self._auto_refresh_token())
+
+    async def _auto_refresh_token(self) -> None:
+        # seconds the token got by the last refresh was valid for
+        lifetime = None
+        while self._ctx.token:
+            margin = self._ctx.token_refresh_margin
+            if lifetime is not None:
+                # a margin as long as the token lives would refresh it again right away, over and over
+                margin = min(margin, lifetime / 2)
+            delay = (self._ctx.token.expires_on - datetime.timedelta(seconds=margin) - datetime.datetime.now()).total_seconds()
+            await asyncio.sleep(max(delay, 0 if lifetime is None else _MIN_REFRESH_INTERVAL))
+
+            try:
+                await self.refresh_token()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                _logger.exception("Cannot refresh OAuth2 token", exc_info=exc)
+                await asyncio.sleep(self._ctx.token_refresh_retry_delay)
+                continue
+
+            if self._ctx.token:
+                lifetime = (self._ctx.token.expires_on - datetime.datetime.now()).total_seconds()
+
+    @property
+    def codec(self) -> JsonCodec:
+        if self._codec is None:
+            self._codec = get_codec(self._ctx.json_codec)
+        return self._codec
+
+    @property
+    def compressor(self) -> Optional[Compressor]:
+        if self._compressor is None and self._ctx.compression:
+            self._compressor = get_compressor(self._ctx.compression)
+        return self._compressor
+
+    async def _compress(self, body: bytes) -> bytes:
+        if len(body) < self._ctx.compression_offload_threshold:
+            return self.compressor.compress(body)
+        # zlib and zstd release the GIL, large bodies don't block the event loop
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.compressor.compress, body)
+
+    def _get_basic_authorization(self) -> str:
+        credentials = (self._ctx.sending_account_id, self._ctx.sending_account_key)
+        if self._basic_authorization is None or self._basic_authorization[0] != credentials:
+            token = base64.b64encode(b'%s:%s' % (credentials[0].encode(), credentials[1].encode()))
+            self._basic_authorization = (credentials, 'Basic ' + token.decode())
+        return self._basic_authorization[1]
+
+    def _get_bearer_authorization(self) -> str:
+        # a new token object is created on every login and refresh
+        token = self._ctx.token
+        if self._bearer_authorization is None or self._bearer_authorization[0] is not token:
+            self._bearer_authorization = (token, 'Bearer ' + token.access_token)
+        return self._bearer_authorization[1]
+
+    def _parse_url(self, url: str) -> httpx.URL:
+        # httpx parses and normalizes string URLs on every request, API endpoints are few
+        parsed = self._parsed_urls.get(url)
+        if parsed is None:
+            if len(self._parsed_urls) >= 256:
+                self._parsed_urls.clear()
+            parsed = self._parsed_urls[url] = httpx.URL(url)
+        return parsed
+
+    def _format_body(self, body: Optional[bytes]) -> str:
+        return _format_body(body, self._ctx.log_body_limit, (self._ctx.sending_account_key, self._ctx.password))
+
+    def emit(self, event: str, **fields) -> None:
+        self.stats.on_event(event, fields)
+
+        trace_hook = self._ctx.trace_hook
+        if trace_hook is None:
+            return
+        try:
+            trace_hook(event, fields)
+        except Exception:
+            _logger.exception("Coresender trace hook failed on %s event", event)
+
+    async def _request(self, method: str, url: str, headers: dict, body: Optional[bytes]) -> httpx.Response:
+        http = self.http
+        host_limit = self._get_host_limit(url)
+        if host_limit:
+            async with host_limit:
+                return await http.request(method, self._parse_url(url), headers=headers, data=body)
 
-    async def send(self, method: str, url: str, data: dict = None, options: dict = None) -> httpx.Response:
+        return await http.request(method, self._parse_url(url), headers=headers, data=body)
+
+    async def send(self, method: str, url: str, data: Any = None, options: dict = None) -> ApiResponse:
         if not options:
             options = {}
 
-        headers = {
-            'User-Agent': 'coresender-sdk-python/%s' % __version__,
-            'Accept': 'application/json',
+        url = self._build_url(url, options.get('query_params', {}))
+        record = {
+            'request_id': next(self._request_ids),
+            'attempts': 0,
+            'status_code': None,
+            'timings': {'login': 0.0, 'encode': 0.0, 'rate_limit': 0.0, 'network': 0.0, 'retry_wait': 0.0, 'decode': 0.0},
         }
-        auth = CoresenderClientAuth(
-            oauth2_token_required=options.get('oauth2_token_required', False),
-            api_key_required=options.get('api_key_required', False),
-            access_token=(self._ctx.token.access_token if self._ctx.token else None),
-            sending_account_key=self._ctx.sending_account_key,
-            sending_account_id=self._ctx.sending_account_id,
-        )
-
-        if auth.oauth2_token_required and not auth.access_token:
+        self.emit('request_start', request_id=record['request_id'], method=method, url=url, emails=options.get('emails', 0))
+
+        started = time.perf_counter()
+        exception = None
+        try:
+            return await self._send(method, url, data, options, record)
+        except BaseException as exc:
+            exception = exc
+            raise
+        finally:
+            self.emit(
+                'request_end', request_id=record['request_id'], method=method, url=url, attempts=record['attempts'],
+                status_code=record['status_code'], elapsed=time.perf_counter() - started, timings=record['timings'],
+                exception=exception,
+            )
+
+    async def _send(self, method: str, url: str, data: Any, options: dict, record: dict) -> ApiResponse:
+        request_id = record['request_id']
+        timings = record['timings']
+
+        oauth2_token_required = options.get('oauth2_token_required', False)
+        if oauth2_token_required and not self._has_valid_token():
+            started = time.perf_counter()
             await self.login()
-            auth.access_token = self._ctx.token.access_token
+            timings['login'] = time.perf_counter() - started
 
-        if 'headers' in options:
+        headers = self._static_headers.copy()
+        if options.get('headers'):
             headers.update(options['headers'])
 
-        url = self._build_url(url, options.get('query_params', {}))
-        _logger.debug("Sending %s to %s with headers %s and data %s", method, url, headers, data)
-
-        async with httpx.AsyncClient() as cl:
-            rsp = await cl.request(method, url, headers=headers, json=data, auth=auth)
-
-        _logger.debug("Coresender API response is [%s] %s", rsp.status_code, rsp.text)
-
-        error_handler = get_error_handler(rsp)
+        if oauth2_token_required:
+            headers['Authorization'] = self._get_bearer_authorization()
+        elif options.get('api_key_required', False):
+            headers['Authorization'] = self._get_basic_authorization()
+
+        # encoded once, retries send the same bytes
+        started = time.perf_counter()
+        body = None
+        if isinstance(data, bytes):
+            body = data
+        elif hasattr(data, 'encode_json'):
+            body = data.encode_json(self.codec)
+        elif data is not None:
+            body = self.codec.dumps(data)
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+
+        # checked once, so bodies are neither decoded nor formatted when debug logging is off
+        debug = _logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            _logger.debug("Sending %s to %s with headers %s and body %s", method, url, _redact_headers(headers), self._format_body(body))
+
+        raw_body = body
+        if body is not None and self.compressor and len(body) >= self._ctx.compression_threshold:
+            body = await self._compress(body)
+            headers['Content-Encoding'] = self.compressor.encoding
+        timings['encode'] = time.perf_counter() - started
+
+        retry_policy = self._ctx.retry_policy
+        rate_limiter = self._ctx.rate_limiter
+        idempotent = options.get('idempotent', method in IDEMPOTENT_METHODS)
+        attempt = 0
+        while True:
+            attempt += 1
+            record['attempts'] += 1
+            if rate_limiter:
+                waited = await rate_limiter.acquire(options.get('emails', 0))
+                if waited:
+                    timings['rate_limit'] += waited
+                    self.emit('rate_limit_wait', request_id=request_id, url=url, waited=waited)
+
+            self.emit('request', request_id=request_id, method=method, url=url, attempt=attempt, body_size=len(body) if body else 0)
+            started = time.perf_counter()
+            try:
+                rsp = await self._request(method, url, headers, body)
+            except Exception as exc:
+                elapsed = time.perf_counter() - started
+                timings['network'] += elapsed
+                self.emit('error', request_id=request_id, method=method, url=url, attempt=attempt, elapsed=elapsed, exception=exc)
+                if not retry_policy or not retry_policy.should_retry_exception(exc, attempt, idempotent):
+                    raise
+                delay = retry_policy.get_delay(attempt)
+                _logger.warning("Coresender API request failed (%r), retrying in %.2fs [attempt %s]", exc, delay, attempt)
+                self.emit('retry', request_id=request_id, url=url, attempt=attempt, delay=delay, status_code=None, exception=exc)
+                await asyncio.sleep(delay)
+                timings['retry_wait'] += delay
+                continue
+
+            elapsed = time.perf_counter() - started
+            timings['network'] += elapsed
+            record['status_code'] = rsp.status_code
+            self.emit(
+                'response', request_id=request_id, method=method, url=url, attempt=attempt, elapsed=elapsed,
+                status_code=rsp.status_code, http_version=rsp.http_version, body_size=len(rsp.content),
+            )
+            if debug:
+                _logger.debug("Coresender API response is [%s] %s", rsp.status_code, self._format_body(rsp.content))
+            if rsp.status_code == 415 and body is not raw_body:
+                # the API doesn't accept compressed bodies, don't try again
+                _logger.warning("Coresender API rejected %s request body, compression disabled", self.compressor.encoding)
+                self._ctx.compression = None
+                self._compressor = None
+                body = raw_body
+                del headers['Content-Encoding']
+                attempt -= 1
+                continue
+
+            if rate_limiter:
+                rate_limiter.on_response(rsp)
+
+            if not retry_policy or not retry_policy.should_retry_response(rsp, attempt, idempotent):
+                break
+            delay = retry_policy.get_delay(attempt, rsp)
+            _logger.warning("Coresender API response code is %s, retrying in %.2fs [attempt %s]", rsp.status_code, delay, attempt)
+            self.emit('retry', request_id=request_id, url=url, attempt=attempt, delay=delay, status_code=rsp.status_code, exception=None)
+            await asyncio.sleep(delay)
+            timings['retry_wait'] += delay
+
+        # decoded once here, handlers and responses get the parsed payload
+        started = time.perf_counter()
+        rsp_data = decode_json(rsp, self.codec)
+        timings['decode'] = time.perf_counter() - started
+
+        error_handler = get_error_handler(rsp, rsp_data)
         if error_handler:
             error_handler()
 
-        return rsp
+        return ApiResponse(rsp, rsp_data)
 
 
 class CoresenderApiRequest:
@@ -147,12 +697,16 @@ class CoresenderApiRequest:
     _login_method: LoginMethod = None
 
     _client: CoresenderClient = None
+    _bound_client: Optional[CoresenderClient] = None
+
+    def __init__(self, *, client: CoresenderClient = None):
+        self._bound_client = client
 
     @classmethod
     def client(cls) -> Optional[CoresenderClient]:
         if not cls._client:
-            ctx = get_context()
-            cls._client = CoresenderClient(ctx)
+            # shared by all request classes, so they share one connection pool
+            CoresenderApiRequest._client = CoresenderClient(get_context())
 
         return cls._client
 
@@ -160,7 +714,11 @@ class CoresenderApiRequest:
     def set_client(cls, client: CoresenderClient) -> None:
         cls._client = client
 
-    async def send(self, *, data: Union[list, dict] = None, qs: dict = None, headers: dict = None):
+    def get_client(self) -> CoresenderClient:
+        # passed to the request first, then bound with CoresenderClient.bind(), then the shared one
+        return self._bound_client or _current_client.get() or self.client()
+
+    async def send(self, *, data: Any = None, qs: dict = None, headers: dict = None) -> ApiResponse:
         query_params = self.get_query_params() or {}
         if qs:
             query_params.update(qs)
@@ -172,9 +730,11 @@ class CoresenderApiRequest:
             'oauth2_token_required': (self.login_required and self.login_method is LoginMethod.oauth2),
         }
 
-        query_data = data or self.to_json()
+        payload = data or self.get_payload()
+        options['idempotent'] = self.is_idempotent(payload)
+        options['emails'] = self.count_emails(payload)
 
-        api_rsp = await self.client().send(self._api_method, self.get_full_url(), query_data, options)
+        api_rsp = await self.get_client().send(self._api_method, self.get_full_url(), self.encode_payload(payload), options)
 
         return api_rsp
 
@@ -182,8 +742,12 @@ class CoresenderApiRequest:
     async def execute(self) -> 'CoresenderApiRequest':
         raise NotImplementedError()
 
+    def execute_sync(self, *args, **kwargs):
+        return sync.run(self.execute(*args, **kwargs))
+
     def get_full_url(self) -> str:
-        ctx = get_context()
+        # the host comes from the same client, and so context, as the credentials
+        ctx = self.get_client().context
         url_prefix = '%(proto)s://%(host)s:%(port)d/v%(version)s/%(uri)s' % {
             'proto': ctx.api_proto or self._api_proto,
             'host': ctx.api_host or self._api_host,
@@ -201,6 +765,18 @@ class CoresenderApiRequest:
     def get_query_params(self) -> dict:
         return {}
 
+    def get_payload(self) -> Any:
+        return self.to_json()
+
+    def encode_payload(self, payload: Any) -> Any:
+        return payload
+
+    def is_idempotent(self, payload: Any) -> bool:
+        return self._api_method in IDEMPOTENT_METHODS
+
+    def count_emails(self, payload: Any) -> int:
+        return 0
+
     @property
     def api_method(self) -> str:
         return self._api_method
@@ -1,11 +1,24 @@
 __all__ = ["BodyType", "SendEmail"]
 
+import asyncio
+import collections
 import enum
-from typing import List, Dict
+import time
+import weakref
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from .core import CoresenderApiRequest, LoginMethod
+from .core import ApiResponse, CoresenderApiRequest, CoresenderClient, LoginMethod
 from .. import responses
 from .. import errors
+from .. import sync
+from ..batching import AdaptiveBatching
+from ..message import Message, MessageBatch, MessageTemplate, Recipient, encode_message
+from ..retry import RetryPolicy
+from ..validation import BatchValidator, InvalidMessage
+
+
+# the API rejected the whole batch before processing it, so it can be sent again in smaller batches
+_unprocessed_statuses = (413, 429, 503)
 
 
 class BodyType(enum.Enum):
@@ -13,6 +26,88 @@ class BodyType(enum.Enum):
     html = 'html'
 
 
+class _Coalescer:
+    def __init__(self, client: CoresenderClient):
+        # weak, the coalescer is the value of a weak key dictionary keyed by the client
+        self._client = weakref.ref(client)
+        self._loop = asyncio.get_event_loop()
+        self._pending: List[Tuple[Message, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # the loop keeps only weak references to tasks
+        self._sending = set()
+
+    async def submit(self, email: Message) -> responses.SendEmailResponse:
+        future = self._loop.create_future()
+        self._pending.append((email, future))
+
+        ctx = self._client().context
+        if len(self._pending) >= ctx.coalesce_max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(ctx.coalesce_window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # callers cancelled while waiting don't send their emails
+        batch = [(email, future) for email, future in self._pending if not future.done()]
+        self._pending = []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: List[Tuple[Message, asyncio.Future]]) -> None:
+        client = self._client()
+        if client is None:
+            self._set_exception(batch, errors.CoresenderError("Client was garbage collected"))
+            return
+
+        rq = SendEmail(client=client)
+        try:
+            api_rsp = await rq.send(data=[email for email, _ in batch])
+            rsp = rq._parse_response(api_rsp, [email for email, _ in batch])
+            if len(rsp.entries) != len(batch):
+                raise errors.CoresenderError("Coresender API returned %s entries for %s emails" % (len(rsp.entries), len(batch)))
+        except (errors.ValidationError, errors.ApiLogicError) as exc:
+            if len(batch) == 1:
+                self._set_exception(batch, exc)
+                return
+            # the API rejects the whole batch for an invalid email, halves are sent so the other callers succeed
+            middle = len(batch) // 2
+            await asyncio.gather(self._send(batch[:middle]), self._send(batch[middle:]))
+            return
+        except Exception as exc:
+            self._set_exception(batch, exc)
+            return
+
+        # entries are in the order of the sent emails
+        for (_, future), entry in zip(batch, rsp.entries):
+            if not future.done():
+                future.set_result(entry)
+
+    @classmethod
+    def _set_exception(cls, batch: List[Tuple[Message, asyncio.Future]], exc: Exception) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+
+# one per client, coalesced calls share its requests
+_coalescers: 'weakref.WeakKeyDictionary[CoresenderClient, _Coalescer]' = weakref.WeakKeyDictionary()
+
+
+def _get_coalescer(client: CoresenderClient) -> _Coalescer:
+    coalescer = _coalescers.get(client)
+    if coalescer is None or coalescer._loop is not asyncio.get_event_loop():
+        coalescer = _coalescers[client] = _Coalescer(client)
+    return coalescer
+
+
 class SendEmail(CoresenderApiRequest):
     _api_version: str = '1'
     _api_method: str = 'POST'
@@ -20,90 +115,430 @@ class SendEmail(CoresenderApiRequest):
     _login_required: bool = True
     _login_method: LoginMethod = LoginMethod.api_key
 
-    def __init__(self):
+    def __init__(self, *, client: CoresenderClient = None):
+        super().__init__(client=client)
         self._emails = []
 
-    def _validate_email(self, email: dict):
-        if not email['from']['email']:
+    def _validate_email(self, email: Message):
+        if not email.get('from_email'):
             raise errors.CoresenderError('No sender address specified')
-        if not email['to'][0]['email']:
+        if not email.to or not email.to[0].email:
             raise errors.CoresenderError('No recipient address specified')
 
+    @classmethod
+    def _build_email(cls,
+        from_email: str = None, from_name: str = None,
+        to: List[Dict[str, str]] = None,
+        to_email: str = None, to_name: str = None,
+        subject: str = None, body_html: str = None, body_text: str = None,
+        reply_to: List[Dict[str, str]] = None,
+        reply_to_email: str = None, reply_to_name: str = None,
+        custom_id: str = None, custom_id_unique: Optional[bool] = None,
+        track_opens: Optional[bool] = None, track_click: Optional[bool] = None,
+        list_id: str = None, list_unsubscribe: str = None,
+        template: MessageTemplate = None
+    ) -> Message:
+        if to:
+            to = [Recipient.from_dict(recipient) for recipient in to]
+        else:
+            to = [Recipient(to_email, to_name)]
+
+        if reply_to:
+            reply_to = [Recipient.from_dict(recipient) for recipient in reply_to]
+        elif reply_to_email:
+            reply_to = [Recipient(reply_to_email, reply_to_name)]
+
+        email = Message(
+            from_email, to,
+            template=template,
+            from_name=from_name,
+            reply_to=reply_to,
+            subject=subject,
+            body_html=body_html,
+            body_text=body_text,
+            custom_id=custom_id,
+            custom_id_unique=custom_id_unique,
+            track_opens=track_opens,
+            track_clicks=track_click,
+            list_id=list_id,
+            list_unsubscribe=list_unsubscribe,
+        )
+
+        return email
+
     def add_to_batch(self,
-        from_email: str, from_name: str = None,
+        from_email: str = None, from_name: str = None,
         to: List[Dict[str, str]] = None,
         to_email: str = None, to_name: str = None,
         subject: str = None, body_html: str = None, body_text: str = None,
         reply_to: List[Dict[str, str]] = None,
         reply_to_email: str = None, reply_to_name: str = None,
-        custom_id: str = None, custom_id_unique: bool = False,
-        track_opens: bool = False, track_click: bool = False,
-        list_id: str = None, list_unsubscribe: str = None
+        custom_id: str = None, custom_id_unique: Optional[bool] = None,
+        track_opens: Optional[bool] = None, track_click: Optional[bool] = None,
+        list_id: str = None, list_unsubscribe: str = None,
+        template: MessageTemplate = None
     ) -> None:
-        if not to:
-            to = [{'email': to_email, 'name': to_name}]
-
-        if not reply_to:
-            reply_to = [{'email': reply_to_email, 'name': reply_to_name}]
-
-        email = {
-            "from": {
-                "email": from_email,
-                "name": from_name,
-            },
-            "to": to,
-            "reply_to": reply_to,
-            "subject": subject,
-            "body": {
-                "html": body_html,
-                "text": body_text,
-            },
-            "custom_id": custom_id,
-            "custom_id_unique": custom_id_unique,
-            "track_opens": track_opens,
-            "track_clicks": track_click,
-            "list_id": list_id,
-            "list_unsubscribe": list_unsubscribe,
-        }
+        email = self._build_email(
+            from_email=from_email, from_name=from_name,
+            to=to, to_email=to_email, to_name=to_name,
+            subject=subject, body_html=body_html, body_text=body_text,
+            reply_to=reply_to, reply_to_email=reply_to_email, reply_to_name=reply_to_name,
+            custom_id=custom_id, custom_id_unique=custom_id_unique,
+            track_opens=track_opens, track_click=track_click,
+            list_id=list_id, list_unsubscribe=list_unsubscribe,
+            template=template,
+        )
 
         self._validate_email(email)
 
         self._emails.append(email)
 
-    async def execute(self) -> responses.SendEmail:
+    def add_message(self, message: Message) -> None:
+        self._validate_email(message)
+
+        self._emails.append(message)
+
+    def _split_batch(self, emails: List[Message], chunk_size: int = None, max_chunk_bytes: int = None) -> Iterator[MessageBatch]:
+        # measured with the codec the client sends with, the chunks keep the bytes so they aren't encoded twice
+        codec = self.get_client().codec if max_chunk_bytes else None
+        chunk, encoded = [], []
+        chunk_bytes = 2  # enclosing brackets of JSON list
+        for email in emails:
+            if codec:
+                email_encoded = encode_message(email, codec)
+                email_bytes = len(email_encoded) + 1
+                if chunk and chunk_bytes + email_bytes > max_chunk_bytes:
+                    yield MessageBatch(chunk, encoded)
+                    chunk, encoded = [], []
+                    chunk_bytes = 2
+                chunk_bytes += email_bytes
+                encoded.append(email_encoded)
+
+            chunk.append(email)
+            if chunk_size and len(chunk) >= chunk_size:
+                yield MessageBatch(chunk, encoded if codec else None)
+                chunk, encoded = [], []
+                chunk_bytes = 2
+
+        if chunk:
+            yield MessageBatch(chunk, encoded if codec else None)
+
+    def _parse_response(self,
+        api_rsp: ApiResponse, messages: List[Message] = None, classifier: responses.OutcomeClassifier = None
+    ) -> responses.SendEmail:
+        rsp = responses.SendEmail(api_rsp.status_code, api_rsp.data, messages)
+        accepted = len(rsp.get_entries(responses.Outcome.accepted, classifier))
+        self.get_client().emit('batch', status_code=api_rsp.status_code, emails=len(rsp.entries), accepted=accepted, rejected=len(rsp.entries) - accepted)
+        return rsp
+
+    async def _execute_chunks(self,
+        chunks: List[MessageBatch], max_concurrency: int, classifier: responses.OutcomeClassifier = None
+    ) -> responses.SendEmail:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        client = self.get_client()
+
+        async def send_chunk(index, chunk):
+            async with semaphore:
+                client.emit('chunk_start', index=index, chunks=len(chunks), emails=len(chunk))
+                started = time.perf_counter()
+                api_rsp = await self.send(data=chunk)
+                client.emit('chunk_end', index=index, chunks=len(chunks), emails=len(chunk), elapsed=time.perf_counter() - started)
+            return self._parse_response(api_rsp, chunk.messages, classifier)
+
+        # every chunk completes, a failed one doesn't discard the responses of the others
+        results = await asyncio.gather(*[send_chunk(index, chunk) for index, chunk in enumerate(chunks)], return_exceptions=True)
+        rsps = [result for result in results if not isinstance(result, BaseException)]
+        failed = [(chunk, result) for chunk, result in zip(chunks, results) if isinstance(result, BaseException)]
+        if failed:
+            if not rsps:
+                raise failed[0][1]
+            raise errors.PartialBatchError(
+                responses.SendEmail.merge(rsps), [email for chunk, _ in failed for email in chunk], [exc for _, exc in failed])
+
+        return responses.SendEmail.merge(rsps)
+
+    def validate_batch(self, validator: BatchValidator = None) -> List[InvalidMessage]:
+        # invalid messages are removed from the batch and returned
+        validator = validator or BatchValidator()
+        valid, invalid = validator.validate(self._emails)
+        self._emails[:] = valid
+        return invalid
+
+    async def execute(self, *,
+        chunk_size: int = None, max_chunk_bytes: int = None, max_concurrency: int = 4,
+        validator: BatchValidator = None, skip_invalid: bool = False
+    ) -> responses.SendEmail:
         if not self._emails:
             raise errors.CoresenderError("No emails scheduled to send")
 
-        api_rsp = await self.send()
-
-        rsp = responses.SendEmail(api_rsp.status_code, api_rsp.json())
+        invalid = []
+        if validator is not None:
+            valid, invalid = validator.validate(self._emails)
+            if invalid and not skip_invalid:
+                # nothing is sent, the batch can be fixed and executed again
+                raise errors.BatchValidationError(invalid)
+            emails = valid
+        else:
+            # the batch is cleared below, the response keeps the sent messages
+            emails = list(self._emails)
 
+        try:
+            rsp = await self._send_messages(emails, chunk_size, max_chunk_bytes, max_concurrency)
+        except errors.PartialBatchError as exc:
+            exc.response.invalid = invalid
+            # only the failed chunks stay in the batch, executing it again doesn't repeat accepted messages
+            self._emails[:] = exc.messages
+            raise
+        rsp.invalid = invalid
         self._emails.clear()
 
         return rsp
 
+    async def _send_messages(self,
+        emails: List[Message], chunk_size: int = None, max_chunk_bytes: int = None, max_concurrency: int = 4,
+        classifier: responses.OutcomeClassifier = None
+    ) -> responses.SendEmail:
+        if not emails:
+            return responses.SendEmail.merge([])
+        if chunk_size or max_chunk_bytes:
+            chunks = list(self._split_batch(emails, chunk_size, max_chunk_bytes))
+            return await self._execute_chunks(chunks, max_concurrency, classifier)
+
+        api_rsp = await self.send(data=emails)
+        return self._parse_response(api_rsp, emails, classifier)
+
+    async def resubmit(self, rsp: responses.SendEmail, *,
+        classifier: responses.OutcomeClassifier = None,
+        chunk_size: int = None, max_chunk_bytes: int = None, max_concurrency: int = 4
+    ) -> responses.SendEmail:
+        # only the transiently failed messages of an executed batch are sent again, the response covers just them
+        emails = rsp.get_messages(responses.Outcome.transient, classifier)
+        return await self._send_messages(emails, chunk_size, max_chunk_bytes, max_concurrency, classifier)
+
+    def resubmit_sync(self, rsp: responses.SendEmail, *,
+        classifier: responses.OutcomeClassifier = None,
+        chunk_size: int = None, max_chunk_bytes: int = None, max_concurrency: int = 4
+    ) -> responses.SendEmail:
+        return sync.run(self.resubmit(
+            rsp, classifier=classifier, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes, max_concurrency=max_concurrency))
+
+    @classmethod
+    async def _iter_batches(cls,
+        messages: Union[Iterable[Union[dict, Message]], AsyncIterable[Union[dict, Message]]], batch_size: int
+    ) -> AsyncIterator[List[Union[dict, Message]]]:
+        batch = []
+
+        if hasattr(messages, '__aiter__'):
+            async for message in messages:
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        else:
+            for message in messages:
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+
+        if batch:
+            yield batch
+
+    async def bulk_send(self,
+        messages: Union[Iterable[Union[dict, Message]], AsyncIterable[Union[dict, Message]]], *,
+        batch_size: int = 500, max_concurrency: int = 4
+    ) -> AsyncIterator[responses.SendEmailResponse]:
+        async def send_batch(batch):
+            emails = []
+            for message in batch:
+                email = message if isinstance(message, Message) else self._build_email(**message)
+                self._validate_email(email)
+                emails.append(email)
+
+            api_rsp = await self.send(data=emails)
+            return self._parse_response(api_rsp, emails)
+
+        in_flight = set()
+        try:
+            async for batch in self._iter_batches(messages, batch_size):
+                if len(in_flight) >= max_concurrency:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        for entry in task.result():
+                            yield entry
+
+                in_flight.add(asyncio.ensure_future(send_batch(batch)))
+
+            while in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for entry in task.result():
+                        yield entry
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    def bulk_send_sync(self,
+        messages: Union[Iterable[Union[dict, Message]], AsyncIterable[Union[dict, Message]]], *,
+        batch_size: int = 500, max_concurrency: int = 4
+    ) -> Iterator[responses.SendEmailResponse]:
+        return sync.iterate(self.bulk_send(messages, batch_size=batch_size, max_concurrency=max_concurrency))
+
+    @classmethod
+    async def _iter_messages(cls,
+        messages: Union[Iterable[Union[dict, Message]], AsyncIterable[Union[dict, Message]]]
+    ) -> AsyncIterator[Union[dict, Message]]:
+        if hasattr(messages, '__aiter__'):
+            async for message in messages:
+                yield message
+        else:
+            for message in messages:
+                yield message
+
+    async def adaptive_send(self,
+        messages: Union[Iterable[Union[dict, Message]], AsyncIterable[Union[dict, Message]]], *,
+        batching: AdaptiveBatching = None, max_attempts: int = 3
+    ) -> AsyncIterator[responses.SendEmailResponse]:
+        batching = batching or AdaptiveBatching()
+        client = self.get_client()
+        source = self._iter_messages(messages)
+        # (message, encoded message, attempt) of batches rejected as a whole, sent again first
+        resend: collections.deque = collections.deque()
+        exhausted = False
+
+        def emit_state(reason):
+            if reason:
+                client.emit('batching', reason=reason, **batching.get_state())
+
+        async def next_batch() -> List[Tuple[Message, bytes, int]]:
+            nonlocal exhausted
+            batch = []
+            batch_bytes = 2
+            while len(batch) < batching.batch_size:
+                if resend:
+                    item = resend.popleft()
+                elif exhausted:
+                    break
+                else:
+                    try:
+                        message = await source.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    email = message if isinstance(message, Message) else self._build_email(**message)
+                    self._validate_email(email)
+                    # encoded once, the size decides the batch and the same bytes are sent
+                    item = (email, encode_message(email, client.codec), 1)
+
+                if batch and batch_bytes + len(item[1]) + 1 > batching.max_batch_bytes:
+                    resend.appendleft(item)
+                    break
+                batch.append(item)
+                batch_bytes += len(item[1]) + 1
+            return batch
+
+        async def send_batch(batch: List[Tuple[Message, bytes, int]]) -> List[responses.SendEmailResponse]:
+            emails = MessageBatch([item[0] for item in batch], [item[1] for item in batch])
+            batch_bytes = 2 + sum(len(item[1]) + 1 for item in batch)
+            started = time.perf_counter()
+            try:
+                api_rsp = await self.send(data=emails)
+            except (errors.ValidationError, errors.ApiLogicError) as exc:
+                # one invalid message rejects the whole batch, halves are sent until it is alone and reported as rejected
+                if len(batch) == 1:
+                    return [self._rejected_entry(batch[0][0], exc)]
+                middle = len(batch) // 2
+                halves = await asyncio.gather(send_batch(batch[:middle]), send_batch(batch[middle:]))
+                return halves[0] + halves[1]
+            except Exception as exc:
+                emit_state(batching.on_error(exc, len(batch), batch_bytes))
+                attempt = max(item[2] for item in batch)
+                unprocessed = (
+                    getattr(exc, 'http_status', None) in _unprocessed_statuses
+                    or isinstance(exc, RetryPolicy.unsent_exceptions)
+                    or self.is_idempotent(emails)
+                )
+                if not unprocessed or attempt >= max_attempts:
+                    raise
+                resend.extendleft((message, encoded, attempt + 1) for message, encoded, _ in reversed(batch))
+                return []
+
+            emit_state(batching.on_success(len(batch), batch_bytes, time.perf_counter() - started))
+            return self._parse_response(api_rsp, emails.messages).entries
+
+        in_flight = set()
+        try:
+            while True:
+                while len(in_flight) < batching.concurrency:
+                    batch = await next_batch()
+                    if not batch:
+                        break
+                    in_flight.add(asyncio.ensure_future(send_batch(batch)))
+
+                if not in_flight:
+                    break
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for entry in task.result():
+                        yield entry
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    @classmethod
+    def _rejected_entry(cls, email: Message, exc: Exception) -> responses.SendEmailResponse:
+        return responses.SendEmailResponse({'message_id': None, 'custom_id': email.custom_id, 'status': 'rejected', 'errors': str(exc)})
+
+    def adaptive_send_sync(self,
+        messages: Union[Iterable[Union[dict, Message]], AsyncIterable[Union[dict, Message]]], *,
+        batching: AdaptiveBatching = None, max_attempts: int = 3
+    ) -> Iterator[responses.SendEmailResponse]:
+        return sync.iterate(self.adaptive_send(messages, batching=batching, max_attempts=max_attempts))
+
     async def simple_email(self,
         from_email: str = None, to_email: str = None,
         subject: str = None,
         body: str = None, *, body_type: BodyType = BodyType.text
     ) -> responses.SendEmailResponse:
-        email = {
-            "from": {
-                "email": from_email,
-            },
-            "to": [{'email': to_email, }],
-            "subject": subject,
-            "body": {
-                body_type.value: body,
-            },
-        }
+        email = Message(from_email, [Recipient(to_email)], subject=subject)
+        if body_type is BodyType.html:
+            email.body_html = body
+        else:
+            email.body_text = body
         self._validate_email(email)
 
+        client = self.get_client()
+        if client.context.coalesce_window is not None:
+            return await _get_coalescer(client).submit(email)
+
         api_rsp = await self.send(data=[email])
 
-        rsp = responses.SendEmail(api_rsp.status_code, api_rsp.json())
+        rsp = self._parse_response(api_rsp, [email])
 
         return rsp.entries[0]
 
-    def _to_json(self):
+    def simple_email_sync(self,
+        from_email: str = None, to_email: str = None,
+        subject: str = None,
+        body: str = None, *, body_type: BodyType = BodyType.text
+    ) -> responses.SendEmailResponse:
+        return sync.run(self.simple_email(from_email, to_email, subject, body, body_type=body_type))
+
+    def get_payload(self) -> List[Message]:
         return self._emails
+
+    def encode_payload(self, payload: List[Message]) -> MessageBatch:
+        if isinstance(payload, MessageBatch):
+            return payload
+        # encoded by the client with its codec, messages sharing a template reuse its encoded content
+        return MessageBatch(payload)
+
+    def is_idempotent(self, payload: List[Message]) -> bool:
+        # the API deduplicates messages with unique custom_id, so a repeated batch can't be delivered twice
+        return bool(payload) and all(email.custom_id and email.get('custom_id_unique') for email in payload)
+
+    def count_emails(self, payload: List[Message]) -> int:
+        return len(payload)
+
+    def _to_json(self):
+        return [email.to_wire() for email in self._emails]
@@ -1,4 +1,56 @@
+__all__ = ['Outcome', 'OutcomeClassifier', 'default_classifier', 'SendEmailResponse', 'SendEmail']
+
+import enum
+from typing import Any, Dict, Iterable, List, Optional
+
 from .core import CoresenderApiResponse
+from .. import errors
+
+
+class Outcome(enum.Enum):
+    accepted = 'accepted'
+    # sending the message again won't help, e.g. an invalid or suppressed recipient
+    rejected = 'rejected'
+    # the message can be sent again later
+    transient = 'transient'
+
+
+class OutcomeClassifier:
+    # the API documents only 'accepted' and 'rejected' message statuses, anything else is taken as rejected,
+    # so messages are never sent again unless their status or error code is known to be transient
+    def __init__(self, *,
+        accepted_statuses: Iterable[str] = ('accepted', ),
+        transient_statuses: Iterable[str] = (),
+        transient_error_codes: Iterable[str] = ()
+    ):
+        self.accepted_statuses = frozenset(accepted_statuses)
+        self.transient_statuses = frozenset(transient_statuses)
+        self.transient_error_codes = frozenset(transient_error_codes)
+
+    def __repr__(self):
+        return '<OutcomeClassifier accepted_statuses=%s, transient_statuses=%s, transient_error_codes=%s>' % (
+            sorted(self.accepted_statuses), sorted(self.transient_statuses), sorted(self.transient_error_codes))
+
+    def classify(self, status: str, entry_errors: Any) -> Outcome:
+        if status in self.accepted_statuses:
+            return Outcome.accepted
+        if status in self.transient_statuses:
+            return Outcome.transient
+        if self.transient_error_codes and not self.transient_error_codes.isdisjoint(self._get_error_codes(entry_errors)):
+            return Outcome.transient
+        return Outcome.rejected
+
+    @classmethod
+    def _get_error_codes(cls, entry_errors: Any) -> List[str]:
+        # error objects carry a code, a free-form description is not matched
+        if isinstance(entry_errors, dict):
+            entry_errors = [entry_errors]
+        if not isinstance(entry_errors, list):
+            return []
+        return [error['code'] for error in entry_errors if isinstance(error, dict) and isinstance(error.get('code'), str)]
+
+
+default_classifier = OutcomeClassifier()
 
 
 class SendEmailResponse:
@@ -10,6 +62,13 @@ class SendEmailResponse:
         self.status = data['status']
         self.errors = data['errors'] or ''
 
+    @property
+    def outcome(self) -> Outcome:
+        return self.get_outcome()
+
+    def get_outcome(self, classifier: OutcomeClassifier = None) -> Outcome:
+        return (classifier or default_classifier).classify(self.status, self.errors)
+
     def __repr__(self):
         r = ', '.join(['%s="%s"' % (item, getattr(self, item)) for item in self.__slots__])
         r = '<SendEmailResponse ' + r + '>'
@@ -17,13 +76,70 @@ class SendEmailResponse:
 
 
 class SendEmail(CoresenderApiResponse):
-    def __init__(self, http_status, data):
+    def __init__(self, http_status, data, messages: list = None):
         self.entries = [SendEmailResponse(item) for item in data['data']]
         self.http_status = http_status
+        # the sent messages, in the order of entries
+        self.messages = messages
+        # messages left out of the batch by validation, see SendEmail.execute
+        self.invalid = []
+
+    @classmethod
+    def merge(cls, rsps: List['SendEmail']) -> 'SendEmail':
+        r = cls.__new__(cls)
+        r.entries = [entry for rsp in rsps for entry in rsp.entries]
+        r.invalid = [message for rsp in rsps for message in rsp.invalid]
+        r.messages = None
+        if all(rsp.messages is not None for rsp in rsps):
+            r.messages = [message for rsp in rsps for message in rsp.messages]
+        # the merged batch is fully accepted only if every chunk was
+        r.http_status = next((rsp.http_status for rsp in rsps if rsp.http_status != 200), 200)
+        return r
 
     @property
     def all_accepted(self):
-        return self.http_status == 200
+        return self.is_all_accepted()
+
+    def is_all_accepted(self, classifier: OutcomeClassifier = None) -> bool:
+        return self.http_status == 200 and not self.invalid and all(
+            entry.get_outcome(classifier) is Outcome.accepted for entry in self.entries)
+
+    def get_entries(self, outcome: Outcome, classifier: OutcomeClassifier = None) -> List[SendEmailResponse]:
+        return [entry for entry in self.entries if entry.get_outcome(classifier) is outcome]
+
+    @property
+    def accepted(self) -> List[SendEmailResponse]:
+        return self.get_entries(Outcome.accepted)
+
+    @property
+    def rejected(self) -> List[SendEmailResponse]:
+        return self.get_entries(Outcome.rejected)
+
+    @property
+    def transient(self) -> List[SendEmailResponse]:
+        return self.get_entries(Outcome.transient)
+
+    def get_messages(self, outcome: Outcome, classifier: OutcomeClassifier = None) -> list:
+        if self.messages is None:
+            raise errors.CoresenderError("Sent messages are not known for this response")
+
+        # matched by position, the custom_id confirms it when both have one
+        by_custom_id: Optional[Dict[str, object]] = None
+        r = []
+        for idx, entry in enumerate(self.entries):
+            if entry.get_outcome(classifier) is not outcome:
+                continue
+
+            message = self.messages[idx] if idx < len(self.messages) else None
+            if entry.custom_id is not None and (message is None or message.custom_id != entry.custom_id):
+                if by_custom_id is None:
+                    by_custom_id = {message.custom_id: message for message in self.messages if message.custom_id is not None}
+                message = by_custom_id.get(entry.custom_id)
+            if message is None:
+                raise errors.CoresenderError("No sent message matches response entry %s" % idx)
+            r.append(message)
+
+        return r
 
     def __repr__(self):
         return '<SendEmail entries=%r>' % (self.entries, )
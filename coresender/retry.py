@@ -0,0 +1,92 @@
+__all__ = ['RetryPolicy']
+
+import datetime
+import email.utils
+import random
+import socket
+from typing import Iterable, Optional, Tuple, Type
+
+import httpx
+
+
+class RetryPolicy:
+    # the request surely didn't reach the API, so it's safe to repeat even if it's not idempotent
+    unsent_exceptions: Tuple[Type[BaseException], ...] = (
+        httpx.ConnectTimeout,
+        httpx.PoolTimeout,
+        ConnectionRefusedError,
+        socket.gaierror,
+    )
+    # the request was rejected before processing
+    unprocessed_statuses: Tuple[int, ...] = (429, 503)
+
+    def __init__(self, *,
+        max_attempts: int = 3,
+        backoff_factor: float = 0.5, backoff_max: float = 30.0, jitter: bool = True,
+        retry_statuses: Iterable[int] = (429, 500, 502, 503, 504),
+        retry_exceptions: Iterable[Type[BaseException]] = (httpx.NetworkError, httpx.TimeoutException, OSError),
+        respect_retry_after: bool = True, max_retry_after: float = 120.0
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.respect_retry_after = respect_retry_after
+        self.max_retry_after = max_retry_after
+
+    def __repr__(self):
+        return '<RetryPolicy max_attempts=%s, backoff_factor=%s, backoff_max=%s, retry_statuses=%s>' % (
+            self.max_attempts, self.backoff_factor, self.backoff_max, sorted(self.retry_statuses),
+        )
+
+    def should_retry_exception(self, exc: BaseException, attempt: int, idempotent: bool) -> bool:
+        if attempt >= self.max_attempts:
+            return False
+        if not isinstance(exc, self.retry_exceptions):
+            return False
+
+        return idempotent or isinstance(exc, self.unsent_exceptions)
+
+    def should_retry_response(self, rsp: httpx.Response, attempt: int, idempotent: bool) -> bool:
+        if attempt >= self.max_attempts:
+            return False
+        if rsp.status_code not in self.retry_statuses:
+            return False
+        if not idempotent and rsp.status_code not in self.unprocessed_statuses:
+            return False
+
+        retry_after = self.get_retry_after(rsp)
+        return retry_after is None or retry_after <= self.max_retry_after
+
+    def get_retry_after(self, rsp: httpx.Response) -> Optional[float]:
+        if not self.respect_retry_after:
+            return None
+
+        value = rsp.headers.get('Retry-After')
+        if not value:
+            return None
+
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max((date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+    def get_delay(self, attempt: int, rsp: httpx.Response = None) -> float:
+        delay = min(self.backoff_factor * (2 ** (attempt - 1)), self.backoff_max)
+        if self.jitter:
+            # "full jitter", spreads retries of many clients failing at the same time
+            delay = random.uniform(0, delay)
+
+        retry_after = self.get_retry_after(rsp) if rsp is not None else None
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        return delay
@@ -0,0 +1,74 @@
+__all__ = ['run', 'iterate', 'close']
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+
+_logger = logging.getLogger('coresender')
+
+
+class _LoopThread:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # threads don't survive fork(), e.g. in prefork Celery workers
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='coresender-loop', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+                _logger.debug("Started background event loop thread")
+
+            return self._loop
+
+    def run(self, coro: Awaitable, timeout: float = None) -> Any:
+        loop = self.get_loop()
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("coresender.sync cannot be used from within its own event loop, await the coroutine instead")
+
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def stop(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = self._pid = None
+
+        if loop is not None and thread.is_alive():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            _logger.debug("Stopped background event loop thread")
+
+
+_loop_thread = _LoopThread()
+
+
+def run(coro: Awaitable, timeout: float = None) -> Any:
+    return _loop_thread.run(coro, timeout)
+
+
+def iterate(agen: AsyncIterator, timeout: float = None) -> Iterator:
+    try:
+        while True:
+            try:
+                yield run(agen.__anext__(), timeout)
+            except StopAsyncIteration:
+                return
+    finally:
+        run(agen.aclose())
+
+
+def close() -> None:
+    from . import close as close_client
+
+    if _loop_thread._loop is not None:
+        run(close_client())
+    _loop_thread.stop()
@@ -1,11 +1,22 @@
 __all__ = ["OAuth2Token", "get_storage_handler"]
 
+import asyncio
+import contextlib
 import datetime
 import json
 import logging
+import os
 import pathlib
+import sqlite3
+import tempfile
+import threading
 from abc import abstractmethod
-from typing import Optional, Type
+from typing import AsyncIterator, Optional, Type
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from . import errors
 
@@ -104,6 +115,9 @@ class OAuth2Token:
 
 
 class OAuth2TokenStorage:
+    # storages shared between processes serialize logins with acquire_lock/release_lock
+    shared: bool = False
+
     def __init_subclass__(cls, storage_name: str, **kwargs):
         super().__init_subclass__(**kwargs)
 
@@ -121,19 +135,65 @@ class OAuth2TokenStorage:
     def save(self, token: OAuth2Token) -> None:
         raise NotImplementedError()
 
+    async def aread(self) -> Optional[OAuth2Token]:
+        return await asyncio.get_event_loop().run_in_executor(None, self.read)
+
+    async def asave(self, token: OAuth2Token) -> None:
+        await asyncio.get_event_loop().run_in_executor(None, self.save, token)
+
+    def acquire_lock(self) -> None:
+        pass
+
+    def release_lock(self) -> None:
+        pass
+
+    @contextlib.asynccontextmanager
+    async def alock(self) -> AsyncIterator[None]:
+        if not self.shared:
+            yield
+            return
+
+        loop = asyncio.get_event_loop()
+        acquired = loop.run_in_executor(None, self.acquire_lock)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # the executor keeps waiting for the lock, release it as soon as it's taken
+            acquired.add_done_callback(lambda fut: fut.exception() is None and self.release_lock())
+            raise
+
+        try:
+            yield
+        finally:
+            await loop.run_in_executor(None, self.release_lock)
+
 
 class OAuth2TokenFileStorage(OAuth2TokenStorage, storage_name='file'):
     default_storage_path = '~/.coresender.token'
 
+    def __init__(self, params: dict):
+        super().__init__(params)
+        self._cached_token: Optional[OAuth2Token] = None
+        self._cached_mtime: Optional[int] = None
+
     def _get_path(self):
         path = self.params.get('path', self.default_storage_path)
         path = pathlib.Path(path).expanduser()
         return path
 
+    def _get_mtime(self, path: pathlib.Path) -> Optional[int]:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
     def read(self) -> Optional[OAuth2Token]:
         path = self._get_path()
-        if not path.exists():
+        mtime = self._get_mtime(path)
+        if mtime is None:
             return
+        if mtime == self._cached_mtime:
+            return self._cached_token
 
         with path.open('r') as fh:
             try:
@@ -143,11 +203,140 @@ class OAuth2TokenFileStorage(OAuth2TokenStorage, storage_name='file'):
                 return
 
         token = OAuth2Token.from_json(token)
+        self._cached_token, self._cached_mtime = token, mtime
         _logger.debug("Success reading cached token data from %s", path)
         return token
 
     def save(self, token: OAuth2Token) -> None:
         path = self._get_path()
-        with path.open('w') as fh:
-            json.dump(token.to_json(), fh)
-            _logger.debug("OAuth2Token successfully dumped into %s" % path)
+
+        # write to a temporary file and rename it, so readers never see a partially written token
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=path.name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(token.to_json(), fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_path, str(path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self._cached_token, self._cached_mtime = token, self._get_mtime(path)
+        _logger.debug("OAuth2Token successfully dumped into %s" % path)
+
+    async def aread(self) -> Optional[OAuth2Token]:
+        # a stat is cheap enough to run in the event loop, parsing the file is offloaded only when it changed
+        mtime = self._get_mtime(self._get_path())
+        if mtime is not None and mtime == self._cached_mtime:
+            return self._cached_token
+
+        return await super().aread()
+
+
+class OAuth2TokenLockedFileStorage(OAuth2TokenFileStorage, storage_name='locked_file'):
+    shared = True
+
+    def __init__(self, params: dict):
+        if fcntl is None:
+            raise errors.CoresenderError("Token storage 'locked_file' requires fcntl, which is not available on this platform")
+
+        super().__init__(params)
+        self._lock_fh = None
+        self._local_lock = threading.Lock()
+
+    def acquire_lock(self) -> None:
+        self._local_lock.acquire()
+        try:
+            path = self._get_path()
+            fh = open(str(path) + '.lock', 'a')
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            self._local_lock.release()
+            raise
+
+        self._lock_fh = fh
+        _logger.debug("Acquired token storage lock %s", fh.name)
+
+    def release_lock(self) -> None:
+        fh, self._lock_fh = self._lock_fh, None
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            fh.close()
+        finally:
+            self._local_lock.release()
+
+
+class OAuth2TokenSQLiteStorage(OAuth2TokenStorage, storage_name='sqlite'):
+    default_storage_path = '~/.coresender.token.sqlite'
+    shared = True
+
+    def __init__(self, params: dict):
+        super().__init__(params)
+        self._lock_conn: Optional[sqlite3.Connection] = None
+        self._local_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        path = self.params.get('path', self.default_storage_path)
+        path = pathlib.Path(path).expanduser()
+
+        conn = sqlite3.connect(str(path), timeout=self.params.get('timeout', 30.0), isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS oauth2_token (id INTEGER PRIMARY KEY CHECK (id = 1), data TEXT NOT NULL)')
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self):
+        # while the lock is held, its transaction is the only one allowed to write
+        if self._lock_conn is not None:
+            yield self._lock_conn
+            return
+
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def read(self) -> Optional[OAuth2Token]:
+        with self._connection() as conn:
+            row = conn.execute('SELECT data FROM oauth2_token WHERE id = 1').fetchone()
+        if not row:
+            return
+
+        try:
+            token = OAuth2Token.from_json(json.loads(row[0]))
+        except Exception as exc:
+            _logger.exception("Cannot read saved token from %s", self.params.get('path', self.default_storage_path), exc_info=exc)
+            return
+
+        _logger.debug("Success reading cached token data from sqlite storage")
+        return token
+
+    def save(self, token: OAuth2Token) -> None:
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO oauth2_token (id, data) VALUES (1, ?)', (json.dumps(token.to_json()), ))
+        _logger.debug("OAuth2Token successfully dumped into sqlite storage")
+
+    def acquire_lock(self) -> None:
+        self._local_lock.acquire()
+        conn = None
+        try:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            if conn is not None:
+                conn.close()
+            self._local_lock.release()
+            raise
+
+        self._lock_conn = conn
+        _logger.debug("Acquired sqlite token storage lock")
+
+    def release_lock(self) -> None:
+        conn, self._lock_conn = self._lock_conn, None
+        try:
+            conn.execute('COMMIT')
+            conn.close()
+        finally:
+            self._local_lock.release()
@@ -0,0 +1,134 @@
+__all__ = ['Strictness', 'InvalidMessage', 'BatchValidator']
+
+import enum
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .message import Message
+
+
+class Strictness(enum.Enum):
+    # sender and recipient are present, as SendEmail checks every message
+    lenient = 'lenient'
+    # addresses look like addresses, no line breaks in header fields, size and recipients limits
+    standard = 'standard'
+    # addresses follow RFC 5321 dot-atom syntax and length limits
+    strict = 'strict'
+
+
+_EMAIL_RE = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s.]+')
+_STRICT_EMAIL_RE = re.compile(
+    r"(?=.{1,254}$)(?=[^@]{1,64}@)"
+    r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z][A-Za-z0-9-]{0,61}[A-Za-z0-9]"
+)
+# line breaks in header fields can inject headers
+_HEADER_INJECTION_RE = re.compile(r'[\r\n\0]')
+
+
+class InvalidMessage:
+    __slots__ = ('index', 'message', 'errors')
+
+    def __init__(self, index: int, message: Message, errors: List[str]):
+        self.index = index
+        self.message = message
+        self.errors = errors
+
+    def __repr__(self):
+        return '<InvalidMessage index=%s, custom_id="%s", errors=%r>' % (self.index, self.message.custom_id, self.errors)
+
+
+class BatchValidator:
+    def __init__(self, *,
+        strictness: Strictness = Strictness.standard,
+        max_recipients: Optional[int] = 50, max_body_bytes: Optional[int] = 10 * 2 ** 20,
+        unique_custom_ids: bool = True
+    ):
+        self.strictness = Strictness(strictness)
+        self.max_recipients = max_recipients
+        self.max_body_bytes = max_body_bytes
+        self.unique_custom_ids = unique_custom_ids
+        self._email_re = _STRICT_EMAIL_RE if self.strictness is Strictness.strict else _EMAIL_RE
+
+    def __repr__(self):
+        return '<BatchValidator strictness=%s, max_recipients=%s, max_body_bytes=%s>' % (
+            self.strictness.value, self.max_recipients, self.max_body_bytes)
+
+    def validate(self, messages: List[Message]) -> Tuple[List[Message], List[InvalidMessage]]:
+        valid = []
+        invalid = []
+        # fields taken from a template are checked once per template
+        shared_errors: Dict[int, List[str]] = {}
+        custom_ids = set()
+
+        for index, message in enumerate(messages):
+            template = message.template
+            if template is not None and not message.overrides_template():
+                errors = shared_errors.get(id(template))
+                if errors is None:
+                    errors = shared_errors[id(template)] = self._check_shared(message)
+                errors = errors + self._check_own(message)
+            else:
+                errors = self._check_shared(message) + self._check_own(message)
+
+            # the API rejects the whole batch if a unique custom_id repeats
+            if message.custom_id is not None and message.get('custom_id_unique') and self.unique_custom_ids:
+                if message.custom_id in custom_ids:
+                    errors.append('custom_id %s is not unique in the batch' % message.custom_id)
+                else:
+                    custom_ids.add(message.custom_id)
+
+            if errors:
+                invalid.append(InvalidMessage(index, message, errors))
+            else:
+                valid.append(message)
+
+        return valid, invalid
+
+    def _check_address(self, field: str, address: Optional[str], errors: List[str]) -> None:
+        if not address:
+            errors.append('%s: no address specified' % field)
+        elif self.strictness is not Strictness.lenient and not self._email_re.fullmatch(address):
+            errors.append('%s: invalid address %s' % (field, address))
+
+    def _check_header(self, field: str, value: Optional[str], errors: List[str]) -> None:
+        if value and _HEADER_INJECTION_RE.search(value):
+            errors.append('%s: line breaks are not allowed' % field)
+
+    def _check_shared(self, message: Message) -> List[str]:
+        errors = []
+        self._check_address('from', message.get('from_email'), errors)
+        if self.strictness is Strictness.lenient:
+            return errors
+
+        self._check_header('from_name', message.get('from_name'), errors)
+        self._check_header('subject', message.get('subject'), errors)
+        self._check_header('list_id', message.get('list_id'), errors)
+        self._check_header('list_unsubscribe', message.get('list_unsubscribe'), errors)
+        for recipient in message.get('reply_to') or ():
+            if recipient.email:
+                self._check_address('reply_to', recipient.email, errors)
+            self._check_header('reply_to name', recipient.name, errors)
+
+        if self.max_body_bytes:
+            body_bytes = sum(len(body.encode()) for body in (message.get('body_html'), message.get('body_text')) if body)
+            if body_bytes > self.max_body_bytes:
+                errors.append('body: %s bytes, at most %s allowed' % (body_bytes, self.max_body_bytes))
+
+        return errors
+
+    def _check_own(self, message: Message) -> List[str]:
+        errors = []
+        if not message.to:
+            errors.append('to: no address specified')
+        elif self.strictness is Strictness.lenient:
+            self._check_address('to', message.to[0].email, errors)
+        else:
+            if self.max_recipients and len(message.to) > self.max_recipients:
+                errors.append('to: %s recipients, at most %s allowed' % (len(message.to), self.max_recipients))
+            for recipient in message.to:
+                self._check_address('to', recipient.email, errors)
+                self._check_header('to name', recipient.name, errors)
+            self._check_header('custom_id', message.custom_id, errors)
+
+        return errors
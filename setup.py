@@ -53,6 +53,12 @@ setup(
     ],
     tests_require=test_requirements,
     extras_require={
+        'orjson': ['orjson'],
+        'ujson': ['ujson'],
+        'msgspec': ['msgspec'],
+        'zstd': ['zstandard'],
+        'prometheus': ['prometheus_client'],
+        'opentelemetry': ['opentelemetry-api'],
     },
     project_urls={
         'API Documentation': 'https://coresender.com/docs/api',
@@ -0,0 +1,148 @@
+import json
+
+import httpx
+import pytest
+
+from coresender import errors
+from coresender.batching import AdaptiveBatching
+from coresender.requests.send import SendEmail
+
+
+def _api_error(status):
+    return errors.CoresenderApiError(None, 'Coresender API request failed', status)
+
+
+def test_increase_on_fast_responses():
+    batching = AdaptiveBatching(batch_size=100, batch_size_step=50, concurrency=2, target_latency=1.0)
+
+    assert batching.on_success(100, 10000, 0.1) == 'increase'
+    assert batching.batch_size == 150
+    assert batching.concurrency == 2
+    batching.on_success(150, 15000, 0.1)
+    assert batching.concurrency == 3
+
+    # a partial batch doesn't show that larger ones are fine
+    batching.on_success(10, 1000, 0.1)
+    assert batching.batch_size == 200
+
+
+def test_limits():
+    batching = AdaptiveBatching(batch_size=90, max_batch_size=100, concurrency=1, max_concurrency=1)
+
+    batching.on_success(90, 10000, 0.1)
+    assert batching.batch_size == 100
+    assert batching.on_success(100, 10000, 0.1) is None
+    assert batching.concurrency == 1
+
+
+def test_decrease_on_slow_responses():
+    batching = AdaptiveBatching(batch_size=200, target_latency=1.0)
+
+    assert batching.on_success(200, 10000, 3.0) == 'latency'
+    assert batching.batch_size == 100
+
+
+def test_decrease_on_errors():
+    batching = AdaptiveBatching(batch_size=200, concurrency=8, max_batch_bytes=10 ** 6, min_batch_bytes=1000)
+
+    assert batching.on_error(_api_error(413), 200, 400000) == 'too_large'
+    assert batching.batch_size == 100
+    assert batching.max_batch_bytes == 200000
+
+    assert batching.on_error(httpx.ReadTimeout(''), 100, 200000) == 'too_large'
+    assert batching.batch_size == 50
+
+    assert batching.on_error(_api_error(429), 50, 100000) == 'overload'
+    assert batching.concurrency == 4
+
+    assert batching.on_error(_api_error(401), 50, 100000) is None
+    assert (batching.batch_size, batching.concurrency) == (50, 4)
+
+
+def _mock_http(mocker, *statuses, invalid_custom_id=None):
+    statuses = list(statuses)
+    sent = []
+
+    async def request(method, url, headers, data):
+        emails = json.loads(data)
+        sent.append(len(emails))
+        rsp = mocker.MagicMock()
+        rsp.status_code = statuses.pop(0) if statuses else 200
+        if any(email['custom_id'] == invalid_custom_id for email in emails):
+            rsp.status_code = 422
+            rsp.content = json.dumps({'data': {'code': 'VALIDATION_ERROR', 'errors': [
+                {'field': 'to', 'errors': [{'code': 'INVALID', 'description': 'Invalid address'}]},
+            ]}}).encode()
+        elif rsp.status_code == 200:
+            rsp.content = json.dumps({'data': [
+                {'message_id': 'msg-%s' % email['custom_id'], 'custom_id': email['custom_id'], 'status': 'accepted', 'errors': None}
+                for email in emails
+            ]}).encode()
+        else:
+            rsp.content = json.dumps({'data': {'code': 'ERROR'}}).encode()
+        return rsp
+
+    http = mocker.MagicMock()
+    http.request = request
+    mocker.patch('httpx.AsyncClient', return_value=http)
+    return sent
+
+
+def _messages(count):
+    return [
+        {'from_email': 'from@example.com', 'to_email': 'to@example.com', 'subject': 'test', 'custom_id': str(idx)}
+        for idx in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_adaptive_send(cs_client, mocker):
+    sent = _mock_http(mocker)
+    batching = AdaptiveBatching(batch_size=2, batch_size_step=2, concurrency=1)
+
+    rq = SendEmail(client=cs_client)
+    entries = [entry async for entry in rq.adaptive_send(_messages(10), batching=batching)]
+
+    assert sorted(entry.custom_id for entry in entries) == [str(idx) for idx in range(10)]
+    assert sent == [2, 4, 4]
+    assert cs_client.stats.batch_size == batching.batch_size == 6
+    assert cs_client.stats.concurrency == batching.concurrency
+
+
+@pytest.mark.asyncio
+async def test_adaptive_send_splits_rejected_batch(cs_client, mocker):
+    sent = _mock_http(mocker, 413)
+    batching = AdaptiveBatching(batch_size=4, concurrency=1, max_concurrency=1)
+
+    rq = SendEmail(client=cs_client)
+    entries = [entry async for entry in rq.adaptive_send(_messages(4), batching=batching)]
+
+    assert [entry.custom_id for entry in entries] == ['0', '1', '2', '3']
+    assert sent == [4, 2, 2]
+
+
+@pytest.mark.asyncio
+async def test_adaptive_send_gives_up(cs_client, mocker):
+    _mock_http(mocker, 413, 413, 413)
+    batching = AdaptiveBatching(batch_size=4, concurrency=1)
+
+    rq = SendEmail(client=cs_client)
+    with pytest.raises(errors.CoresenderApiError):
+        [entry async for entry in rq.adaptive_send(_messages(4), batching=batching, max_attempts=3)]
+
+
+@pytest.mark.asyncio
+async def test_adaptive_send_isolates_invalid_message(cs_client, mocker):
+    sent = _mock_http(mocker, invalid_custom_id='3')
+    batching = AdaptiveBatching(batch_size=8, concurrency=1, max_concurrency=1)
+
+    rq = SendEmail(client=cs_client)
+    entries = [entry async for entry in rq.adaptive_send(_messages(20), batching=batching)]
+
+    # the invalid message is reported, every other message is sent
+    assert sorted(int(entry.custom_id) for entry in entries) == list(range(20))
+    rejected = [entry for entry in entries if entry.status == 'rejected']
+    assert [entry.custom_id for entry in rejected] == ['3']
+    assert 'Invalid address' in rejected[0].errors
+    assert sent[:7] == [8, 4, 4, 2, 2, 1, 1]
+    assert batching.batch_size >= 8
@@ -0,0 +1,15 @@
+import pytest
+
+from benchmarks import bench_fake_api
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('scenario', list(bench_fake_api.SCENARIOS))
+async def test_fake_api_scenarios(scenario):
+    result = await bench_fake_api.run(scenario, latency=0.0, scale=0.01)
+
+    assert result['emails_per_second'] > 0
+    assert result['latency_p99'] >= result['latency_p50']
+    if scenario == 'refresh_storm':
+        # concurrent requests wait for one login
+        assert result['logins'] == result['rounds']
@@ -0,0 +1,478 @@
+import asyncio
+import base64
+import contextlib
+import gzip
+import json
+import logging
+import threading
+import time
+
+import httpx
+import pytest
+from httpx._dispatch.base import AsyncDispatcher
+
+import coresender
+from coresender.token import OAuth2Token
+from coresender.requests.core import CoresenderApiRequest, CoresenderClient, _ConnectionPool, _HTTP2Connection
+
+
+def _mock_http(mocker, status_code=200, data=None):
+    rsp = mocker.MagicMock()
+    rsp.status_code = status_code
+    rsp.content = json.dumps(data or {'data': {}}).encode()
+
+    http = mocker.MagicMock()
+    http.request = mocker.AsyncMock(return_value=rsp)
+    http.aclose = mocker.AsyncMock()
+
+    return mocker.patch('httpx.AsyncClient', return_value=http)
+
+
+@pytest.mark.asyncio
+async def test_connection_pool_is_reused(cs_client, mocker):
+    http_class = _mock_http(mocker)
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    http_class.assert_called_once()
+    assert http_class.return_value.request.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_pool_limits_from_context(cs_ctx, mocker):
+    http_class = _mock_http(mocker)
+    cs_ctx.pool_max_keepalive = 3
+    cs_ctx.pool_max_connections = 7
+
+    cl = CoresenderClient(cs_ctx)
+    cl.http
+
+    pool_limits = http_class.call_args[1]['pool_limits']
+    assert pool_limits.soft_limit == 3
+    assert pool_limits.hard_limit == 7
+
+
+@pytest.mark.asyncio
+async def test_http2_from_context(cs_ctx, mocker):
+    http_class = _mock_http(mocker)
+
+    CoresenderClient(cs_ctx).http
+    assert http_class.call_args[1]['http2'] is False
+
+    cs_ctx.http2 = True
+    CoresenderClient(cs_ctx).http
+    assert http_class.call_args[1]['http2'] is True
+    assert isinstance(http_class.call_args[1]['dispatch'], _ConnectionPool)
+
+    # httpx itself is left unchanged for other users
+    from httpx._dispatch.http2 import HTTP2Connection
+    assert HTTP2Connection.wait_for_event is not _HTTP2Connection.wait_for_event
+
+
+@pytest.mark.asyncio
+async def test_aclose(cs_ctx, mocker):
+    http_class = _mock_http(mocker)
+
+    async with CoresenderClient(cs_ctx) as cl:
+        cl.http
+
+    http_class.return_value.aclose.assert_awaited_once()
+    assert cl._http is None
+
+
+@pytest.mark.asyncio
+async def test_max_connections_per_host(cs_ctx, mocker):
+    http_class = _mock_http(mocker)
+    cs_ctx.max_connections_per_host = 2
+
+    in_flight = 0
+    max_in_flight = 0
+    rsp = http_class.return_value.request.return_value
+
+    async def request(*args, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return rsp
+
+    http_class.return_value.request = request
+
+    cl = CoresenderClient(cs_ctx)
+    await asyncio.gather(*[
+        cl.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+        for _ in range(6)
+    ])
+
+    assert max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_response_is_decoded_once(cs_client, mocker):
+    _mock_http(mocker, data={'data': [{'message_id': '1'}]})
+    loads = mocker.spy(cs_client.codec, 'loads')
+
+    rsp = await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    assert rsp.data == {'data': [{'message_id': '1'}]}
+    assert rsp.json() is rsp.data
+    loads.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_request_body_is_encoded_once(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    dumps = mocker.spy(cs_client.codec, 'dumps')
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [{'subject': 'test'}], {'api_key_required': True})
+
+    dumps.assert_called_once()
+    kwargs = http_class.return_value.request.call_args[1]
+    assert json.loads(kwargs['data']) == [{'subject': 'test'}]
+    assert kwargs['headers']['Content-Type'] == 'application/json'
+
+
+@pytest.mark.asyncio
+async def test_large_body_is_compressed(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    cs_client._ctx.compression = 'gzip'
+    cs_client._ctx.compression_threshold = 1024
+    data = [{'subject': 'test', 'body': {'html': 'x' * 2048}}]
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', data, {'api_key_required': True})
+
+    kwargs = http_class.return_value.request.call_args[1]
+    assert kwargs['headers']['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(kwargs['data'])) == data
+
+
+@pytest.mark.asyncio
+async def test_small_body_is_not_compressed(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    cs_client._ctx.compression = 'gzip'
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [{'subject': 'test'}], {'api_key_required': True})
+
+    kwargs = http_class.return_value.request.call_args[1]
+    assert 'Content-Encoding' not in kwargs['headers']
+    assert json.loads(kwargs['data']) == [{'subject': 'test'}]
+
+
+@pytest.mark.asyncio
+async def test_large_body_is_compressed_in_executor(cs_client, mocker):
+    _mock_http(mocker)
+    cs_client._ctx.compression = 'gzip'
+    cs_client._ctx.compression_threshold = 0
+    cs_client._ctx.compression_offload_threshold = 1024
+    run_in_executor = mocker.spy(asyncio.get_event_loop(), 'run_in_executor')
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [{'body': 'x' * 100}], {'api_key_required': True})
+    run_in_executor.assert_not_called()
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [{'body': 'x' * 2048}], {'api_key_required': True})
+    run_in_executor.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_compression_disabled_on_unsupported_media_type(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    cs_client._ctx.compression = 'gzip'
+    cs_client._ctx.compression_threshold = 0
+    rejected = mocker.MagicMock(status_code=415, content=b'{}')
+    accepted = http_class.return_value.request.return_value
+    http_class.return_value.request.side_effect = [rejected, accepted]
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [{'subject': 'test'}], {'api_key_required': True})
+
+    kwargs = http_class.return_value.request.call_args[1]
+    assert 'Content-Encoding' not in kwargs['headers']
+    assert json.loads(kwargs['data']) == [{'subject': 'test'}]
+    assert cs_client.compressor is None
+
+
+def _mock_send(mocker, client):
+    rsp = mocker.MagicMock()
+    rsp.status_code = 200
+    rsp.data = {'data': [{'message_id': '1', 'custom_id': None, 'status': 'accepted', 'errors': None}]}
+    mocker.patch.object(client, 'send', return_value=rsp)
+
+
+def _sent_url(client):
+    return client.send.call_args[0][1]
+
+
+@pytest.mark.asyncio
+async def test_request_uses_passed_client(mocker):
+    first = coresender.create_client(sending_account_id='1', sending_account_key='a', api_host='first.example.com')
+    second = coresender.create_client(sending_account_id='2', sending_account_key='b', api_host='second.example.com')
+    assert first.context is not second.context
+
+    for client in (first, second):
+        _mock_send(mocker, client)
+        await coresender.SendEmail(client=client).simple_email(from_email='from@example.com', to_email='to@example.com', subject='test', body='test')
+
+    assert _sent_url(first).startswith('https://first.example.com:443/')
+    assert _sent_url(second).startswith('https://second.example.com:443/')
+
+
+@pytest.mark.asyncio
+async def test_bound_client_is_used_in_concurrent_tasks(mocker):
+    clients = [coresender.create_client(sending_account_id=str(idx), sending_account_key='key', api_host='%d.example.com' % idx) for idx in range(3)]
+    for client in clients:
+        _mock_send(mocker, client)
+
+    async def send(client):
+        with client.bind():
+            await asyncio.sleep(0.01)
+            rq = coresender.SendEmail()
+            await rq.simple_email(from_email='from@example.com', to_email='to@example.com', subject='test', body='test')
+
+    await asyncio.gather(*[send(client) for client in clients])
+
+    for idx, client in enumerate(clients):
+        client.send.assert_awaited_once()
+        assert _sent_url(client).startswith('https://%d.example.com:443/' % idx)
+
+
+def test_bound_client_is_used_by_sync_calls(mocker):
+    client = coresender.create_client(sending_account_id='1', sending_account_key='a')
+    _mock_send(mocker, client)
+
+    with client.bind():
+        coresender.SendEmail().simple_email_sync(from_email='from@example.com', to_email='to@example.com', subject='test', body='test')
+
+    client.send.assert_awaited_once()
+
+
+def test_init_replaces_shared_client(mocker):
+    mocker.patch('coresender.context._ctx')
+    coresender.init(sending_account_id='1', sending_account_key='a')
+    first = CoresenderApiRequest.client()
+
+    coresender.init(sending_account_id='2', sending_account_key='b')
+    second = CoresenderApiRequest.client()
+
+    assert first.context.sending_account_id == '1'
+    assert second.context.sending_account_id == '2'
+    CoresenderApiRequest._client = None
+
+
+def test_url_from_shared_client(mocker):
+    mocker.patch('coresender.context._ctx', None)
+    client = coresender.create_client(sending_account_id='1', sending_account_key='a', api_host='api.example.com')
+    CoresenderApiRequest.set_client(client)
+    try:
+        assert coresender.SendEmail().get_full_url().startswith('https://api.example.com:443/')
+    finally:
+        CoresenderApiRequest._client = None
+
+
+@pytest.mark.asyncio
+async def test_init_closes_previous_client(mocker):
+    mocker.patch('coresender.context._ctx')
+    coresender.init(sending_account_id='1', sending_account_key='a')
+    first = CoresenderApiRequest.client()
+    http = first._http = mocker.MagicMock(aclose=mocker.AsyncMock())
+    refresh_task = first._refresh_task = asyncio.ensure_future(asyncio.sleep(3600))
+
+    coresender.init(sending_account_id='2', sending_account_key='b')
+    # the pool is closed soon after on its loop
+    await asyncio.sleep(0.01)
+
+    # the token of the old credentials isn't refreshed anymore
+    assert refresh_task.cancelled()
+    http.aclose.assert_awaited_once()
+    CoresenderApiRequest._client = None
+
+
+def _sent_headers(http_class):
+    return http_class.return_value.request.call_args[1]['headers']
+
+
+@pytest.mark.asyncio
+async def test_basic_authorization_is_computed_once(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    b64encode = mocker.spy(base64, 'b64encode')
+
+    for _ in range(3):
+        await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    assert b64encode.call_count == 1
+    assert _sent_headers(http_class)['Authorization'] == 'Basic ' + base64.b64encode(b'bbb:aaa').decode()
+
+    cs_client.context.sending_account_key = 'changed'
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+    assert _sent_headers(http_class)['Authorization'] == 'Basic ' + base64.b64encode(b'bbb:changed').decode()
+
+
+@pytest.mark.asyncio
+async def test_bearer_authorization_follows_token(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    cs_client.context.token = OAuth2Token.from_rq_json({'access_token': 'first', 'refresh_token': 'r', 'token_type': 'Bearer', 'expires_in': 3600})
+
+    await cs_client.send('GET', 'https://api.coresender.com/v1/account', None, {'oauth2_token_required': True})
+    assert _sent_headers(http_class)['Authorization'] == 'Bearer first'
+
+    cs_client.context.token = OAuth2Token.from_rq_json({'access_token': 'second', 'refresh_token': 'r', 'token_type': 'Bearer', 'expires_in': 3600})
+    await cs_client.send('GET', 'https://api.coresender.com/v1/account', None, {'oauth2_token_required': True})
+    assert _sent_headers(http_class)['Authorization'] == 'Bearer second'
+
+
+@pytest.mark.asyncio
+async def test_authorization_is_not_logged(cs_client, mocker, caplog):
+    _mock_http(mocker)
+
+    with caplog.at_level(logging.DEBUG, logger='coresender'):
+        await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    assert 'Basic' not in caplog.text
+
+
+@contextlib.contextmanager
+def _fake_api_in_thread():
+    from benchmarks.fake_api import FakeApi
+
+    # the server runs in its own loop, so the client can use any other loop, blocking or not
+    server_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=server_loop.run_forever, daemon=True)
+    thread.start()
+    api = FakeApi(latency=0.0)
+    asyncio.run_coroutine_threadsafe(api.start(), server_loop).result()
+    try:
+        yield api
+    finally:
+        asyncio.run_coroutine_threadsafe(api.stop(), server_loop).result()
+        server_loop.call_soon_threadsafe(server_loop.stop)
+        thread.join()
+        server_loop.close()
+
+
+def _wait_for_connections(api, count):
+    deadline = time.monotonic() + 2
+    while len(api._handlers) > count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return len(api._handlers)
+
+
+def test_loop_change_closes_connections():
+    with _fake_api_in_thread() as api:
+        client = CoresenderClient(api.create_context())
+        rq = coresender.SendEmail(client=client)
+        # a new loop for every call
+        for _ in range(3):
+            asyncio.run(rq.simple_email(from_email='from@example.com', to_email='to@example.com', subject='test', body='test'))
+
+        # connections of the closed loops are shut down, not left open
+        assert api.connections == 3
+        assert _wait_for_connections(api, 1) == 1
+
+
+def test_sync_and_async_calls_keep_their_pools():
+    with _fake_api_in_thread() as api:
+        client = CoresenderClient(api.create_context())
+        rq = coresender.SendEmail(client=client)
+        loop = asyncio.new_event_loop()
+        try:
+            for _ in range(5):
+                loop.run_until_complete(rq.simple_email(from_email='from@example.com', to_email='to@example.com', subject='test', body='test'))
+                rq.simple_email_sync(from_email='from@example.com', to_email='to@example.com', subject='test', body='test')
+
+            # one connection for the async caller's loop, one for the background loop of the sync calls
+            assert api.connections == 2
+
+            loop.run_until_complete(client.aclose())
+            assert _wait_for_connections(api, 0) == 0
+        finally:
+            loop.close()
+
+
+class _InstantDispatch(AsyncDispatcher):
+    async def send(self, request, timeout=None):
+        return httpx.Response(200, request=request, content=b'{"data":[]}')
+
+
+@pytest.mark.timing
+@pytest.mark.asyncio
+async def test_send_overhead(cs_client):
+    # catches gross regressions only, python -m benchmarks.bench_send_overhead measures the overhead
+    cs_client._bind_loop()
+    cs_client._http = httpx.AsyncClient(dispatch=_InstantDispatch())
+    requests = 500
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+    per_request = (time.perf_counter() - started) / requests
+
+    assert per_request < 0.005
+
+
+@pytest.mark.asyncio
+async def test_response_body_is_not_decoded_when_debug_is_off(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    text = mocker.PropertyMock(return_value='')
+    type(http_class.return_value.request.return_value).text = text
+
+    logger = logging.getLogger('coresender')
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+    finally:
+        logger.setLevel(level)
+
+    text.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_debug_log_is_redacted_and_truncated(cs_client, mocker, caplog):
+    _mock_http(mocker, data={'access_token': 'token-value', 'refresh_token': 'refresh-value'})
+    cs_client.context.sending_account_key = 'account-key-value'
+    cs_client.context.log_body_limit = 200
+    data = {'password': 'password-value', 'note': 'account-key-value', 'filler': 'x' * 1000}
+
+    with caplog.at_level(logging.DEBUG, logger='coresender'):
+        await cs_client.send('POST', 'https://api.coresender.com/v1/login', data, {'headers': {'Authorization': 'Basic custom'}})
+
+    for secret in ('password-value', 'account-key-value', 'token-value', 'refresh-value', 'Basic custom'):
+        assert secret not in caplog.text
+    assert '"password":"***"' in caplog.text
+    assert 'x' * 300 not in caplog.text
+    assert '(%d bytes)' % len(json.dumps(data, separators=(',', ':'))) in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_trace_hook(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    http_class.return_value.request.side_effect = [httpx.ConnectTimeout(), http_class.return_value.request.return_value]
+    mocker.patch('asyncio.sleep')
+    events = []
+    cs_client.context.trace_hook = lambda event, fields: events.append((event, fields))
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    assert [event for event, _ in events] == ['request_start', 'request', 'error', 'retry', 'request', 'response', 'request_end']
+    assert len({fields['request_id'] for _, fields in events}) == 1
+    assert isinstance(events[2][1]['exception'], httpx.ConnectTimeout)
+    assert events[5][1]['status_code'] == 200
+    assert events[5][1]['attempt'] == 2
+    assert events[5][1]['body_size'] == len(http_class.return_value.request.return_value.content)
+    assert events[5][1]['elapsed'] >= 0
+
+    end = events[6][1]
+    assert end['attempts'] == 2
+    assert end['status_code'] == 200
+    assert end['exception'] is None
+    assert set(end['timings']) == {'login', 'encode', 'rate_limit', 'network', 'retry_wait', 'decode'}
+
+
+@pytest.mark.asyncio
+async def test_failing_trace_hook_does_not_break_sending(cs_client, mocker):
+    _mock_http(mocker)
+    cs_client.context.trace_hook = mocker.Mock(side_effect=RuntimeError())
+
+    rsp = await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    assert rsp.status_code == 200
@@ -0,0 +1,31 @@
+import pytest
+
+from coresender import codec, errors
+
+
+def test_stdlib_codec_is_always_available():
+    assert 'json' in codec.available_codecs()
+    assert codec.get_codec('json').name == 'json'
+
+
+def test_default_codec_is_fastest_available():
+    assert codec.get_codec().name == codec.available_codecs()[0]
+
+
+def test_unknown_codec():
+    with pytest.raises(errors.CoresenderError):
+        codec.get_codec('yaml')
+
+
+@pytest.mark.parametrize('name', codec.available_codecs())
+def test_codec_round_trip(name):
+    cdc = codec.get_codec(name)
+    data = [{'subject': 'Zażółć gęślą jaźń', 'body': {'html': '<a href="https://example.com/">x</a>', 'text': None}, 'track_opens': True}]
+
+    encoded = cdc.dumps(data)
+
+    assert isinstance(encoded, bytes)
+    assert cdc.loads(encoded) == data
+
+    with pytest.raises(ValueError):
+        cdc.loads(b'{"data"')
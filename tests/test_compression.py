@@ -0,0 +1,33 @@
+import gzip
+
+import pytest
+
+from coresender import errors
+from coresender.compression import available_compressions, get_compressor
+
+
+def test_gzip_is_always_available():
+    assert 'gzip' in available_compressions()
+
+
+def test_gzip_compress():
+    compressor = get_compressor('gzip')
+
+    assert compressor.encoding == 'gzip'
+    assert gzip.decompress(compressor.compress(b'x' * 1000)) == b'x' * 1000
+
+
+def test_auto_picks_best_available():
+    assert get_compressor('auto').encoding == available_compressions()[0]
+
+
+def test_unknown_compression():
+    with pytest.raises(errors.CoresenderError):
+        get_compressor('lzma')
+
+
+def test_zstd_compress():
+    zstandard = pytest.importorskip('zstandard')
+
+    data = b'x' * 1000
+    assert zstandard.ZstdDecompressor().decompress(get_compressor('zstd').compress(data)) == data
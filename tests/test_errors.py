@@ -56,3 +56,17 @@ def test_validation_error(mocker):
 
     with pytest.raises(errors.ValidationError):
         handler()
+
+
+def test_handler_uses_decoded_data(mocker):
+    rsp = mocker.patch('httpx.Response')
+    rsp.status_code = 409
+    rsp_json = {'data': {'code': 'ENTITY_EXISTS', 'errors': [{'code': 'A', 'description': 'desc'}]}}
+
+    handler = handlers.get_handler(rsp, rsp_json)
+    assert type(handler) is handlers.ErrorHandler409
+
+    with pytest.raises(errors.EntityExistsError):
+        handler()
+
+    rsp.json.assert_not_called()
@@ -0,0 +1,161 @@
+import json
+
+import httpx
+import pytest
+
+import coresender
+from coresender.instrumentation import ClientStats, OpenTelemetryHook, PrometheusHook, combine_hooks
+
+
+def _mock_http(mocker, status_code=200, data=None):
+    rsp = mocker.MagicMock()
+    rsp.status_code = status_code
+    rsp.content = json.dumps(data or {'data': {}}).encode()
+
+    http = mocker.MagicMock()
+    http.request = mocker.AsyncMock(return_value=rsp)
+    return mocker.patch('httpx.AsyncClient', return_value=http)
+
+
+def _send_email_data(statuses):
+    return {'data': [
+        {'message_id': str(idx), 'custom_id': str(idx), 'status': status, 'errors': None}
+        for idx, status in enumerate(statuses)
+    ]}
+
+
+def _add_emails(rq, count):
+    for idx in range(count):
+        rq.add_to_batch(from_email='from@example.com', to_email='to@example.com', subject='test', custom_id=str(idx))
+
+
+@pytest.mark.asyncio
+async def test_stats_count_requests(cs_client, mocker):
+    http_class = _mock_http(mocker)
+    http_class.return_value.request.side_effect = [httpx.ConnectTimeout(), http_class.return_value.request.return_value]
+    mocker.patch('asyncio.sleep')
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    stats = cs_client.stats
+    assert stats.requests == 1
+    assert stats.attempts == 2
+    assert stats.retries == 1
+    assert stats.failures == 0
+    assert stats.statuses == {200: 1}
+    assert stats.latency_percentile(99) >= 0
+
+
+@pytest.mark.asyncio
+async def test_stats_count_failures(cs_client, mocker):
+    _mock_http(mocker, 401, {'data': {'errors': [{'code': 401, 'description': 'Unauthorized'}]}})
+
+    with pytest.raises(coresender.errors.CoresenderError):
+        await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    assert cs_client.stats.failures == 1
+    assert cs_client.stats.statuses == {401: 1}
+
+
+@pytest.mark.asyncio
+async def test_batch_and_chunk_events(cs_client, mocker):
+    _mock_http(mocker, 200, _send_email_data(['accepted', 'rejected']))
+    events = []
+    cs_client.context.trace_hook = lambda event, fields: events.append((event, fields))
+
+    rq = coresender.SendEmail(client=cs_client)
+    _add_emails(rq, 4)
+    await rq.execute(chunk_size=2)
+
+    names = [event for event, _ in events]
+    assert names.count('chunk_start') == 2
+    assert names.count('chunk_end') == 2
+    assert names.count('batch') == 2
+    assert cs_client.stats.emails == 4
+    assert cs_client.stats.emails_accepted == 2
+    assert cs_client.stats.acceptance_rate == 0.5
+
+
+@pytest.mark.asyncio
+async def test_login_event(cs_client, mocker):
+    _mock_http(mocker, 200, {'access_token': 'access', 'refresh_token': 'refresh', 'token_type': 'Bearer', 'expires_in': 3600})
+    events = []
+    cs_client.context.trace_hook = lambda event, fields: events.append((event, fields))
+
+    await cs_client._request_token({'grant_type': 'password', 'email': 'user@example.com', 'password': 'secret'})
+
+    login = [fields for event, fields in events if event == 'login']
+    assert len(login) == 1
+    assert login[0]['grant_type'] == 'password'
+    assert login[0]['exception'] is None
+    assert cs_client.stats.logins == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_wait_event(cs_client, mocker):
+    _mock_http(mocker)
+    cs_client.context.rate_limiter = coresender.RateLimiter(requests_per_second=10)
+    mocker.patch.object(cs_client.context.rate_limiter, 'acquire', mocker.AsyncMock(return_value=0.25))
+    events = []
+    cs_client.context.trace_hook = lambda event, fields: events.append((event, fields))
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    end = events[-1][1]
+    assert ('rate_limit_wait', {'request_id': end['request_id'], 'url': end['url'], 'waited': 0.25}) in events
+    assert end['timings']['rate_limit'] == 0.25
+    assert cs_client.stats.rate_limit_wait_time == 0.25
+
+
+def test_combine_hooks(mocker):
+    first = mocker.Mock(side_effect=RuntimeError())
+    second = mocker.Mock()
+
+    combine_hooks(first, second)('batch', {'emails': 1})
+
+    first.assert_called_once_with('batch', {'emails': 1})
+    second.assert_called_once_with('batch', {'emails': 1})
+
+
+def test_stats_as_dict():
+    stats = ClientStats()
+    stats.on_event('request_end', {'elapsed': 0.5, 'status_code': 200, 'exception': None})
+    stats.on_event('batch', {'emails': 4, 'accepted': 3, 'rejected': 1})
+
+    data = stats.as_dict()
+    assert data['requests'] == 1
+    assert data['latency_p50'] == 0.5
+    assert data['acceptance_rate'] == 0.75
+
+
+def test_prometheus_hook():
+    prometheus_client = pytest.importorskip('prometheus_client')
+    registry = prometheus_client.CollectorRegistry()
+    hook = PrometheusHook(registry=registry)
+
+    hook('request_end', {'url': 'https://api.coresender.com/v1/send_email', 'status_code': 200, 'exception': None, 'elapsed': 0.1})
+    hook('batch', {'emails': 3, 'accepted': 2, 'rejected': 1})
+
+    assert registry.get_sample_value('coresender_requests_total', {'endpoint': '/v1/send_email', 'status': '200'}) == 1
+    assert registry.get_sample_value('coresender_emails_total', {'result': 'accepted'}) == 2
+
+
+def test_opentelemetry_hook(mocker):
+    pytest.importorskip('opentelemetry.trace')
+    tracer = mocker.Mock()
+    hook = OpenTelemetryHook(tracer)
+
+    hook('request_start', {'request_id': 1, 'method': 'POST', 'url': 'https://api.coresender.com/v1/send_email', 'emails': 2})
+    hook('request_end', {'request_id': 1, 'attempts': 1, 'status_code': 200, 'exception': None, 'timings': {'network': 0.1}})
+
+    span = tracer.start_span.return_value
+    span.set_attribute.assert_any_call('http.status_code', 200)
+    span.end.assert_called_once()
+
+
+def test_missing_optional_dependency():
+    try:
+        import prometheus_client  # noqa
+    except ImportError:
+        with pytest.raises(coresender.errors.CoresenderError):
+            PrometheusHook()
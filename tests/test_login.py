@@ -0,0 +1,96 @@
+import asyncio
+import datetime
+
+import pytest
+
+from coresender.token import OAuth2Token
+
+
+def _token_response(mocker, access_token='access', expires_in=3600):
+    rsp = mocker.MagicMock()
+    rsp.status_code = 200
+    rsp.data = {
+        'access_token': access_token,
+        'refresh_token': 'refresh',
+        'token_type': 'Bearer',
+        'expires_in': expires_in,
+    }
+    return rsp
+
+
+@pytest.fixture
+def login_client(cs_ctx, cs_client, mocker):
+    mocker.patch('coresender.requests.core.get_context', return_value=cs_ctx)
+    cs_ctx.username = 'user@example.com'
+    cs_ctx.password = 'secret'
+    return cs_client
+
+
+@pytest.mark.asyncio
+async def test_concurrent_login_is_single_flight(login_client, mocker):
+    async def send(method, url, data, options=None):
+        await asyncio.sleep(0.01)
+        return _token_response(mocker)
+
+    mocker.patch.object(login_client, 'send', side_effect=send)
+
+    await asyncio.gather(*[login_client.login() for _ in range(10)])
+
+    assert login_client.send.await_count == 1
+    assert login_client._ctx.token.access_token == 'access'
+
+    await login_client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_token_is_refreshed_in_background(login_client, cs_ctx, mocker):
+    cs_ctx.token_refresh_margin = 60
+
+    token = OAuth2Token()
+    token.access_token = 'old'
+    token.refresh_token = 'refresh'
+    token.token_type = 'Bearer'
+    token.expires_on = datetime.datetime.now() + datetime.timedelta(seconds=60)
+    cs_ctx.token = token
+
+    refreshed = asyncio.Event()
+
+    async def send(method, url, data, options=None):
+        refreshed.set()
+        return _token_response(mocker, access_token='new')
+
+    mocker.patch.object(login_client, 'send', side_effect=send)
+
+    login_client._schedule_token_refresh()
+    await asyncio.wait_for(refreshed.wait(), 1)
+    await asyncio.sleep(0)
+
+    data = login_client.send.call_args[0][2]
+    assert data == {'grant_type': 'refresh_token', 'refresh_token': 'refresh'}
+    assert cs_ctx.token.access_token == 'new'
+
+    await login_client.aclose()
+    assert login_client._refresh_task is None
+
+
+@pytest.mark.asyncio
+async def test_refresh_margin_longer_than_token_lifetime(login_client, cs_ctx, mocker):
+    cs_ctx.token_refresh_margin = 3600
+
+    token = OAuth2Token()
+    token.access_token = 'old'
+    token.refresh_token = 'refresh'
+    token.token_type = 'Bearer'
+    token.expires_on = datetime.datetime.now() + datetime.timedelta(seconds=10)
+    cs_ctx.token = token
+
+    mocker.patch.object(login_client, 'send', return_value=_token_response(mocker, access_token='new', expires_in=10))
+
+    login_client._schedule_token_refresh()
+    await asyncio.sleep(0.1)
+
+    # refreshed once, then after half of the new token's lifetime instead of in a loop
+    assert login_client.send.await_count == 1
+    assert cs_ctx.token.access_token == 'new'
+
+    await login_client.aclose()
@@ -0,0 +1,134 @@
+import json
+
+import pytest
+
+import coresender
+from coresender.codec import available_codecs, get_codec
+from coresender.message import Message, MessageBatch, MessageTemplate, Recipient, encode_message
+
+
+def test_minimal_message_omits_defaults():
+    msg = Message('from@example.com', [Recipient('to@example.com')], body_text='test')
+
+    assert msg.to_wire() == {
+        'from': {'email': 'from@example.com'},
+        'to': [{'email': 'to@example.com'}],
+        'body': {'text': 'test'},
+    }
+    assert not hasattr(msg, '__dict__')
+
+
+def test_full_message():
+    msg = Message(
+        'from@example.com', [Recipient('to@example.com', 'To')],
+        from_name='From', reply_to=[Recipient('reply@example.com')],
+        subject='subject', body_html='<b>html</b>', body_text='text',
+        custom_id='1', custom_id_unique=True, track_opens=True, track_clicks=True,
+        list_id='list', list_unsubscribe='<mailto:unsubscribe@example.com>',
+    )
+
+    assert msg.to_wire() == {
+        'from': {'email': 'from@example.com', 'name': 'From'},
+        'to': [{'email': 'to@example.com', 'name': 'To'}],
+        'reply_to': [{'email': 'reply@example.com'}],
+        'subject': 'subject',
+        'body': {'html': '<b>html</b>', 'text': 'text'},
+        'custom_id': '1',
+        'custom_id_unique': True,
+        'track_opens': True,
+        'track_clicks': True,
+        'list_id': 'list',
+        'list_unsubscribe': '<mailto:unsubscribe@example.com>',
+    }
+
+
+def test_add_message():
+    rq = coresender.SendEmail()
+    rq.add_message(Message('from@example.com', [Recipient('to@example.com')], subject='test'))
+    rq.add_to_batch(from_email='from@example.com', to=[{'email': 'to@example.com', 'name': 'To'}], subject='test')
+
+    assert rq.to_json() == [
+        {'from': {'email': 'from@example.com'}, 'to': [{'email': 'to@example.com'}], 'subject': 'test'},
+        {'from': {'email': 'from@example.com'}, 'to': [{'email': 'to@example.com', 'name': 'To'}], 'subject': 'test'},
+    ]
+
+
+def _get_template():
+    return MessageTemplate(
+        from_email='from@example.com', subject='Offer', body_html='<b>Offer</b>', body_text='Offer', track_opens=True,
+    )
+
+
+def test_templated_message_to_wire():
+    msg = Message(None, [Recipient('to@example.com')], template=_get_template(), custom_id='1')
+
+    assert msg.to_wire() == {
+        'from': {'email': 'from@example.com'},
+        'to': [{'email': 'to@example.com'}],
+        'subject': 'Offer',
+        'body': {'html': '<b>Offer</b>', 'text': 'Offer'},
+        'track_opens': True,
+        'custom_id': '1',
+    }
+
+
+def test_templated_message_overrides():
+    msg = Message(None, [Recipient('to@example.com')], template=_get_template(), subject='Personal offer')
+
+    assert msg.overrides_template()
+    assert msg.to_wire()['subject'] == 'Personal offer'
+    assert msg.to_wire()['body'] == {'html': '<b>Offer</b>', 'text': 'Offer'}
+
+
+def test_templated_message_overrides_with_falsy_values():
+    template = _get_template()
+    template.custom_id_unique = True
+    msg = Message(None, [Recipient('to@example.com')], template=template, custom_id='1',
+                  custom_id_unique=False, track_opens=False, subject='')
+
+    assert msg.overrides_template()
+    assert msg.get('custom_id_unique') is False
+    wire = msg.to_wire()
+    assert wire['subject'] == ''
+    assert 'custom_id_unique' not in wire
+    assert 'track_opens' not in wire
+    assert json.loads(encode_message(msg, get_codec('json'))) == wire
+
+    # a message not marked as unique is not retried as idempotent
+    assert not coresender.SendEmail().is_idempotent([msg])
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_encode_templated_messages(name):
+    cdc = get_codec(name)
+    template = _get_template()
+    messages = [
+        Message(None, [Recipient('to-%d@example.com' % idx)], template=template, custom_id=str(idx))
+        for idx in range(3)
+    ]
+    messages.append(Message(None, [Recipient('to@example.com')], template=template, subject='Personal offer'))
+    messages.append(Message('from@example.com', [Recipient('to@example.com')], body_text='plain'))
+
+    encoded = MessageBatch(messages).encode_json(cdc)
+
+    assert json.loads(encoded) == [msg.to_wire() for msg in messages]
+
+
+def test_template_change_invalidates_encoded_fields():
+    cdc = get_codec('json')
+    template = _get_template()
+    msg = Message(None, [Recipient('to@example.com')], template=template)
+
+    assert json.loads(encode_message(msg, cdc))['subject'] == 'Offer'
+    template.subject = 'New offer'
+    assert json.loads(encode_message(msg, cdc))['subject'] == 'New offer'
+
+
+def test_add_to_batch_with_template():
+    rq = coresender.SendEmail()
+    rq.add_to_batch(template=_get_template(), to_email='to@example.com', custom_id='1')
+
+    assert rq.to_json()[0]['subject'] == 'Offer'
+
+    with pytest.raises(coresender.errors.CoresenderError):
+        rq.add_to_batch(template=MessageTemplate(subject='No sender'), to_email='to@example.com')
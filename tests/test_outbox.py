@@ -0,0 +1,202 @@
+import asyncio
+import json
+import sqlite3
+
+import httpx
+import pytest
+
+from coresender import responses
+from coresender.message import Message, Recipient
+from coresender.outbox import Outbox
+
+
+def _response(mocker, status_code, data):
+    rsp = mocker.MagicMock()
+    rsp.status_code = status_code
+    rsp.content = json.dumps(data).encode()
+    return rsp
+
+
+def _accepted(mocker, *custom_ids):
+    return _response(mocker, 200, {'data': [
+        {'message_id': 'msg-%s' % custom_id, 'custom_id': custom_id, 'status': 'accepted', 'errors': None}
+        for custom_id in custom_ids
+    ]})
+
+
+def _rejected_batch(mocker):
+    return _response(mocker, 422, {'data': {'code': 'VALIDATION_ERROR', 'errors': [
+        {'field': 'to', 'errors': [{'code': 'INVALID', 'description': 'Invalid address'}]},
+    ]}})
+
+
+def _mock_http(mocker, *responses):
+    http = mocker.MagicMock()
+    http.request = mocker.AsyncMock(side_effect=list(responses))
+    mocker.patch('httpx.AsyncClient', return_value=http)
+    return http.request
+
+
+def _message(custom_id):
+    return Message('from@example.com', [Recipient('to@example.com')], subject='test', custom_id=custom_id)
+
+
+@pytest.fixture
+def outbox(tmp_path, cs_client):
+    outbox = Outbox(str(tmp_path / 'outbox.sqlite'), client=cs_client, retry_delay=0.0)
+    yield outbox
+    outbox.close()
+
+
+def test_add_is_durable(outbox, tmp_path, cs_client):
+    ids = outbox.add_messages([_message('a'), _message('b')])
+    outbox.add_to_batch(from_email='from@example.com', to_email='to@example.com', subject='test', custom_id='c')
+    outbox.close()
+
+    reopened = Outbox(str(tmp_path / 'outbox.sqlite'), client=cs_client)
+    assert reopened.counts() == {'pending': 3}
+    assert reopened.get(ids[1]).custom_id == 'b'
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_flush_records_results(outbox, mocker):
+    request = _mock_http(mocker, _accepted(mocker, 'a', 'b'))
+    ids = await outbox.aadd_messages([_message('a'), _message('b')])
+
+    await outbox.flush()
+
+    assert request.call_count == 1
+    assert json.loads(request.call_args.kwargs['data'])[1]['custom_id'] == 'b'
+    entry = outbox.get(ids[1])
+    assert (entry.status, entry.message_id, entry.attempts) == ('accepted', 'msg-b', 1)
+    assert outbox.counts() == {'accepted': 2}
+
+
+@pytest.mark.asyncio
+async def test_batches_are_limited(tmp_path, cs_client, mocker):
+    outbox = Outbox(str(tmp_path / 'outbox.sqlite'), client=cs_client, batch_size=2)
+    request = _mock_http(mocker, _accepted(mocker, 'a', 'b'), _accepted(mocker, 'c'))
+    outbox.add_messages([_message('a'), _message('b'), _message('c')])
+
+    await outbox.flush()
+
+    assert request.call_count == 2
+    assert outbox.counts() == {'accepted': 3}
+    outbox.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_send_is_retried(outbox, cs_client, mocker):
+    cs_client.context.retry_policy = None
+    request = _mock_http(mocker, httpx.ReadTimeout(''), _accepted(mocker, 'a'))
+    entry_id = outbox.add_message(_message('a'))
+
+    await outbox.flush()
+    entry = outbox.get(entry_id)
+    assert (entry.status, entry.attempts) == ('pending', 1)
+    assert entry.errors
+
+    await outbox.flush()
+    assert outbox.get(entry_id).status == 'accepted'
+    assert request.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_deferred_entries_are_retried(tmp_path, cs_client, mocker):
+    outbox = Outbox(
+        str(tmp_path / 'outbox.sqlite'), client=cs_client, retry_delay=0.0,
+        classifier=responses.OutcomeClassifier(transient_statuses=('deferred', )),
+    )
+    request = _mock_http(mocker, _response(mocker, 200, {'data': [
+        {'message_id': 'msg-a', 'custom_id': 'a', 'status': 'accepted', 'errors': None},
+        {'message_id': None, 'custom_id': 'b', 'status': 'deferred', 'errors': None},
+        {'message_id': None, 'custom_id': 'c', 'status': 'rejected', 'errors': 'Invalid recipient'},
+    ]}), _accepted(mocker, 'b'))
+    a, b, c = outbox.add_messages([_message('a'), _message('b'), _message('c')])
+
+    await outbox.flush()
+    assert (outbox.get(b).status, outbox.get(b).errors) == ('pending', 'deferred')
+    assert outbox.get(c).status == 'rejected'
+
+    await outbox.flush()
+    # only the deferred message is sent again
+    assert [email['custom_id'] for email in json.loads(request.call_args.kwargs['data'])] == ['b']
+    assert outbox.counts() == {'accepted': 2, 'rejected': 1}
+    outbox.close()
+
+
+@pytest.mark.asyncio
+async def test_rejected_batch_is_split(outbox, mocker):
+    _mock_http(mocker, _rejected_batch(mocker), _accepted(mocker, 'a'), _rejected_batch(mocker))
+    good, bad = outbox.add_messages([_message('a'), _message('b')])
+
+    await outbox.flush()
+
+    assert outbox.get(good).status == 'accepted'
+    assert outbox.get(bad).status == 'failed'
+    assert 'Invalid address' in outbox.get(bad).errors
+
+
+@pytest.mark.asyncio
+async def test_abandoned_messages_are_sent_again(tmp_path, cs_client, mocker):
+    path = str(tmp_path / 'outbox.sqlite')
+    crashed = Outbox(path, client=cs_client, lease_timeout=0.0)
+    entry_id = crashed.add_message(_message('a'))
+    # claimed by a flusher that died before saving the result
+    crashed._claim()
+    crashed.close()
+
+    _mock_http(mocker, _accepted(mocker, 'a'))
+    outbox = Outbox(path, client=cs_client)
+    await outbox.flush()
+
+    entry = outbox.get(entry_id)
+    assert (entry.status, entry.attempts) == ('accepted', 2)
+    outbox.close()
+
+
+@pytest.mark.asyncio
+async def test_background_flusher(outbox, mocker):
+    _mock_http(mocker, _accepted(mocker, 'a'))
+
+    async with outbox:
+        entry_id = await outbox.aadd_message(_message('a'))
+        for _ in range(100):
+            if outbox.get(entry_id).status == 'accepted':
+                break
+            await asyncio.sleep(0.01)
+
+    assert outbox.get(entry_id).status == 'accepted'
+
+
+@pytest.mark.asyncio
+async def test_failed_claims_keep_concurrency(tmp_path, cs_client, mocker):
+    outbox = Outbox(str(tmp_path / 'outbox.sqlite'), client=cs_client, max_concurrency=1, flush_interval=0.001)
+    claims = [sqlite3.OperationalError('database is locked')] * 5
+    mocker.patch.object(outbox, '_claim', side_effect=lambda: _raise_or_claim(claims))
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def send(messages):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.005)
+        in_flight -= 1
+
+    mocker.patch.object(outbox, '_send', side_effect=send)
+
+    async with outbox:
+        await asyncio.sleep(0.1)
+
+    assert outbox._send.await_count > 1
+    assert max_in_flight == 1
+    outbox.close()
+
+
+def _raise_or_claim(claims):
+    if claims:
+        raise claims.pop()
+    return [object()]
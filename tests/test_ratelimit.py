@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from coresender.ratelimit import RateLimiter, TokenBucket
+
+
+def _response(mocker, status_code, headers=None):
+    rsp = mocker.MagicMock()
+    rsp.status_code = status_code
+    rsp.headers = httpx.Headers(headers or {})
+    rsp.json = mocker.MagicMock(return_value={'data': {'code': ''}})
+    return rsp
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=100, capacity=1)
+
+    started = time.monotonic()
+    await asyncio.gather(*[bucket.acquire() for _ in range(6)])
+
+    assert time.monotonic() - started >= 0.045
+
+
+def test_token_bucket_reservations_queue_up():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.reserve(2) == 0
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve(1) == pytest.approx(0.2, abs=0.01)
+
+
+def test_rate_limiter_adapts_to_429(mocker):
+    limiter = RateLimiter(requests_per_second=100, emails_per_second=1000)
+
+    limiter.on_response(_response(mocker, 429, {'Retry-After': '2'}))
+
+    assert limiter.requests.rate == 50
+    assert limiter.emails.rate == 500
+    assert limiter._paused_until > time.monotonic() + 1
+
+    limiter.on_response(_response(mocker, 200))
+    assert limiter.requests.rate == 55
+
+
+def test_rate_limiter_follows_rate_limit_headers(mocker):
+    limiter = RateLimiter(requests_per_second=100)
+
+    limiter.on_response(_response(mocker, 200, {'X-RateLimit-Remaining': '20', 'X-RateLimit-Reset': '2'}))
+    assert limiter.requests.rate == 10
+
+    limiter.on_response(_response(mocker, 200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '3'}))
+    assert limiter._paused_until > time.monotonic() + 2
+
+
+@pytest.mark.asyncio
+async def test_client_uses_rate_limiter(cs_ctx, cs_client, mocker):
+    cs_ctx.rate_limiter = RateLimiter(emails_per_second=1000)
+    acquire = mocker.spy(cs_ctx.rate_limiter, 'acquire')
+    mocker.patch.object(cs_client, '_request', return_value=_response(mocker, 200))
+
+    await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [{}, {}], {'emails': 2})
+
+    acquire.assert_awaited_once_with(2)
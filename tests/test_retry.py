@@ -0,0 +1,84 @@
+import email.utils
+import time
+
+import httpx
+import pytest
+
+import coresender
+from coresender.retry import RetryPolicy
+
+
+def _response(mocker, status_code, headers=None):
+    rsp = mocker.MagicMock()
+    rsp.status_code = status_code
+    rsp.headers = httpx.Headers(headers or {})
+    rsp.json = mocker.MagicMock(return_value={'data': {'code': ''}})
+    return rsp
+
+
+def test_retry_statuses(mocker):
+    policy = RetryPolicy(max_attempts=3)
+
+    assert policy.should_retry_response(_response(mocker, 503), 1, idempotent=False)
+    assert policy.should_retry_response(_response(mocker, 429), 2, idempotent=False)
+    assert not policy.should_retry_response(_response(mocker, 429), 3, idempotent=False)
+    assert not policy.should_retry_response(_response(mocker, 500), 1, idempotent=False)
+    assert policy.should_retry_response(_response(mocker, 500), 1, idempotent=True)
+    assert not policy.should_retry_response(_response(mocker, 422), 1, idempotent=True)
+
+
+def test_retry_exceptions():
+    policy = RetryPolicy(max_attempts=3)
+
+    assert policy.should_retry_exception(ConnectionRefusedError(), 1, idempotent=False)
+    assert not policy.should_retry_exception(httpx.ReadTimeout(), 1, idempotent=False)
+    assert policy.should_retry_exception(httpx.ReadTimeout(), 1, idempotent=True)
+    assert not policy.should_retry_exception(ValueError(), 1, idempotent=True)
+
+
+def test_retry_after(mocker):
+    policy = RetryPolicy(backoff_factor=0.1, jitter=False)
+
+    assert policy.get_delay(1) == 0.1
+    assert policy.get_delay(3) == 0.4
+    assert policy.get_delay(1, _response(mocker, 429, {'Retry-After': '7'})) == 7
+
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < policy.get_delay(1, _response(mocker, 503, {'Retry-After': date})) <= 30
+
+    assert not policy.should_retry_response(_response(mocker, 429, {'Retry-After': '3600'}), 1, idempotent=False)
+
+
+@pytest.mark.asyncio
+async def test_client_retries_transient_errors(cs_ctx, cs_client, mocker):
+    cs_ctx.retry_policy = RetryPolicy(max_attempts=3, backoff_factor=0)
+    request = mocker.patch.object(cs_client, '_request', side_effect=[
+        ConnectionRefusedError(),
+        _response(mocker, 503),
+        _response(mocker, 200),
+    ])
+
+    rsp = await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'api_key_required': True})
+
+    assert rsp.status_code == 200
+    assert request.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_client_does_not_repeat_non_idempotent_requests(cs_ctx, cs_client, mocker):
+    cs_ctx.retry_policy = RetryPolicy(max_attempts=3, backoff_factor=0)
+    request = mocker.patch.object(cs_client, '_request', side_effect=httpx.ReadTimeout())
+
+    with pytest.raises(httpx.ReadTimeout):
+        await cs_client.send('POST', 'https://api.coresender.com/v1/send_email', [], {'idempotent': False})
+
+    assert request.await_count == 1
+
+
+def test_send_email_idempotency():
+    rq = coresender.SendEmail()
+    rq.add_to_batch(from_email='from@example.com', to_email='to@example.com', custom_id='1', custom_id_unique=True)
+    assert rq.is_idempotent(rq.get_payload())
+
+    rq.add_to_batch(from_email='from@example.com', to_email='to@example.com', custom_id='2')
+    assert not rq.is_idempotent(rq.get_payload())
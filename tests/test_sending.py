@@ -1,40 +1,32 @@
+import asyncio
+import gc
+import weakref
+
 from mock import patch
 import pytest
 
 import coresender
+from coresender.codec import available_codecs, get_codec
+from coresender.message import encode_message
 from coresender.requests.core import CoresenderClient
+from coresender.requests.send import _coalescers, _get_coalescer
 
 
 def _get_email_structure(data):
-    return {
+    # null and default values are not sent
+    email = {
        'from': {
-           'email': data.get('from_email', None),
-           'name': data.get('from_name', None),
+           'email': data['from_email'],
        },
        'to': [
             {
-                'email': data.get('to_email', None),
-                'name': data.get('to_name', None),
+                'email': data['to_email'],
             }
        ],
-       'reply_to': [
-           {
-               'email': data.get('reply_to_email', None),
-               'name': data.get('reply_to_name', None),
-           }
-       ],
-       'subject': data.get('subject', None),
-       'body': {
-           'html': data.get('body_html', None),
-           'text': data.get('body_text', None),
-       },
-       'custom_id': data.get('custom_id', None),
-       'custom_id_unique': data.get('custom_id_unique', False),
-       'track_opens': data.get('track_opens', False),
-       'track_clicks': data.get('track_clicks', False),
-       'list_id': data.get('list_id', None),
-       'list_unsubscribe': data.get('list_unsubscribe', None),
     }
+    if 'subject' in data:
+        email['subject'] = data['subject']
+    return email
 
 
 def _get_emails_structures(data):
@@ -59,6 +51,9 @@ async def test_simple_email_send(_, cs_ctx, mocker):
     assert type(rq) is coresender.SendEmail
 
     client = mocker.patch.object(CoresenderClient(cs_ctx), 'send')
+    client.context = cs_ctx
+    # emit is synchronous, the AsyncMock would return coroutines nobody awaits
+    client.emit = mocker.MagicMock()
 
     rq.set_client(client)
 
@@ -86,12 +81,13 @@ def test_add_to_batch():
     rq.add_to_batch(**emails[0])
     rq.add_to_batch(**emails[1])
 
-    assert rq._emails == _get_emails_structures(emails)
+    assert rq.to_json() == _get_emails_structures(emails)
 
 
 @pytest.mark.asyncio
 async def test_batch_send(cs_ctx, mocker):
     cl = mocker.patch.object(CoresenderClient(cs_ctx), 'send')
+    cl.emit = mocker.MagicMock()
     mocker.patch('coresender.responses.SendEmail')
 
     rq = coresender.SendEmail()
@@ -118,3 +114,328 @@ async def test_batch_send(cs_ctx, mocker):
 
     cl.send.assert_awaited_once()
     assert not rq._emails
+
+
+def _api_response(mocker, status_code, emails):
+    rsp = mocker.MagicMock()
+    rsp.status_code = status_code
+    rsp.data = {'data': [
+        {'message_id': str(idx), 'custom_id': email.custom_id, 'status': 'accepted', 'errors': None}
+        for idx, email in enumerate(emails)
+    ]}
+    return rsp
+
+
+def _add_emails(rq, count):
+    for idx in range(count):
+        rq.add_to_batch(from_email='from@example.com', to_email='to@example.com', subject='test', custom_id=str(idx))
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_split_batch(cs_ctx, codec):
+    cs_ctx.json_codec = codec
+    rq = coresender.SendEmail(client=CoresenderClient(cs_ctx))
+    _add_emails(rq, 5)
+
+    chunks = list(rq._split_batch(rq._emails, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+    cdc = get_codec(codec)
+    email_bytes = len(encode_message(rq._emails[0], cdc)) + 1
+    chunks = list(rq._split_batch(rq._emails, max_chunk_bytes=2 + email_bytes * 2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    # measured with the client's codec, the bytes are sent as they are
+    for chunk in chunks:
+        assert chunk.encoded == [encode_message(email, cdc) for email in chunk]
+        assert rq.encode_payload(chunk) is chunk
+        assert len(chunk.encode_json(cdc)) <= 2 + email_bytes * 2
+
+
+@pytest.mark.asyncio
+async def test_chunked_batch_send(cs_client, mocker):
+    rq = coresender.SendEmail(client=cs_client)
+    _add_emails(rq, 5)
+
+    async def send(*, data):
+        await asyncio.sleep(0.01 * (5 - int(data[0].custom_id)))
+        return _api_response(mocker, 200, data)
+
+    mocker.patch.object(rq, 'send', side_effect=send)
+
+    rsp = await rq.execute(chunk_size=2, max_concurrency=2)
+
+    assert rq.send.await_count == 3
+    assert [entry.custom_id for entry in rsp] == ['0', '1', '2', '3', '4']
+    assert rsp.all_accepted
+    assert not rq._emails
+
+
+@pytest.mark.asyncio
+async def test_chunked_batch_send_partially_accepted(cs_client, mocker):
+    rq = coresender.SendEmail(client=cs_client)
+    _add_emails(rq, 4)
+
+    async def send(*, data):
+        return _api_response(mocker, 207 if data[0].custom_id == '2' else 200, data)
+
+    mocker.patch.object(rq, 'send', side_effect=send)
+
+    rsp = await rq.execute(chunk_size=2)
+
+    assert len(rsp.entries) == 4
+    assert not rsp.all_accepted
+
+
+@pytest.mark.asyncio
+async def test_chunked_batch_send_failed_chunk(cs_client, mocker):
+    rq = coresender.SendEmail(client=cs_client)
+    _add_emails(rq, 6)
+    failing = {'2'}
+
+    async def send(*, data):
+        if data[0].custom_id in failing:
+            raise coresender.errors.CoresenderApiError('INTERNAL_ERROR', 'Internal server error', 500)
+        return _api_response(mocker, 200, data)
+
+    mocker.patch.object(rq, 'send', side_effect=send)
+
+    with pytest.raises(coresender.errors.PartialBatchError) as exc_info:
+        await rq.execute(chunk_size=2)
+
+    assert [entry.custom_id for entry in exc_info.value.response] == ['0', '1', '4', '5']
+    assert [email.custom_id for email in exc_info.value.messages] == ['2', '3']
+    # only the failed chunk is left to send again
+    assert [email.custom_id for email in rq._emails] == ['2', '3']
+
+    failing.clear()
+    rsp = await rq.execute(chunk_size=2)
+    assert [entry.custom_id for entry in rsp] == ['2', '3']
+
+
+def _message_specs(count):
+    for idx in range(count):
+        yield {'from_email': 'from@example.com', 'to_email': 'to@example.com', 'subject': 'test', 'custom_id': str(idx)}
+
+
+@pytest.mark.asyncio
+async def test_bulk_send(cs_client, mocker):
+    rq = coresender.SendEmail(client=cs_client)
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def send(*, data):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return _api_response(mocker, 200, data)
+
+    mocker.patch.object(rq, 'send', side_effect=send)
+
+    entries = [entry async for entry in rq.bulk_send(_message_specs(10), batch_size=3, max_concurrency=2)]
+
+    assert rq.send.await_count == 4
+    assert max_in_flight == 2
+    assert sorted(int(entry.custom_id) for entry in entries) == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_bulk_send_async_iterable(cs_client, mocker):
+    rq = coresender.SendEmail(client=cs_client)
+
+    async def send(*, data):
+        return _api_response(mocker, 200, data)
+
+    mocker.patch.object(rq, 'send', side_effect=send)
+
+    async def messages():
+        for message in _message_specs(5):
+            yield message
+
+    entries = [entry async for entry in rq.bulk_send(messages(), batch_size=2)]
+
+    assert rq.send.await_count == 3
+    assert len(entries) == 5
+
+
+def _coalesced_send(cs_client, mocker, invalid_email=None):
+    cs_client.context.coalesce_window = 0.01
+    batches = []
+
+    async def send(method, url, data, options):
+        emails = list(data)
+        batches.append(len(emails))
+        if any(email.to[0].email == invalid_email for email in emails):
+            raise coresender.errors.ValidationError('VALIDATION_ERROR', 'field to: invalid', 422)
+        rsp = mocker.MagicMock()
+        rsp.status_code = 200
+        rsp.data = {'data': [
+            {'message_id': email.to[0].email, 'custom_id': None, 'status': 'accepted', 'errors': None}
+            for email in emails
+        ]}
+        return rsp
+
+    mocker.patch.object(cs_client, 'send', side_effect=send)
+    return batches
+
+
+def _simple_emails(cs_client, count):
+    rq = coresender.SendEmail(client=cs_client)
+    return [
+        rq.simple_email(from_email='from@example.com', to_email='to%d@example.com' % idx, subject='test', body='test')
+        for idx in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_simple_email_coalesced(cs_client, mocker):
+    batches = _coalesced_send(cs_client, mocker)
+
+    entries = await asyncio.gather(*_simple_emails(cs_client, 5))
+
+    assert batches == [5]
+    assert [entry.message_id for entry in entries] == ['to%d@example.com' % idx for idx in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_simple_email_coalesced_max_batch(cs_client, mocker):
+    batches = _coalesced_send(cs_client, mocker)
+    cs_client.context.coalesce_max_batch = 2
+
+    entries = await asyncio.gather(*_simple_emails(cs_client, 5))
+
+    assert batches == [2, 2, 1]
+    assert len(entries) == 5
+
+
+@pytest.mark.asyncio
+async def test_simple_email_coalesced_errors(cs_client, mocker):
+    batches = _coalesced_send(cs_client, mocker, invalid_email='to2@example.com')
+
+    results = await asyncio.gather(*_simple_emails(cs_client, 4), return_exceptions=True)
+
+    # the rejected batch is split until the invalid email is alone
+    assert batches == [4, 2, 2, 1, 1]
+    assert isinstance(results[2], coresender.errors.ValidationError)
+    assert [entry.message_id for idx, entry in enumerate(results) if idx != 2] == ['to0@example.com', 'to1@example.com', 'to3@example.com']
+
+
+def _outcome_response(mocker, statuses, emails):
+    rsp = mocker.MagicMock()
+    rsp.status_code = 200
+    rsp.data = {'data': [
+        {'message_id': None if status != 'accepted' else str(idx), 'custom_id': email.custom_id, 'status': status, 'errors': errors}
+        for idx, (email, (status, errors)) in enumerate(zip(emails, statuses))
+    ]}
+    return rsp
+
+
+_classifier = coresender.responses.OutcomeClassifier(transient_statuses=('deferred', ), transient_error_codes=('TOO_MANY_REQUESTS', ))
+
+
+def test_classify():
+    Outcome = coresender.responses.Outcome
+
+    assert _classifier.classify('accepted', None) is Outcome.accepted
+    assert _classifier.classify('rejected', 'Recipient rejected') is Outcome.rejected
+    assert _classifier.classify('deferred', None) is Outcome.transient
+    assert _classifier.classify('rejected', [{'code': 'TOO_MANY_REQUESTS', 'description': 'Rate limit'}]) is Outcome.transient
+    # free-form descriptions are not matched
+    assert _classifier.classify('rejected', 'Too many requests, internal error') is Outcome.rejected
+
+    # unknown statuses are rejected unless they are known to be transient
+    default = coresender.responses.default_classifier
+    assert default.classify('deferred', None) is Outcome.rejected
+    assert default.classify('failed', 'Internal error') is Outcome.rejected
+
+
+@pytest.mark.asyncio
+async def test_get_messages(cs_client, mocker):
+    rq = coresender.SendEmail(client=cs_client)
+    _add_emails(rq, 4)
+    emails = list(rq._emails)
+    statuses = [('accepted', None), ('rejected', 'Recipient rejected'), ('deferred', None), ('accepted', None)]
+    mocker.patch.object(rq, 'send', return_value=_outcome_response(mocker, statuses, emails))
+
+    rsp = await rq.execute()
+
+    assert not rsp.all_accepted
+    assert [entry.custom_id for entry in rsp.accepted] == ['0', '3']
+    assert rsp.get_messages(coresender.responses.Outcome.rejected, _classifier) == [emails[1]]
+    assert rsp.get_messages(coresender.responses.Outcome.transient, _classifier) == [emails[2]]
+    assert rsp.get_messages(coresender.responses.Outcome.rejected) == [emails[1], emails[2]]
+
+    # entries out of order are matched by custom_id
+    rsp.entries.reverse()
+    assert rsp.get_messages(coresender.responses.Outcome.transient, _classifier) == [emails[2]]
+
+    rsp.messages = None
+    with pytest.raises(coresender.errors.CoresenderError):
+        rsp.get_messages(coresender.responses.Outcome.transient, _classifier)
+
+
+@pytest.mark.asyncio
+async def test_accepted_by_classifier(cs_client, mocker):
+    rq = coresender.SendEmail(client=cs_client)
+    _add_emails(rq, 3)
+    emails = list(rq._emails)
+    send = mocker.patch.object(rq, 'send', return_value=_outcome_response(
+        mocker, [('accepted', None), ('queued', None), ('deferred', None)], emails))
+    events = []
+    cs_client.context.trace_hook = lambda event, fields: events.append((event, fields))
+    classifier = coresender.responses.OutcomeClassifier(accepted_statuses=('accepted', 'queued'), transient_statuses=('deferred', ))
+
+    rsp = await rq.execute()
+    assert not rsp.is_all_accepted(classifier)
+
+    send.return_value = _outcome_response(mocker, [('queued', None)], [emails[2]])
+    retry_rsp = await rq.resubmit(rsp, classifier=classifier)
+    assert not retry_rsp.all_accepted
+    assert retry_rsp.is_all_accepted(classifier)
+
+    # counted by the default classifier, unless the request is given one
+    assert [fields['accepted'] for event, fields in events if event == 'batch'] == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_resubmit(cs_client, mocker):
+    rq = coresender.SendEmail(client=cs_client)
+    _add_emails(rq, 5)
+    sent = []
+    deferred = {'1', '4'}
+
+    async def send(*, data):
+        sent.append([email.custom_id for email in data])
+        if deferred & {email.custom_id for email in data} and len(sent) <= 3:
+            statuses = [('deferred', None) if email.custom_id in deferred else ('accepted', None) for email in data]
+        else:
+            statuses = [('accepted', None)] * len(data)
+        return _outcome_response(mocker, statuses, data)
+
+    mocker.patch.object(rq, 'send', side_effect=send)
+
+    rsp = await rq.execute(chunk_size=2)
+    assert [entry.custom_id for entry in rsp.get_entries(coresender.responses.Outcome.transient, _classifier)] == ['1', '4']
+
+    retry_rsp = await rq.resubmit(rsp, classifier=_classifier)
+
+    # only the transient failures are sent again
+    assert sent[-1] == ['1', '4']
+    assert retry_rsp.all_accepted
+    assert not (await rq.resubmit(retry_rsp, classifier=_classifier)).entries
+    assert len(sent) == 4
+
+
+@pytest.mark.asyncio
+async def test_coalescer_does_not_keep_client(cs_ctx, mocker):
+    client = CoresenderClient(cs_ctx)
+    _get_coalescer(client)
+    client_ref = weakref.ref(client)
+
+    del client
+    gc.collect()
+
+    assert client_ref() is None
+    assert not any(coalescer._client() is None for coalescer in _coalescers.values())
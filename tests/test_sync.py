@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+import pytest
+
+import coresender
+from coresender import sync
+from coresender.requests.core import CoresenderClient
+
+
+@pytest.fixture
+def loop_thread():
+    yield sync._loop_thread
+    sync._loop_thread.stop()
+
+
+async def _get_loop():
+    return asyncio.get_event_loop()
+
+
+def test_run_reuses_event_loop(loop_thread):
+    first = sync.run(_get_loop())
+    second = sync.run(_get_loop())
+
+    assert first is second
+    assert first is not asyncio.new_event_loop()
+
+
+def test_iterate():
+    async def numbers():
+        for i in range(3):
+            yield i
+
+    assert list(sync.iterate(numbers())) == [0, 1, 2]
+
+
+def test_execute_sync_reuses_connection_pool(cs_ctx, loop_thread, mocker):
+    mocker.patch('coresender.requests.core.get_context', return_value=cs_ctx)
+    rsp = mocker.MagicMock()
+    rsp.status_code = 200
+    rsp.content = json.dumps({'data': [
+        {'message_id': '1', 'custom_id': None, 'status': 'accepted', 'errors': None},
+    ]}).encode()
+    http_class = mocker.patch('httpx.AsyncClient')
+    http_class.return_value.request = mocker.AsyncMock(return_value=rsp)
+    http_class.return_value.aclose = mocker.AsyncMock()
+
+    cl = CoresenderClient(cs_ctx)
+    mocker.patch.object(coresender.SendEmail, '_client', cl)
+
+    for _ in range(3):
+        entry = coresender.SendEmail().simple_email_sync(from_email='from@example.com', to_email='to@example.com', subject='test', body='test')
+        assert entry.message_id == '1'
+
+    http_class.assert_called_once()
+    assert http_class.return_value.request.await_count == 3
+
+    sync.run(cl.aclose())
+    http_class.return_value.aclose.assert_awaited_once()
+
+
+def test_close(loop_thread):
+    loop = sync.run(_get_loop())
+    thread = loop_thread._thread
+
+    sync.close()
+
+    assert loop.is_closed()
+    assert not thread.is_alive()
@@ -0,0 +1,111 @@
+import asyncio
+import datetime
+import threading
+
+import pytest
+
+from coresender import token as cs_token
+from coresender.context import CoresenderContext
+from coresender.requests.core import CoresenderClient
+
+
+def _get_token(access_token='access'):
+    token = cs_token.OAuth2Token()
+    token.access_token = access_token
+    token.refresh_token = 'refresh'
+    token.token_type = 'Bearer'
+    token.expires_on = datetime.datetime.now() + datetime.timedelta(hours=1)
+    return token
+
+
+def test_get_storage_handler():
+    assert cs_token.get_storage_handler('file') is cs_token.OAuth2TokenFileStorage
+
+
+def test_file_storage_save_and_read(tmp_path):
+    storage = cs_token.OAuth2TokenFileStorage({'path': str(tmp_path / 'token')})
+    assert storage.read() is None
+
+    storage.save(_get_token())
+
+    assert [item.name for item in tmp_path.iterdir()] == ['token']
+    assert cs_token.OAuth2TokenFileStorage({'path': str(tmp_path / 'token')}).read().access_token == 'access'
+
+
+def test_file_storage_read_is_cached_by_mtime(tmp_path, mocker):
+    path = tmp_path / 'token'
+    cs_token.OAuth2TokenFileStorage({'path': str(path)}).save(_get_token())
+
+    storage = cs_token.OAuth2TokenFileStorage({'path': str(path)})
+    json_load = mocker.spy(cs_token.json, 'load')
+
+    assert storage.read().access_token == 'access'
+    assert storage.read().access_token == 'access'
+    assert json_load.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_file_storage_async(tmp_path):
+    storage = cs_token.OAuth2TokenFileStorage({'path': str(tmp_path / 'token')})
+    assert await storage.aread() is None
+
+    await storage.asave(_get_token('async'))
+
+    assert (await storage.aread()).access_token == 'async'
+
+
+@pytest.mark.parametrize('storage_name', ['locked_file', 'sqlite'])
+def test_shared_storage_save_and_read(tmp_path, storage_name):
+    storage_class = cs_token.get_storage_handler(storage_name)
+    storage = storage_class({'path': str(tmp_path / 'token')})
+    assert storage.read() is None
+
+    storage.save(_get_token())
+
+    assert storage_class({'path': str(tmp_path / 'token')}).read().access_token == 'access'
+
+
+@pytest.mark.parametrize('storage_name', ['locked_file', 'sqlite'])
+def test_shared_storage_lock_is_exclusive(tmp_path, storage_name):
+    storage_class = cs_token.get_storage_handler(storage_name)
+    first = storage_class({'path': str(tmp_path / 'token')})
+    second = storage_class({'path': str(tmp_path / 'token')})
+
+    events = []
+    first.acquire_lock()
+    thread = threading.Thread(target=lambda: (second.acquire_lock(), events.append('second'), second.release_lock()))
+    thread.start()
+
+    thread.join(0.2)
+    events.append('first')
+    first.save(_get_token())
+    first.release_lock()
+    thread.join()
+
+    assert events == ['first', 'second']
+
+
+@pytest.mark.asyncio
+async def test_shared_storage_elects_single_refresher(tmp_path, cs_ctx, mocker):
+    mocker.patch('coresender.requests.core.get_context', return_value=cs_ctx)
+
+    clients = []
+    for _ in range(3):
+        ctx = CoresenderContext()
+        ctx.token = _get_token('old')
+        ctx.token_auto_refresh = False
+        ctx.token_storage_handler = cs_token.OAuth2TokenSQLiteStorage({'path': str(tmp_path / 'token')})
+        clients.append(CoresenderClient(ctx))
+
+    rsp = mocker.MagicMock()
+    rsp.data = {
+        'access_token': 'new', 'refresh_token': 'refresh', 'token_type': 'Bearer', 'expires_in': 3600,
+    }
+    send = mocker.AsyncMock(return_value=rsp)
+    for cl in clients:
+        mocker.patch.object(cl, 'send', send)
+
+    await asyncio.gather(*[cl.refresh_token() for cl in clients])
+
+    assert send.await_count == 1
+    assert [cl._ctx.token.access_token for cl in clients] == ['new', 'new', 'new']
@@ -0,0 +1,120 @@
+import pytest
+
+import coresender
+from coresender.message import Message, MessageTemplate, Recipient
+from coresender.validation import BatchValidator, Strictness
+
+
+def _message(to='to@example.com', **kwargs):
+    kwargs.setdefault('subject', 'test')
+    return Message(kwargs.pop('from_email', 'from@example.com'), [Recipient(to)], **kwargs)
+
+
+def test_standard():
+    messages = [
+        _message(),
+        _message('not an address'),
+        _message(subject='test\r\nBcc: victim@example.com'),
+        Message('from@example.com', [Recipient('to%d@example.com' % idx) for idx in range(3)]),
+        _message(body_text='x' * 101),
+        _message(custom_id='1', custom_id_unique=True),
+        _message(custom_id='1', custom_id_unique=True),
+        _message(custom_id='1'),
+    ]
+
+    valid, invalid = BatchValidator(max_recipients=2, max_body_bytes=100).validate(messages)
+
+    assert valid == [messages[0], messages[5], messages[7]]
+    assert [message.index for message in invalid] == [1, 2, 3, 4, 6]
+    assert invalid[0].errors == ['to: invalid address not an address']
+    assert invalid[1].errors == ['subject: line breaks are not allowed']
+    assert invalid[2].errors == ['to: 3 recipients, at most 2 allowed']
+    assert invalid[3].errors == ['body: 101 bytes, at most 100 allowed']
+    assert invalid[4].errors == ['custom_id 1 is not unique in the batch']
+
+
+@pytest.mark.parametrize('address, lenient, standard, strict', [
+    ('user@example.com', True, True, True),
+    ('first.last+tag@mail.example.co.uk', True, True, True),
+    ('user@localhost', True, False, False),
+    ('first..last@example.com', True, True, False),
+    ('user@-example.com', True, True, False),
+    ('%s@example.com' % ('a' * 65), True, True, False),
+    ('user@exa mple.com', True, False, False),
+])
+def test_address_syntax(address, lenient, standard, strict):
+    for strictness, expected in ((Strictness.lenient, lenient), (Strictness.standard, standard), (Strictness.strict, strict)):
+        valid, _ = BatchValidator(strictness=strictness).validate([_message(address)])
+        assert bool(valid) is expected, strictness
+
+
+def test_lenient_checks_presence_only():
+    valid, invalid = BatchValidator(strictness='lenient').validate([_message(subject='a\nb'), _message(from_email=None)])
+
+    assert len(valid) == 1
+    assert invalid[0].errors == ['from: no address specified']
+
+
+def test_template_is_checked_once(mocker):
+    template = MessageTemplate(from_email='from@example.com', subject='test', body_text='Hello')
+    messages = [Message(None, [Recipient('to%d@example.com' % idx)], template=template) for idx in range(10)]
+    validator = BatchValidator()
+    check_shared = mocker.spy(validator, '_check_shared')
+
+    valid, invalid = validator.validate(messages)
+
+    assert len(valid) == 10
+    assert check_shared.call_count == 1
+
+
+def _mock_send(cs_client, mocker):
+    async def send(method, url, data, options):
+        rsp = mocker.MagicMock()
+        rsp.status_code = 200
+        rsp.data = {'data': [
+            {'message_id': str(idx), 'custom_id': email.custom_id, 'status': 'accepted', 'errors': None}
+            for idx, email in enumerate(data)
+        ]}
+        return rsp
+
+    return mocker.patch.object(cs_client, 'send', side_effect=send)
+
+
+@pytest.mark.asyncio
+async def test_execute_rejects_invalid_batch(cs_client, mocker):
+    send = _mock_send(cs_client, mocker)
+    rq = coresender.SendEmail(client=cs_client)
+    rq.add_to_batch(from_email='from@example.com', to_email='to@example.com', custom_id='0')
+    rq.add_to_batch(from_email='from@example.com', to_email='invalid', custom_id='1')
+
+    with pytest.raises(coresender.errors.BatchValidationError) as exc_info:
+        await rq.execute(validator=BatchValidator())
+
+    assert [message.index for message in exc_info.value.invalid] == [1]
+    assert len(rq._emails) == 2
+    send.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_execute_skips_invalid_messages(cs_client, mocker):
+    send = _mock_send(cs_client, mocker)
+    rq = coresender.SendEmail(client=cs_client)
+    rq.add_to_batch(from_email='from@example.com', to_email='to@example.com', custom_id='0')
+    rq.add_to_batch(from_email='from@example.com', to_email='invalid', custom_id='1')
+
+    rsp = await rq.execute(validator=BatchValidator(), skip_invalid=True)
+
+    assert [entry.custom_id for entry in rsp] == ['0']
+    assert [message.message.custom_id for message in rsp.invalid] == ['1']
+    assert len(send.call_args.args[2]) == 1
+
+
+def test_validate_batch():
+    rq = coresender.SendEmail()
+    rq.add_to_batch(from_email='from@example.com', to_email='invalid')
+    rq.add_to_batch(from_email='from@example.com', to_email='to@example.com')
+
+    invalid = rq.validate_batch()
+
+    assert len(invalid) == 1
+    assert [email.to[0].email for email in rq._emails] == ['to@example.com']